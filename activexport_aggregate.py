@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Single-pass activity aggregation
+Totals, per-sport figures, date range and yearly/monthly/weekly rollups,
+computed in one pass and shared by the analysis and the Markdown export
+"""
+
+from datetime import datetime, timezone
+
+
+def new_totals():
+    """Returns empty totals"""
+    return {'count': 0, 'distance': 0.0, 'elevation': 0.0, 'moving_time': 0}
+
+
+def _accumulate(totals, distance, elevation, moving_time):
+    """Adds one activity to totals"""
+    totals['count'] += 1
+    totals['distance'] += distance
+    totals['elevation'] += elevation
+    totals['moving_time'] += moving_time
+
+
+class ActivityAggregator:
+    """
+    Accumulates activity statistics in a single pass
+    Can be fed a whole list or incrementally, page by page, from a stream
+    """
+
+    def __init__(self):
+        self.totals = new_totals()
+        self.sports = {}
+        self.by_year = {}
+        self.by_month = {}
+        self.by_week = {}
+        self.first_epoch = None
+        self.last_epoch = None
+
+    @property
+    def count(self):
+        return self.totals['count']
+
+    @property
+    def first_date(self):
+        """Start date of the first activity (UTC), None if empty"""
+        if self.first_epoch is None:
+            return None
+        return datetime.fromtimestamp(self.first_epoch, timezone.utc)
+
+    @property
+    def last_date(self):
+        """Start date of the last activity (UTC), None if empty"""
+        if self.last_epoch is None:
+            return None
+        return datetime.fromtimestamp(self.last_epoch, timezone.utc)
+
+    def add(self, record):
+        """Adds one activity record (see activexport_records)"""
+        distance = record.distance
+        elevation = record.elevation
+        moving_time = record.moving_time
+
+        _accumulate(self.totals, distance, elevation, moving_time)
+        _accumulate(self.sports.setdefault(record.sport_type, new_totals()),
+                    distance, elevation, moving_time)
+
+        epoch = record.start_epoch
+        if self.first_epoch is None or epoch < self.first_epoch:
+            self.first_epoch = epoch
+        if self.last_epoch is None or epoch > self.last_epoch:
+            self.last_epoch = epoch
+
+        date = record.start
+        iso_year, iso_week, _ = date.isocalendar()
+        for rollup, key in ((self.by_year, f'{date.year}'),
+                            (self.by_month, f'{date.year}-{date.month:02d}'),
+                            (self.by_week, f'{iso_year}-W{iso_week:02d}')):
+            _accumulate(rollup.setdefault(key, new_totals()), distance, elevation, moving_time)
+
+    def add_many(self, records):
+        """Adds a list (or page) of activity records"""
+        for record in records:
+            self.add(record)
+        return self
+
+    def sports_by_count(self):
+        """Returns (sport, totals) pairs, most frequent first"""
+        return sorted(self.sports.items(), key=lambda x: x[1]['count'], reverse=True)
+
+
+def aggregate(records):
+    """Aggregates a list of activity records in a single pass"""
+    return ActivityAggregator().add_many(records)
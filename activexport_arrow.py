@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Parquet and Arrow IPC (Feather) export (optional, requires pyarrow)
+Typed columnar files written in row-group batches, so they can be streamed
+from the fetch pipeline
+"""
+
+import os
+from activexport_output import format_size, temp_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+HAS_PYARROW = pa is not None
+
+# Activities buffered before a row group / record batch is written
+ROW_GROUP_SIZE = 10000
+
+if HAS_PYARROW:
+    SCHEMA = pa.schema([
+        ('id', pa.int64()),
+        ('name', pa.string()),
+        ('sport_type', pa.dictionary(pa.int32(), pa.string())),
+        ('start_date', pa.timestamp('s', tz='UTC')),
+        ('distance', pa.float64()),
+        ('moving_time', pa.int32()),
+        ('elapsed_time', pa.int32()),
+        ('total_elevation_gain', pa.float64()),
+        ('average_heartrate', pa.float64()),
+        ('max_heartrate', pa.float64()),
+        ('gear_id', pa.string()),
+    ])
+
+
+def record_batch(records, sports):
+    """
+    Builds an Arrow record batch from activity records (see activexport_records)
+    sports maps sport types to dictionary codes; it only grows, so successive
+    batches share the same dictionary (IPC files only accept dictionary deltas)
+    """
+    codes = [sports.setdefault(r.sport_type, len(sports)) for r in records]
+    sport_type = pa.DictionaryArray.from_arrays(
+        pa.array(codes, pa.int32()), pa.array(list(sports), pa.string()))
+
+    return pa.RecordBatch.from_arrays([
+        pa.array([r.id for r in records], pa.int64()),
+        pa.array([r.name for r in records], pa.string()),
+        sport_type,
+        pa.array([r.start_epoch for r in records], pa.timestamp('s', tz='UTC')),
+        pa.array([r.distance for r in records], pa.float64()),
+        pa.array([r.moving_time for r in records], pa.int32()),
+        pa.array([r.elapsed_time for r in records], pa.int32()),
+        pa.array([r.elevation for r in records], pa.float64()),
+        pa.array([r.average_heartrate for r in records], pa.float64()),
+        pa.array([r.max_heartrate for r in records], pa.float64()),
+        pa.array([r.gear_id for r in records], pa.string()),
+    ], schema=SCHEMA)
+
+
+class _BatchedWriter:
+    """Buffers records and writes them in batches of ROW_GROUP_SIZE"""
+
+    label = None
+
+    def __init__(self, filepath, row_group_size=ROW_GROUP_SIZE):
+        if not HAS_PYARROW:
+            raise ImportError("pyarrow is required for Parquet/Feather export (pip install pyarrow)")
+        self.filepath = filepath
+        self.tmp_path = temp_path(filepath)
+        self.row_group_size = row_group_size
+        self.buffer = []
+        self.sports = {}
+        self.count = 0
+        self.writer = self._open()
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _close_writer(self):
+        self.writer.close()
+
+    def _flush(self):
+        if self.buffer:
+            self.writer.write_batch(record_batch(self.buffer, self.sports))
+            self.buffer = []
+
+    def write_page(self, records):
+        self.buffer.extend(records)
+        self.count += len(records)
+        if len(self.buffer) >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        """Completes the file and renames it into place"""
+        self._flush()
+        self._close_writer()
+        os.replace(self.tmp_path, self.filepath)
+        print(f"[OK] {self.label} exported to: {self.filepath}")
+        print(f"     File size: {format_size(os.path.getsize(self.filepath))}")
+
+    def discard(self):
+        """Drops a partial export"""
+        try:
+            self._close_writer()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+class ParquetStreamWriter(_BatchedWriter):
+    """Streaming Parquet writer, one row group per batch"""
+
+    label = 'Parquet'
+
+    def _open(self):
+        return pq.ParquetWriter(self.tmp_path, SCHEMA, compression='zstd')
+
+
+class FeatherStreamWriter(_BatchedWriter):
+    """Streaming Arrow IPC file (Feather v2) writer, one record batch per batch"""
+
+    label = 'Feather'
+
+    def _open(self):
+        self.sink = pa.OSFile(self.tmp_path, 'wb')
+        options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        return pa.ipc.new_file(self.sink, SCHEMA, options=options)
+
+    def _close_writer(self):
+        self.writer.close()
+        self.sink.close()
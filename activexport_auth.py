@@ -7,12 +7,22 @@ Handles initial authorization and automatic token refresh
 import os
 import json
 import time
+import threading
 import webbrowser
+from contextlib import contextmanager
 from urllib.parse import urlencode
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-import requests
 from dotenv import load_dotenv
+from activexport_client import api_get, http_post
+from activexport_metrics import metrics
+from activexport_ratelimit import rate_limiter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 # Load environment variables
 load_dotenv()
@@ -22,9 +32,13 @@ CLIENT_SECRET = os.getenv('STRAVA_CLIENT_SECRET')
 REDIRECT_URI = 'http://localhost:8000/callback'
 TOKEN_FILE = 'activexport_tokens.json'
 
-# Strava endpoints
-AUTH_URL = 'https://www.strava.com/oauth/authorize'
-TOKEN_URL = 'https://www.strava.com/oauth/token'
+# Tokens are refreshed this long (seconds) before they expire
+REFRESH_MARGIN = 300
+
+# Strava endpoints (OAuth base overridable, see activexport_mockserver)
+OAUTH_BASE = os.getenv('ACTIVEXPORT_OAUTH_BASE', 'https://www.strava.com/oauth')
+AUTH_URL = f'{OAUTH_BASE}/authorize'
+TOKEN_URL = f'{OAUTH_BASE}/token'
 
 
 class CallbackHandler(BaseHTTPRequestHandler):
@@ -78,7 +92,7 @@ def exchange_code_for_token(auth_code):
         'grant_type': 'authorization_code'
     }
 
-    response = requests.post(TOKEN_URL, data=payload)
+    response = http_post(TOKEN_URL, payload)
     response.raise_for_status()
     return response.json()
 
@@ -92,52 +106,159 @@ def refresh_access_token(refresh_token):
         'grant_type': 'refresh_token'
     }
 
-    response = requests.post(TOKEN_URL, data=payload)
+    response = http_post(TOKEN_URL, payload)
     response.raise_for_status()
     return response.json()
 
 
-def save_tokens(token_data):
-    """Saves tokens to JSON file"""
-    with open(TOKEN_FILE, 'w') as f:
+def save_tokens(token_data, token_file=TOKEN_FILE):
+    """
+    Saves tokens to JSON file
+    Written to a temporary file then renamed, so readers never see a partial file
+    """
+    tmp_file = f'{token_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
         json.dump(token_data, f, indent=2)
-    print(f"Tokens saved to {TOKEN_FILE}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, token_file)
+    print(f"Tokens saved to {token_file}")
 
 
-def load_tokens():
+def load_tokens(token_file=TOKEN_FILE):
     """Loads tokens from JSON file"""
-    if not os.path.exists(TOKEN_FILE):
+    if not os.path.exists(token_file):
         return None
 
-    with open(TOKEN_FILE, 'r') as f:
+    with open(token_file, 'r') as f:
         return json.load(f)
 
 
+@contextmanager
+def file_lock(lock_file):
+    """Exclusive lock on a lock file, held across processes"""
+    with open(lock_file, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds, keep waiting
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TokenProvider:
+    """
+    Keeps tokens in memory until shortly before they expire
+    Refreshes are serialized across threads (lock) and processes (lock file):
+    the first worker refreshes, the others pick up the new token from the file
+    """
+
+    def __init__(self, token_file=TOKEN_FILE):
+        self.token_file = token_file
+        self.lock_file = f'{token_file}.lock'
+        self.lock = threading.Lock()
+        self.tokens = None
+
+    @staticmethod
+    def _is_valid(tokens):
+        return tokens is not None and time.time() < tokens['expires_at'] - REFRESH_MARGIN
+
+    def get_tokens(self):
+        """Returns valid tokens (refreshed if needed), None if not authenticated"""
+        with self.lock:
+            if self._is_valid(self.tokens):
+                return self.tokens
+
+            with file_lock(self.lock_file):
+                # Another process may have refreshed while we waited
+                tokens = load_tokens(self.token_file)
+                if tokens is None:
+                    return None
+
+                if not self._is_valid(tokens):
+                    print("Token expired, refreshing...")
+                    # Refresh responses do not include the athlete, keep the stored one
+                    tokens = {**tokens, **refresh_access_token(tokens['refresh_token'])}
+                    save_tokens(tokens, self.token_file)
+                    metrics.inc('token_refreshes_total')
+                    print("Token successfully refreshed")
+
+            self.tokens = tokens
+            return tokens
+
+    def get_access_token(self):
+        """Returns a valid access token, None if not authenticated"""
+        tokens = self.get_tokens()
+        return tokens['access_token'] if tokens else None
+
+    def reset(self):
+        """Forgets the in-memory tokens (e.g. after a new authentication)"""
+        with self.lock:
+            self.tokens = None
+
+
+# Shared provider for the default token file
+token_provider = TokenProvider()
+
+# Provider bound to the current thread (one athlete among several, see activexport_team)
+_context = threading.local()
+
+
+def bind_token_provider(provider):
+    """
+    Makes the current thread use another athlete's tokens
+    Also usable as a ThreadPoolExecutor initializer, so workers inherit it
+    """
+    _context.provider = provider
+
+
+def current_token_provider():
+    """Returns the provider bound to the current thread, the default one otherwise"""
+    return getattr(_context, 'provider', None) or token_provider
+
+
 def get_valid_access_token():
     """
     Returns a valid access token
     Automatically refreshes if expired
     """
-    tokens = load_tokens()
+    access_token = current_token_provider().get_access_token()
 
-    if not tokens:
+    if not access_token:
         print("[X] No token found. Run initial authentication first.")
         return None
 
-    # Check if token is expired (with 5 min margin)
-    if time.time() >= (tokens['expires_at'] - 300):
-        print("Token expired, refreshing...")
-        tokens = refresh_access_token(tokens['refresh_token'])
-        save_tokens(tokens)
-        print("Token successfully refreshed")
+    return access_token
+
 
-    return tokens['access_token']
+def get_athlete_id():
+    """Returns the authenticated athlete ID as a string ('default' if unknown)"""
+    provider = current_token_provider()
+    tokens = provider.tokens or load_tokens(provider.token_file) or {}
+    athlete = tokens.get('athlete') or {}
+    return str(athlete.get('id', 'default'))
 
 
-def initial_authentication():
+def initial_authentication(token_file=TOKEN_FILE, provider=None):
     """
     Initial authentication process
     Opens browser and starts local server to retrieve the code
+    The provider of token_file (default: the current thread's one) forgets
+    its in-memory tokens
     """
     print("\n" + "="*60)
     print("STRAVA AUTHENTICATION")
@@ -176,14 +297,15 @@ def initial_authentication():
         token_data = exchange_code_for_token(server.auth_code)
 
         # Save tokens
-        save_tokens(token_data)
+        save_tokens(token_data, token_file)
+        (provider or current_token_provider()).reset()
 
         print("="*60)
         print("AUTHENTICATION SUCCESSFUL!")
         print("="*60)
         print(f"\nAthlete: {token_data['athlete']['firstname']} {token_data['athlete']['lastname']}")
         print(f"Token expires at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(token_data['expires_at']))}")
-        print(f"\nTokens saved to: {TOKEN_FILE}")
+        print(f"\nTokens saved to: {token_file}")
         print("Tokens will be automatically refreshed when needed\n")
 
         return True
@@ -205,11 +327,9 @@ def test_api_connection():
         print("[X] Unable to get valid token")
         return False
 
-    headers = {'Authorization': f'Bearer {access_token}'}
-
     try:
         # Fetch athlete profile
-        response = requests.get('https://www.strava.com/api/v3/athlete', headers=headers)
+        response = api_get('/athlete', access_token)
         response.raise_for_status()
         athlete = response.json()
 
@@ -222,10 +342,11 @@ def test_api_connection():
         print(f"   Shoes: {athlete.get('shoes', [])}")
 
         # Count activities
-        response = requests.get('https://www.strava.com/api/v3/athlete/activities',
-                              headers=headers, params={'per_page': 1})
+        response = api_get('/athlete/activities', access_token, params={'per_page': 1})
+        headroom_15min, headroom_day = rate_limiter.headroom()
         print(f"\nAPI ready to fetch your activities!")
-        print(f"   Limits: 100 req/15min, 1000 req/day (read)")
+        print(f"   Limits: {rate_limiter.limit_15min} req/15min, {rate_limiter.limit_day} req/day (read)")
+        print(f"   Remaining: {headroom_15min} req (15 min), {headroom_day} req (day)")
 
         return True
 
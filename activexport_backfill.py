@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Date-sharded backfill
+First import of the full history: the history is split into time windows
+(before/after API parameters) fetched concurrently within the rate budget;
+a window that turns out to be dense is split again as its first page comes
+back, so the import takes a few round-trips instead of one per 200 activities
+"""
+
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+import requests
+from activexport_auth import bind_token_provider, current_token_provider, get_valid_access_token
+from activexport_checkpoint import CHECKPOINT_DIR, BackfillCheckpoint
+from activexport_client import api_get, configure_session
+from activexport_ratelimit import RateLimitExceeded, rate_limiter
+from activexport_records import parse_epoch
+from activexport_store import STORE_FILE, open_store, merge_activities, count_activities
+
+DEFAULT_WORKERS = 4
+
+# Windows per worker at the start; dense windows are split further
+WINDOWS_PER_WORKER = 2
+
+# Most windows a dense window is split into at once
+MAX_SPLIT = 8
+
+PAGE_SIZE = 200
+
+
+def fetch_window(window, page_size=PAGE_SIZE):
+    """
+    Fetches one page of activities started in a window (after, before, page),
+    bounds in epoch seconds, after included; pages are oldest first
+    """
+    after, before, page = window
+    access_token = current_token_provider().get_access_token()
+    response = api_get('/athlete/activities', access_token, params={
+        'after': after - 1,
+        'before': before,
+        'per_page': page_size,
+        'page': page,
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def find_oldest_start():
+    """Start epoch of the oldest activity, None if there is none (one request)"""
+    activities = fetch_window((1, int(time.time()) + 1, 1), page_size=1)
+    return parse_epoch(activities[0]['start_date']) if activities else None
+
+
+def split_range(after, before, parts):
+    """Splits [after, before) into parts windows of equal length"""
+    parts = max(min(parts, before - after), 1)
+    bounds = [after + (before - after) * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1], 1) for i in range(parts)]
+
+
+def next_windows(window, activities, page_size=PAGE_SIZE):
+    """
+    Windows left to fetch after the page of a window: none if the page was
+    not full, otherwise the rest of the window, split by the density observed
+    (activities started at the last second seen are fetched again, then
+    deduplicated by ID in the store)
+    """
+    after, before, page = window
+    if len(activities) < page_size:
+        return []
+
+    last = max(parse_epoch(activity['start_date']) for activity in activities)
+    if last <= after:
+        # A full page started within the same second: plain pagination
+        return [(after, before, page + 1)]
+
+    # Pages of page_size activities expected in the rest of the window
+    parts = math.ceil((before - last) / (last - after))
+    return split_range(last, before, min(parts, MAX_SPLIT))
+
+
+def _window_text(window):
+    after, before, _ = window
+    return (f"{datetime.fromtimestamp(after).strftime('%d/%m/%Y')} -> "
+            f"{datetime.fromtimestamp(before).strftime('%d/%m/%Y')}")
+
+
+def backfill_activities(store_file=STORE_FILE, workers=DEFAULT_WORKERS, resume=False,
+                        checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Fetches the full history into the local store, workers windows at a time
+    Stopped early (daily API limit, network error, or any other failure),
+    the windows left are saved in checkpoint_dir and continued with resume
+    Returns True if the whole history is stored
+    """
+    if not get_valid_access_token():
+        print("[X] Unable to get valid token")
+        return False
+
+    print("\n" + "="*60)
+    print("BACKFILLING ACTIVITY HISTORY")
+    print("="*60 + "\n")
+
+    start = time.perf_counter()
+    checkpoint = BackfillCheckpoint(directory=checkpoint_dir)
+    windows = checkpoint.open(resume)
+    request_count = 0
+
+    if windows:
+        print(f"[OK] Resuming: {len(windows)} windows left by the interrupted backfill\n")
+    else:
+        try:
+            oldest = find_oldest_start()
+            request_count += 1
+        except (RateLimitExceeded, requests.exceptions.RequestException) as e:
+            print(f"[X] {e}")
+            return False
+        if oldest is None:
+            print("[OK] No activities\n")
+            return True
+        windows = split_range(oldest, int(time.time()) + 1, workers * WINDOWS_PER_WORKER)
+        print(f"[OK] History since {datetime.fromtimestamp(oldest).strftime('%d/%m/%Y')}, "
+              f"{len(windows)} windows on {workers} workers\n")
+
+    configure_session(workers)
+    store = open_store(store_file)
+    stored_before = count_activities(store)
+    fetched = 0
+    left = []
+    futures = {}
+    error = None
+
+    try:
+        # Workers fetch with the tokens of the athlete bound to this thread (see activexport_team)
+        with ThreadPoolExecutor(max_workers=workers, initializer=bind_token_provider,
+                                initargs=(current_token_provider(),)) as executor:
+            futures = {executor.submit(fetch_window, window): window for window in windows}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window = futures.pop(future)
+                    try:
+                        activities = future.result()
+                        merge_activities(store, activities)
+                        following = next_windows(window, activities)
+                    except Exception as e:
+                        # The window is fetched again on resume (merging is idempotent)
+                        if error is None:
+                            error = e
+                            print(f"[X] {e}, stopping")
+                        left.append(window)
+                        continue
+
+                    request_count += 1
+                    fetched += len(activities)
+                    split = f", {len(following)} more window(s)" if following else ''
+                    print(f"[{_window_text(window)}] {len(activities)} activities{split}")
+
+                    if error is not None:
+                        left.extend(following)
+                        continue
+                    for next_window in following:
+                        futures[executor.submit(fetch_window, next_window)] = next_window
+    finally:
+        # Windows still in flight if the loop itself was interrupted
+        left.extend(futures.values())
+        if left:
+            checkpoint.save(left)
+        else:
+            checkpoint.complete()
+
+    added = count_activities(store) - stored_before
+    total = count_activities(store)
+    store.close()
+
+    print("\n" + "="*60)
+    print(f"TOTAL: {fetched} activities fetched, {added} new, {total} in store "
+          f"({time.perf_counter() - start:.1f}s)")
+    print(f"API requests used: {request_count}")
+    headroom_15min, headroom_day = rate_limiter.headroom()
+    print(f"Rate limit headroom: {headroom_15min} (15 min), {headroom_day} (day)")
+    print("="*60 + "\n")
+
+    if left:
+        print(f"[!] Backfill interrupted: {len(left)} windows left in {checkpoint.filepath}")
+        print("    Run again with --backfill --resume to continue from there\n")
+        return False
+    return True
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Offline benchmark
+Runs the fetch, export and batch detail code paths against the local mock
+API server (see activexport_mockserver) and reports throughput, export time
+per format, peak memory and API requests per activity
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+import requests
+import activexport_auth
+import activexport_client
+from activexport_arrow import HAS_PYARROW
+from activexport_auth import save_tokens, token_provider
+from activexport_cache import disable_cache
+from activexport_fetch_activities import fetch_all_records, save_activities
+from activexport_get_activity_details import DEFAULT_WORKERS, get_activities_details
+from activexport_mockserver import ATHLETE_ID, DEFAULT_ACTIVITIES
+from activexport_output import COMPRESSIONS, check_compression
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak memory is not reported
+    resource = None
+
+EXPORT_FORMATS = ['json', 'ndjson', 'csv', 'md'] + (['parquet', 'feather'] if HAS_PYARROW else [])
+DEFAULT_DETAILS = 200
+SERVER_START_TIMEOUT = 10
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (None if unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(args):
+    """
+    Starts the mock server in a separate process, so its CPU time and memory
+    are not counted in the measurements; returns (process, base URL)
+    """
+    port = free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            'activexport_mockserver.py'),
+               '-n', str(args.activities), '--port', str(port),
+               '--latency', str(args.latency), '--error-rate', str(args.error_rate)]
+    if args.rate_limit:
+        command += ['--rate-limit', args.rate_limit]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    base_url = f'http://localhost:{port}'
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        try:
+            requests.get(f'{base_url}/_mock/stats', timeout=1)
+            return process, base_url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Mock server did not start on port {port}")
+
+
+def server_requests(base_url):
+    """Total API requests served so far"""
+    return requests.get(f'{base_url}/_mock/stats', timeout=10).json()['total_requests']
+
+
+def use_server(base_url):
+    """Points the API client and the OAuth calls at the mock server"""
+    activexport_client.API_BASE = f'{base_url}/api/v3'
+    activexport_auth.TOKEN_URL = f'{base_url}/oauth/token'
+
+
+def quietly(verbose, function, *args, **kwargs):
+    """Calls a function, hiding its console output unless verbose"""
+    if verbose:
+        return function(*args, **kwargs)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        return function(*args, **kwargs)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def bench_fetch(base_url, verbose):
+    """Fetches the whole (mock) history as records"""
+    requests_before = server_requests(base_url)
+    start = time.perf_counter()
+    records = quietly(verbose, fetch_all_records, keep_raw=True)
+    elapsed = time.perf_counter() - start
+    api_requests = server_requests(base_url) - requests_before
+
+    return records, {
+        'activities': len(records),
+        'seconds': round(elapsed, 3),
+        'activities_per_second': round(len(records) / elapsed, 1) if elapsed else None,
+        'requests': api_requests,
+        'requests_per_activity': round(api_requests / len(records), 4) if records else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_exports(records, formats, output_dir, verbose, compress=None):
+    """Exports the records once per format"""
+    results = {}
+    for fmt in formats:
+        fmt_dir = os.path.join(output_dir, 'export', fmt)
+        start = time.perf_counter()
+        quietly(verbose, save_activities, records, [fmt], fmt_dir, compress=compress)
+        elapsed = time.perf_counter() - start
+        results[fmt] = {
+            'seconds': round(elapsed, 3),
+            'size_kb': round(directory_size(fmt_dir) / 1024, 1),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    return results
+
+
+def bench_details(base_url, activity_ids, output_dir, workers, streams, verbose):
+    """Fetches activity details (and streams) in batch mode"""
+    details_dir = os.path.join(output_dir, 'details')
+    streams_dir = os.path.join(output_dir, 'streams') if streams else None
+
+    requests_before = server_requests(base_url)
+    start = time.perf_counter()
+    fetched = quietly(verbose, get_activities_details, activity_ids, ['json'], details_dir,
+                      workers, streams_dir=streams_dir)
+    elapsed = time.perf_counter() - start
+    api_requests = server_requests(base_url) - requests_before
+
+    return {
+        'activities': fetched,
+        'workers': workers,
+        'streams': streams,
+        'seconds': round(elapsed, 3),
+        'activities_per_second': round(fetched / elapsed, 1) if elapsed else None,
+        'requests': api_requests,
+        'requests_per_activity': round(api_requests / fetched, 2) if fetched else None,
+        'streams_mb': round(directory_size(streams_dir) / (1024 * 1024), 1) if streams else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def format_mb(value):
+    return f'{value:.0f} MB' if value is not None else 'n/a'
+
+
+def display_results(results):
+    """Displays the benchmark report"""
+    fetch = results['fetch']
+    print("\n" + "="*60)
+    print("BENCHMARK RESULTS")
+    print("="*60 + "\n")
+    print(f"Fetch     {fetch['activities']} activities in {fetch['seconds']:.2f}s "
+          f"({fetch['activities_per_second']}/s), {fetch['requests']} requests "
+          f"({fetch['requests_per_activity']}/activity), peak RSS {format_mb(fetch['peak_rss_mb'])}")
+
+    for fmt, export in results['exports'].items():
+        print(f"Export    {fmt:8s} {export['seconds']:8.3f}s {export['size_kb']:10.0f} KB  "
+              f"peak RSS {format_mb(export['peak_rss_mb'])}")
+
+    details = results.get('details')
+    if details:
+        print(f"Details   {details['activities']} activities in {details['seconds']:.2f}s "
+              f"({details['activities_per_second']}/s, {details['workers']} workers), "
+              f"{details['requests']} requests ({details['requests_per_activity']}/activity), "
+              f"peak RSS {format_mb(details['peak_rss_mb'])}")
+        if details['streams']:
+            print(f"          streams: {details['streams_mb']} MB stored")
+    print("="*60 + "\n")
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark ActivExport against a local mock Strava API',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python activexport_bench.py                               # 1000 activities, all formats
+  python activexport_bench.py -n 100000 --details 0         # Fetch/export 100k activities
+  python activexport_bench.py --details 500 --streams -j 8  # Batch details with streams
+  python activexport_bench.py --latency 0.05 --error-rate 0.01
+  python activexport_bench.py --json bench.json             # Save results to compare runs
+  python activexport_bench.py --details 0 --compress gzip   # Time compressed exports
+        """
+    )
+
+    parser.add_argument('-n', '--activities', type=int, default=DEFAULT_ACTIVITIES,
+                        help=f'Number of synthetic activities (default: {DEFAULT_ACTIVITIES})')
+    parser.add_argument('-f', '--formats', nargs='+', default=EXPORT_FORMATS,
+                        choices=['json', 'ndjson', 'csv', 'md', 'parquet', 'feather'],
+                        help=f'Export formats to time (default: {" ".join(EXPORT_FORMATS)})')
+    parser.add_argument('--compress', choices=COMPRESSIONS,
+                        help='Compress the text exports (gzip, zstd, xz)')
+    parser.add_argument('--details', type=int, default=DEFAULT_DETAILS,
+                        help=f'Number of activity details to fetch, 0 to skip (default: {DEFAULT_DETAILS})')
+    parser.add_argument('--streams', action='store_true',
+                        help='Also download streams in the details benchmark')
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Concurrent requests for details (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Server delay per request, in seconds (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a 429 (default: 0)')
+    parser.add_argument('--rate-limit', type=str,
+                        help="Enforced '15min,daily' limits (default: unlimited)")
+    parser.add_argument('--server', type=str,
+                        help='Use an already running mock server (e.g. http://localhost:8010)')
+    parser.add_argument('--json', type=str, dest='json_file',
+                        help='Write the results to a JSON file')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the working directory (exports, streams) after the run')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show the output of the benchmarked scripts')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    args = parse_arguments()
+    if not check_compression(args.compress):
+        sys.exit(1)
+    json_file = os.path.abspath(args.json_file) if args.json_file else None
+
+    process = None
+    if args.server:
+        base_url = args.server.rstrip('/')
+    else:
+        process, base_url = start_mock_server(args)
+    use_server(base_url)
+
+    # Work in a scratch directory: tokens, cache and exports stay out of the project
+    work_dir = tempfile.mkdtemp(prefix='activexport_bench_')
+    os.chdir(work_dir)
+    disable_cache()
+
+    print(f"\n[OK] Mock API: {base_url}")
+    print(f"[OK] Working directory: {work_dir}{' (kept)' if args.keep else ''}")
+
+    try:
+        # An expired token: the first call exercises the refresh endpoint
+        quietly(args.verbose, save_tokens, {'access_token': 'bench', 'refresh_token': 'bench',
+                                            'expires_at': 0, 'athlete': {'id': ATHLETE_ID}})
+        token_provider.reset()
+
+        print(f"[...] Fetching {args.activities} activities")
+        records, fetch = bench_fetch(base_url, args.verbose)
+        results = {'date': datetime.now().isoformat(timespec='seconds'),
+                   'python': sys.version.split()[0], 'server': base_url, 'fetch': fetch}
+
+        print(f"[...] Exporting to {', '.join(args.formats)}")
+        results['exports'] = bench_exports(records, args.formats, work_dir, args.verbose, args.compress)
+
+        if args.details:
+            activity_ids = [record.id for record in records[:args.details]]
+            print(f"[...] Fetching {len(activity_ids)} activity details")
+            results['details'] = bench_details(base_url, activity_ids, work_dir, args.workers,
+                                               args.streams, args.verbose)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if not args.keep:
+            os.chdir(os.path.dirname(work_dir))
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    display_results(results)
+
+    if json_file:
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"[OK] Results saved to: {json_file}")
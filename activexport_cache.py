@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+ActivExport - On-disk API response cache
+Content-addressed cache of activity detail and athlete responses, with TTL,
+size-bounded LRU eviction and conditional revalidation (ETag / Last-Modified)
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlencode
+
+CACHE_DIR = os.getenv('ACTIVEXPORT_CACHE_DIR', '.activexport_cache')
+CACHE_ENABLED = os.getenv('ACTIVEXPORT_CACHE', '1') not in ('0', 'false', 'no')
+
+# Freshness: served without any request for this long, then revalidated
+# (any activity may be edited later: title, gear, privacy)
+CACHE_TTL = float(os.getenv('ACTIVEXPORT_CACHE_TTL', str(24 * 3600)))
+
+CACHE_MAX_BYTES = int(float(os.getenv('ACTIVEXPORT_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+# API paths whose responses are cached
+CACHEABLE_PATHS = re.compile(r'^/(activities/\d+|athlete)$')
+
+
+def cache_key(scope, path, params=None):
+    """Key of a response: SHA-256 of the athlete scope and the full request"""
+    request = path + ('?' + urlencode(sorted(params.items())) if params else '')
+    return hashlib.sha256(f'{scope}\n{request}'.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(path):
+    """True if responses of an API path (relative to the API base) are cached"""
+    return CACHEABLE_PATHS.match(path) is not None
+
+
+class CacheEntry:
+    """A cached response: body plus validators"""
+
+    __slots__ = ('body', 'stored_at', 'etag', 'last_modified')
+
+    def __init__(self, body, stored_at, etag=None, last_modified=None):
+        self.body = body
+        self.stored_at = stored_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) - self.stored_at < CACHE_TTL
+
+    def validators(self):
+        """Conditional request headers"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    One JSON file per response, under a two-level directory tree
+    File modification times track last use for LRU eviction
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def get(self, key):
+        """Returns the cached entry (None if absent or unreadable)"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(data['body'], data['stored_at'], data.get('etag'), data.get('last_modified'))
+
+    def put(self, key, body, etag=None, last_modified=None):
+        """Stores a response body (atomic write), then enforces the size bound"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({'stored_at': time.time(), 'etag': etag,
+                           'last_modified': last_modified, 'body': body}, ensure_ascii=False)
+
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self._scan_size()
+            else:
+                self.total_bytes += len(data.encode('utf-8')) - previous
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def touch(self, key):
+        """Marks an entry as revalidated (fresh again)"""
+        entry = self.get(key)
+        if entry is not None:
+            self.put(key, entry.body, entry.etag, entry.last_modified)
+        return entry
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def _scan_size(self):
+        return sum(os.path.getsize(path) for path in self._files())
+
+    def _evict(self):
+        """Removes least recently used entries down to 90% of the size bound"""
+        entries = []
+        for path in self._files():
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self.total_bytes = total
+
+    def clear(self):
+        """Removes every cached response"""
+        with self.lock:
+            for path in list(self._files()):
+                os.remove(path)
+            self.total_bytes = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the shared response cache (None when disabled)"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def disable_cache():
+    """Disables the response cache for this process"""
+    global CACHE_ENABLED
+    CACHE_ENABLED = False
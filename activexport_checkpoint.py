@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Checkpoints for long runs
+Durable progress of the activity list fetch (raw pages received so far) and
+of batch detail/stream jobs (activity IDs done), so an interrupted run can
+continue with --resume instead of starting over and re-spending API quota
+"""
+
+import os
+import json
+import hashlib
+from activexport_records import parse_epoch
+
+CHECKPOINT_DIR = 'activexport_checkpoints'
+
+
+def _sync(f):
+    """Flushes a file to disk so progress survives a crash"""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def checkpoint_key(*parts):
+    """Identifies a job (its inputs and options), so a checkpoint is only resumed by the same job"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class FetchCheckpoint:
+    """
+    Activity list fetch: every page is appended to an NDJSON file as soon as
+    it is received; the oldest activity saved is the cursor to resume from
+    (pages are fetched newest first)
+    """
+
+    def __init__(self, name='activities', directory=CHECKPOINT_DIR):
+        self.filepath = os.path.join(directory, f'{name}.ndjson')
+        self.file = None
+        self.count = 0
+        self.cursor = None
+        self.boundary_ids = set()
+
+    def _track(self, activity):
+        """Moves the cursor to the oldest activity saved"""
+        start_epoch = parse_epoch(activity['start_date'])
+        if self.cursor is None or start_epoch < self.cursor:
+            self.cursor = start_epoch
+            self.boundary_ids = set()
+        if start_epoch == self.cursor:
+            self.boundary_ids.add(activity['id'])
+        self.count += 1
+
+    def _load(self):
+        """Reads the saved activities; a torn last line (crash mid-write) is dropped"""
+        valid_size = 0
+        with open(self.filepath, 'rb') as f:
+            for line in f:
+                try:
+                    activity = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                self._track(activity)
+        with open(self.filepath, 'ab') as f:
+            f.truncate(valid_size)
+
+    def open(self, resume=False):
+        """
+        Continues the saved fetch if resume is set and one exists, otherwise
+        starts a new one
+        Returns the number of activities already saved
+        """
+        os.makedirs(os.path.dirname(self.filepath) or '.', exist_ok=True)
+        if os.path.exists(self.filepath):
+            if resume:
+                self._load()
+            else:
+                print("[!] Discarding the checkpoint of an interrupted fetch (use --resume to continue it)")
+                os.remove(self.filepath)
+        self.file = open(self.filepath, 'a', encoding='utf-8')
+        return self.count
+
+    def pages(self, page_size=200):
+        """Saved activities, in pages"""
+        page = []
+        with open(self.filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                page.append(json.loads(line))
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def record_page(self, activities):
+        """
+        Saves a page; activities already saved at the cursor (fetched again
+        when resuming) are dropped
+        Returns the new activities
+        """
+        activities = [activity for activity in activities if activity['id'] not in self.boundary_ids]
+        for activity in activities:
+            self.file.write(json.dumps(activity, ensure_ascii=False) + '\n')
+        _sync(self.file)
+        for activity in activities:
+            self._track(activity)
+        return activities
+
+    def close(self):
+        """Keeps the checkpoint for a later --resume"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def complete(self):
+        """The fetch reached the end: the checkpoint is no longer needed"""
+        self.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+class BatchCheckpoint:
+    """
+    Batch job over activity IDs (details, streams): IDs are appended to a
+    file as soon as they are done, after a first line holding the key of
+    the job (see checkpoint_key)
+    """
+
+    def __init__(self, key, name='details', directory=CHECKPOINT_DIR):
+        self.key = key
+        self.filepath = os.path.join(directory, f'{name}.ids')
+        self.file = None
+
+    def open(self, resume=False):
+        """
+        Continues the saved job if resume is set and one exists, otherwise
+        starts a new one
+        Returns the set of IDs (strings) already done, None if the saved job
+        is another one (other IDs or options: it is left untouched)
+        """
+        os.makedirs(os.path.dirname(self.filepath) or '.', exist_ok=True)
+        done = set()
+        if os.path.exists(self.filepath):
+            if resume:
+                with open(self.filepath, 'r', encoding='utf-8') as f:
+                    lines = [line.strip() for line in f if line.strip()]
+                if not lines or lines[0] != f'# {self.key}':
+                    print(f"[X] The checkpoint in {self.filepath} belongs to another batch "
+                          "(different activities or options), run without --resume to start over")
+                    return None
+                done = set(lines[1:])
+            else:
+                print("[!] Discarding the checkpoint of an interrupted batch (use --resume to continue it)")
+                os.remove(self.filepath)
+        self.file = open(self.filepath, 'a', encoding='utf-8')
+        if self.file.tell() == 0:
+            self.file.write(f'# {self.key}\n')
+            _sync(self.file)
+        return done
+
+    def mark_done(self, activity_id):
+        self.file.write(f'{activity_id}\n')
+        _sync(self.file)
+
+    def close(self):
+        """Keeps the checkpoint for a later --resume"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def complete(self):
+        """Every ID is done: the checkpoint is no longer needed"""
+        self.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+class BackfillCheckpoint:
+    """
+    Date-sharded backfill (see activexport_backfill): the time windows still
+    to fetch, saved when the backfill stops early
+    """
+
+    def __init__(self, name='backfill', directory=CHECKPOINT_DIR):
+        self.filepath = os.path.join(directory, f'{name}.json')
+
+    def exists(self):
+        return os.path.exists(self.filepath)
+
+    def open(self, resume=False):
+        """
+        Returns the windows left by an interrupted backfill if resume is set
+        and one exists, None otherwise (a new backfill starts)
+        """
+        if not self.exists():
+            return None
+        if not resume:
+            print("[!] Discarding the checkpoint of an interrupted backfill (use --resume to continue it)")
+            os.remove(self.filepath)
+            return None
+        with open(self.filepath, 'r', encoding='utf-8') as f:
+            return [tuple(window) for window in json.load(f)['windows']]
+
+    def save(self, windows):
+        """Saves the windows left (replaced atomically)"""
+        os.makedirs(os.path.dirname(self.filepath) or '.', exist_ok=True)
+        tmp_path = f'{self.filepath}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'windows': [list(window) for window in sorted(windows)]}, f)
+            _sync(f)
+        os.replace(tmp_path, self.filepath)
+
+    def complete(self):
+        """The whole history is fetched: the checkpoint is no longer needed"""
+        if self.exists():
+            os.remove(self.filepath)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Shared HTTP client
+Pooled keep-alive session used for every Strava API and OAuth call
+"""
+
+import os
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from activexport_cache import cache_key, is_cacheable, get_cache
+from activexport_metrics import metrics
+from activexport_ratelimit import rate_limiter
+
+load_dotenv()
+
+# Overridable to point the scripts at a local mock server (see activexport_mockserver)
+API_BASE = os.getenv('ACTIVEXPORT_API_BASE', 'https://www.strava.com/api/v3')
+
+# Connection pool and timeouts (overridable from .env / environment)
+POOL_SIZE = int(os.getenv('ACTIVEXPORT_POOL_SIZE', '10'))
+CONNECT_TIMEOUT = float(os.getenv('ACTIVEXPORT_CONNECT_TIMEOUT', '10'))
+READ_TIMEOUT = float(os.getenv('ACTIVEXPORT_READ_TIMEOUT', '60'))
+
+# Transport-level retries (5xx and connection resets) with jittered backoff
+MAX_RETRIES = int(os.getenv('ACTIVEXPORT_MAX_RETRIES', '3'))
+RETRY_BACKOFF = 0.5
+RETRY_JITTER = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+
+def _build_retry():
+    """Retry policy: idempotent requests only, never on 429 (handled by the rate limiter)"""
+    options = {
+        'total': MAX_RETRIES,
+        'connect': MAX_RETRIES,
+        'read': MAX_RETRIES,
+        'status': MAX_RETRIES,
+        'backoff_factor': RETRY_BACKOFF,
+        'status_forcelist': RETRY_STATUSES,
+        'allowed_methods': frozenset(['GET', 'HEAD']),
+        'respect_retry_after_header': False,
+        'raise_on_status': False,
+    }
+    try:
+        return Retry(backoff_jitter=RETRY_JITTER, **options)
+    except TypeError:
+        # urllib3 < 2.0 has no jitter support
+        return Retry(**options)
+
+
+def create_session(pool_size=POOL_SIZE):
+    """Creates a pooled keep-alive session with retries"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=_build_retry()
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+        'User-Agent': 'ActivExport/2.0'
+    })
+    return session
+
+
+def get_session():
+    """Returns the shared session (created on first use)"""
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+            _session_pool_size = POOL_SIZE
+        return _session
+
+
+def configure_session(pool_size=POOL_SIZE):
+    """
+    Sizes the shared session pool for concurrent workers
+    The session is only replaced if its pool is smaller, so jobs running
+    side by side (see activexport_team) never lose their connections
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is not None and _session_pool_size >= pool_size:
+            return _session
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_size)
+        _session_pool_size = pool_size
+        return _session
+
+
+def _cached_response(url, body):
+    """Builds a response object from a cached body"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(body).encode('utf-8')
+    response.from_cache = True
+    return response
+
+
+def api_get(path, access_token, params=None, cache_scope=None):
+    """
+    GET request on the Strava API, scheduled by the shared rate limiter
+    path may be relative to API_BASE ('/athlete') or a full URL
+    Retries after 429 once the rate limiter allows it
+    With a cache_scope (athlete), cacheable responses are served from the
+    on-disk cache while fresh, then revalidated (see activexport_cache)
+    """
+    url = path if path.startswith('http') else f'{API_BASE}{path}'
+    headers = {'Authorization': f'Bearer {access_token}'}
+    session = get_session()
+
+    cache = get_cache() if cache_scope is not None and is_cacheable(path) else None
+    entry = None
+    if cache is not None:
+        key = cache_key(cache_scope, path, params)
+        entry = cache.get(key)
+        if entry is not None and entry.is_fresh():
+            cache.hits += 1
+            metrics.inc('cache_requests_total', result='hit')
+            return _cached_response(url, entry.body)
+        if entry is not None:
+            headers.update(entry.validators())
+
+    while True:
+        rate_limiter.acquire()
+        start = time.perf_counter()
+        response = session.get(url, headers=headers, params=params,
+                               timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        metrics.observe_request(path, response, time.perf_counter() - start)
+        if response.status_code == 429:
+            rate_limiter.backoff(response)
+            continue
+        rate_limiter.update(response)
+        break
+
+    if cache is not None:
+        if response.status_code == 304 and entry is not None:
+            cache.revalidated += 1
+            metrics.inc('cache_requests_total', result='revalidated')
+            cache.touch(key)
+            return _cached_response(url, entry.body)
+        if response.status_code == 200:
+            cache.misses += 1
+            metrics.inc('cache_requests_total', result='miss')
+            cache.put(key, response.json(), response.headers.get('ETag'),
+                      response.headers.get('Last-Modified'))
+    return response
+
+
+def http_post(url, data):
+    """POST request through the shared session (OAuth token endpoint)"""
+    return get_session().post(url, data=data, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
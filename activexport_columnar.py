@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Columnar training statistics (optional, requires numpy)
+Loads activity records into NumPy arrays and computes weekly/monthly/yearly
+volume per sport, rolling 7/28-day load and year-over-year comparisons
+"""
+
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+
+SECONDS_PER_DAY = 86400
+
+
+class ColumnBuilder:
+    """
+    Accumulates activity records into compact typed arrays
+    Can be fed page by page from a stream, then turned into ActivityColumns
+    """
+
+    def __init__(self):
+        self.start_epoch = array('q')
+        self.distance = array('d')
+        self.moving_time = array('d')
+        self.elevation = array('d')
+        self.heartrate = array('d')
+        self.sport_code = array('H')
+        self.sports = {}
+
+    def add_many(self, records):
+        """Adds a list (or page) of activity records"""
+        for record in records:
+            code = self.sports.setdefault(record.sport_type, len(self.sports))
+            self.start_epoch.append(record.start_epoch)
+            self.distance.append(record.distance)
+            self.moving_time.append(record.moving_time)
+            self.elevation.append(record.elevation)
+            hr = record.average_heartrate
+            self.heartrate.append(hr if hr is not None else float('nan'))
+            self.sport_code.append(code)
+        return self
+
+    def build(self):
+        """Returns the NumPy columns"""
+        return ActivityColumns(
+            np.frombuffer(self.start_epoch, dtype=np.int64).copy(),
+            np.frombuffer(self.distance, dtype=np.float64).copy(),
+            np.frombuffer(self.moving_time, dtype=np.float64).copy(),
+            np.frombuffer(self.elevation, dtype=np.float64).copy(),
+            np.frombuffer(self.heartrate, dtype=np.float64).copy(),
+            np.frombuffer(self.sport_code, dtype=np.uint16).astype(np.int64),
+            sorted(self.sports, key=self.sports.get)
+        )
+
+
+class ActivityColumns:
+    """Activity summaries as NumPy arrays (one array per field)"""
+
+    def __init__(self, start_epoch, distance, moving_time, elevation, heartrate,
+                 sport_code, sports):
+        self.start_epoch = start_epoch
+        self.distance = distance
+        self.moving_time = moving_time
+        self.elevation = elevation
+        self.heartrate = heartrate
+        self.sport_code = sport_code
+        self.sports = sports
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds columns from activity records (see activexport_records)"""
+        if not HAS_NUMPY:
+            raise ImportError("numpy is required for columnar statistics (pip install numpy)")
+        return ColumnBuilder().add_many(records).build()
+
+    def __len__(self):
+        return len(self.start_epoch)
+
+    def _days(self):
+        """Days since epoch (UTC) of each activity"""
+        return self.start_epoch // SECONDS_PER_DAY
+
+    def _period_index(self, period):
+        """Returns (period index per activity, index -> label function)"""
+        if period == 'year':
+            dates = self.start_epoch.astype('datetime64[s]')
+            index = dates.astype('datetime64[Y]').astype(np.int64)
+            return index, lambda i: f'{1970 + i}'
+        if period == 'month':
+            dates = self.start_epoch.astype('datetime64[s]')
+            index = dates.astype('datetime64[M]').astype(np.int64)
+            return index, lambda i: f'{1970 + i // 12}-{i % 12 + 1:02d}'
+        if period == 'week':
+            # Weeks start on Monday; 1970-01-01 was a Thursday
+            index = (self._days() + 3) // 7
+
+            def label(i):
+                iso_year, iso_week, _ = datetime.fromtimestamp(
+                    (i * 7 - 3) * SECONDS_PER_DAY, timezone.utc).isocalendar()
+                return f'{iso_year}-W{iso_week:02d}'
+            return index, label
+        raise ValueError(f"Unknown period: {period}")
+
+    def rollup(self, period='month', by_sport=True):
+        """
+        Volume per period (and per sport)
+        Returns rows: (period, sport, count, distance_km, moving_hours,
+        elevation_m, avg_hr) sorted by period then sport
+        """
+        if not len(self):
+            return []
+
+        period_index, label = self._period_index(period)
+        sport_code = self.sport_code if by_sport else np.zeros_like(self.sport_code)
+        keys = period_index * (len(self.sports) + 1) + sport_code
+        unique_keys, group = np.unique(keys, return_inverse=True)
+        n = len(unique_keys)
+
+        count = np.bincount(group, minlength=n)
+        distance = np.bincount(group, weights=self.distance, minlength=n) / 1000
+        hours = np.bincount(group, weights=self.moving_time, minlength=n) / 3600
+        elevation = np.bincount(group, weights=self.elevation, minlength=n)
+
+        # Time-weighted average HR over activities with HR data
+        has_hr = ~np.isnan(self.heartrate)
+        hr_time = np.bincount(group[has_hr], weights=self.moving_time[has_hr], minlength=n)
+        hr_sum = np.bincount(group[has_hr],
+                             weights=self.heartrate[has_hr] * self.moving_time[has_hr], minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_hr = np.where(hr_time > 0, hr_sum / hr_time, np.nan)
+
+        periods = unique_keys // (len(self.sports) + 1)
+        codes = unique_keys % (len(self.sports) + 1)
+        rows = []
+        for i in range(n):
+            sport = self.sports[codes[i]] if by_sport else 'All'
+            rows.append((label(int(periods[i])), sport, int(count[i]), float(distance[i]),
+                         float(hours[i]), float(elevation[i]),
+                         None if np.isnan(avg_hr[i]) else float(avg_hr[i])))
+        return rows
+
+    def daily_series(self, field='moving_time', end_day=None):
+        """
+        Daily totals of a field from the first activity to end_day
+        Returns (first day since epoch, array of daily totals)
+        """
+        days = self._days()
+        first_day = int(days.min())
+        last_day = int(days.max()) if end_day is None else max(int(end_day), int(days.max()))
+        values = getattr(self, field)
+        return first_day, np.bincount(days - first_day, weights=values,
+                                      minlength=last_day - first_day + 1)
+
+    def rolling_load(self, windows=(7, 28), field='moving_time', end_day=None):
+        """
+        Rolling sums over the given windows (days), for every day
+        Returns (first day since epoch, {window: array}) computed with prefix sums
+        """
+        first_day, daily = self.daily_series(field, end_day)
+        cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+        end = np.arange(1, len(daily) + 1)
+        rolling = {}
+        for window in windows:
+            start = np.maximum(end - window, 0)
+            rolling[window] = cumulative[end] - cumulative[start]
+        return first_day, rolling
+
+    def current_load(self, today=None):
+        """
+        Acute (7-day) and chronic (28-day) moving time in hours at a given day
+        Returns (acute_hours, chronic_hours, acute:chronic ratio or None)
+        """
+        if not len(self):
+            return 0.0, 0.0, None
+        if today is None:
+            today = datetime.now(timezone.utc).timestamp()
+        end_day = int(today // SECONDS_PER_DAY)
+        _, rolling = self.rolling_load((7, 28), end_day=end_day)
+        acute = float(rolling[7][-1]) / 3600
+        chronic = float(rolling[28][-1]) / 3600
+        ratio = acute / (chronic / 4) if chronic > 0 else None
+        return acute, chronic, ratio
+
+    def year_over_year(self, today=None):
+        """
+        Year-to-date totals compared across years, at the same day of year
+        Returns rows: (year, count_ytd, distance_km_ytd, hours_ytd, elevation_ytd,
+        distance_km_full_year)
+        """
+        if not len(self):
+            return []
+        if today is None:
+            today = datetime.now(timezone.utc).timestamp()
+        today_date = np.datetime64(int(today), 's')
+        cutoff = int((today_date - today_date.astype('datetime64[Y]')).astype('timedelta64[D]').astype(np.int64))
+
+        dates = self.start_epoch.astype('datetime64[s]')
+        years = dates.astype('datetime64[Y]')
+        day_of_year = (dates - years).astype('timedelta64[D]').astype(np.int64)
+        year_index = years.astype(np.int64)
+        first_year = int(year_index.min())
+        group = year_index - first_year
+        n = int(group.max()) + 1
+        ytd = day_of_year <= cutoff
+
+        count = np.bincount(group[ytd], minlength=n)
+        distance = np.bincount(group[ytd], weights=self.distance[ytd], minlength=n) / 1000
+        hours = np.bincount(group[ytd], weights=self.moving_time[ytd], minlength=n) / 3600
+        elevation = np.bincount(group[ytd], weights=self.elevation[ytd], minlength=n)
+        full_distance = np.bincount(group, weights=self.distance, minlength=n) / 1000
+
+        return [(1970 + first_year + i, int(count[i]), float(distance[i]), float(hours[i]),
+                 float(elevation[i]), float(full_distance[i])) for i in range(n)]
+
+
+def write_markdown_sections(f, columns, recent_weeks=12, recent_months=12):
+    """Writes the training statistics sections of the Markdown report"""
+    if not len(columns):
+        return
+
+    # Training load
+    acute, chronic, ratio = columns.current_load()
+    f.write("\n## Training Load\n\n")
+    f.write(f"- **Last 7 days:** {acute:.1f} hours\n")
+    f.write(f"- **Last 28 days:** {chronic:.1f} hours\n")
+    if ratio is not None:
+        f.write(f"- **Acute:chronic ratio:** {ratio:.2f}\n")
+
+    # Year over year
+    today = datetime.now()
+    f.write(f"\n## Year over Year (to {today.strftime('%d/%m')})\n\n")
+    f.write("| Year | Count | Distance | Time | Elevation | Full Year |\n")
+    f.write("|------|-------|----------|------|-----------|-----------|\n")
+    for year, count, distance, hours, elevation, full_distance in reversed(columns.year_over_year()):
+        f.write(f"| {year} | {count} | {distance:,.1f} km | {hours:,.1f} h | "
+                f"{elevation:,.0f} m | {full_distance:,.1f} km |\n")
+
+    # Recent volume per sport
+    for period, limit, title in (('month', recent_months, 'Monthly'), ('week', recent_weeks, 'Weekly')):
+        rows = columns.rollup(period)
+        kept = set(sorted({row[0] for row in rows}, reverse=True)[:limit])
+        f.write(f"\n## {title} Volume by Sport\n\n")
+        f.write(f"| {period.capitalize()} | Sport | Count | Distance | Time | Elevation | Avg HR |\n")
+        f.write("|------|-------|-------|----------|------|-----------|--------|\n")
+        for label, sport, count, distance, hours, elevation, avg_hr in reversed(rows):
+            if label not in kept:
+                continue
+            hr_str = f"{avg_hr:.0f}" if avg_hr is not None else '-'
+            f.write(f"| {label} | {sport} | {count} | {distance:,.1f} km | {hours:,.1f} h | "
+                    f"{elevation:,.0f} m | {hr_str} |\n")
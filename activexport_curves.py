@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Best efforts and power / heart rate / pace curves
+Computed from activity streams (see activexport_streams) with prefix sums
+and vectorized sliding windows (optional, requires numpy); results are cached
+per activity in the local store and merged into all-time bests incrementally
+"""
+
+import os
+import re
+import json
+from datetime import datetime
+from activexport_streams import STREAMS_DIR, StreamsFile, streams_path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+
+# Curve windows: durations in seconds, distances in meters
+DURATIONS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+DISTANCES = (400, 1000, 1609.344, 5000, 10000, 21097.5, 42195)
+
+# Metrics averaged over durations (higher is better); 'pace' is the fastest
+# time over distances (lower is better)
+DURATION_METRICS = ('watts', 'heartrate')
+LOWER_IS_BETTER = {'pace'}
+
+# Standard efforts shown in the Markdown reports
+REPORT_DURATIONS = (60, 300, 1200, 3600)
+REPORT_DISTANCES = (1000, 5000, 10000, 21097.5)
+
+DISTANCE_LABELS = {400: '400 m', 1000: '1 km', 1609.344: '1 mile', 5000: '5 km',
+                   10000: '10 km', 21097.5: 'Half marathon', 42195: 'Marathon'}
+
+# Recording gaps longer than this (auto-pause) contribute nothing to averages
+MAX_GAP = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS efforts (
+    id INTEGER PRIMARY KEY,
+    sport_type TEXT,
+    streams_mtime REAL NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS best_efforts (
+    sport_type TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    window REAL NOT NULL,
+    value REAL NOT NULL,
+    activity_id INTEGER NOT NULL,
+    PRIMARY KEY (sport_type, metric, window)
+);
+"""
+
+STREAMS_FILE_PATTERN = re.compile(r'^activity_(\d+)\.axs$')
+
+
+def best_averages(time, values, durations=DURATIONS):
+    """
+    Best average of a series over each duration
+    The series is integrated once (prefix sum); each window average is then
+    the difference of the integral at both ends, for every window start
+    and end at once
+    Returns {duration: best average or None if the activity is shorter}
+    """
+    t = np.asarray(time, dtype=np.float64)
+    v = np.asarray(values, dtype=np.float64)
+    dt = np.diff(t)
+    dt[dt > MAX_GAP] = 0
+    integral = np.concatenate(([0.0], np.cumsum(v[:-1] * dt)))
+
+    bests = {}
+    for duration in durations:
+        if len(t) < 2 or t[-1] - t[0] < duration:
+            bests[duration] = None
+            continue
+        # Windows starting on a sample, then windows ending on a sample
+        starts = t[:np.searchsorted(t, t[-1] - duration, side='right')]
+        forward = np.interp(starts + duration, t, integral) - integral[:len(starts)]
+        first_end = np.searchsorted(t, t[0] + duration, side='left')
+        ends = t[first_end:]
+        backward = integral[first_end:] - np.interp(ends - duration, t, integral)
+        bests[duration] = float(max(forward.max(), backward.max())) / duration
+    return bests
+
+
+def fastest_times(time, distance, distances=DISTANCES):
+    """
+    Fastest time (seconds) to cover each distance
+    Returns {distance: seconds or None if the activity is shorter}
+    """
+    t = np.asarray(time, dtype=np.float64)
+    # GPS distance stalls (stops) and drops back (glitches), np.interp needs it
+    # strictly increasing: each plateau keeps its first sample where a window
+    # ends (arrival) and its last sample where a window starts (departure)
+    d = np.maximum.accumulate(np.asarray(distance, dtype=np.float64))
+    moved = d[1:] != d[:-1]
+    arrivals = np.concatenate(([True], moved))
+    departures = np.concatenate((moved, [True]))
+    d_in, t_in = d[arrivals], t[arrivals]
+    d_out, t_out = d[departures], t[departures]
+
+    bests = {}
+    for target in distances:
+        if len(d_in) < 2 or d[-1] - d[0] < target:
+            bests[target] = None
+            continue
+        starts = np.searchsorted(d_out, d_out[-1] - target, side='right')
+        forward = np.interp(d_out[:starts] + target, d_in, t_in) - t_out[:starts]
+        first_end = np.searchsorted(d_in, d_in[0] + target, side='left')
+        backward = t_in[first_end:] - np.interp(d_in[first_end:] - target, d_out, t_out)
+        bests[target] = float(min(forward.min(), backward.min()))
+    return bests
+
+
+def compute_efforts(streams):
+    """
+    Best efforts of one activity from its streams file
+    Returns {metric: {window: value}}
+    """
+    if not HAS_NUMPY:
+        raise ImportError("numpy is required for best efforts (pip install numpy)")
+    if 'time' not in streams:
+        return {}
+
+    time = streams.numpy('time')
+    efforts = {}
+    for metric in DURATION_METRICS:
+        if metric in streams:
+            values = {w: v for w, v in best_averages(time, streams.numpy(metric)).items() if v}
+            if values:
+                efforts[metric] = values
+    if 'distance' in streams:
+        values = {w: v for w, v in fastest_times(time, streams.numpy('distance')).items() if v}
+        if values:
+            efforts['pace'] = values
+    return efforts
+
+
+def activity_efforts(activity_id, streams_dir=STREAMS_DIR):
+    """Best efforts of a downloaded activity (None if its streams are not stored)"""
+    filepath = streams_path(activity_id, streams_dir)
+    if not os.path.exists(filepath):
+        return None
+    with StreamsFile(filepath) as streams:
+        return compute_efforts(streams)
+
+
+def _is_better(metric, value, current):
+    if metric in LOWER_IS_BETTER:
+        return value < current
+    return value > current
+
+
+def _merge_bests(store, activity_id, sport_type, efforts):
+    """Merges the efforts of one activity into the all-time bests of its sport"""
+    current = {(metric, window): value for metric, window, value in store.execute(
+        'SELECT metric, window, value FROM best_efforts WHERE sport_type = ?', (sport_type,))}
+    rows = [(sport_type, metric, window, value, activity_id)
+            for metric, values in efforts.items()
+            for window, value in values.items()
+            if (metric, window) not in current or _is_better(metric, value, current[(metric, window)])]
+    store.executemany('INSERT OR REPLACE INTO best_efforts VALUES (?, ?, ?, ?, ?)', rows)
+
+
+def _decode(data):
+    return {metric: {float(w): v for w, v in values.items()} for metric, values in json.loads(data).items()}
+
+
+def create_efforts_tables(store):
+    """Creates the best efforts tables if needed"""
+    store.executescript(SCHEMA)
+
+
+def save_efforts(store, activity_id, sport_type, efforts, streams_mtime):
+    """
+    Caches the efforts of an activity and updates the all-time bests
+    Bests only move forward, unless the activity already held one of them
+    (its streams were downloaded again): the sport is then rebuilt from cache
+    """
+    with store:
+        held = store.execute('SELECT 1 FROM best_efforts WHERE activity_id = ? LIMIT 1',
+                             (activity_id,)).fetchone()
+        store.execute('INSERT OR REPLACE INTO efforts VALUES (?, ?, ?, ?)',
+                      (activity_id, sport_type, streams_mtime, json.dumps(efforts)))
+        if held:
+            rebuild_bests(store, sport_type)
+        else:
+            _merge_bests(store, activity_id, sport_type, efforts)
+
+
+def remove_efforts(store, activity_id):
+    """Removes the efforts of an activity (runs in the caller's transaction)"""
+    row = store.execute('SELECT sport_type FROM efforts WHERE id = ?', (activity_id,)).fetchone()
+    store.execute('DELETE FROM efforts WHERE id = ?', (activity_id,))
+    if row is not None:
+        rebuild_bests(store, row[0])
+
+
+def rebuild_bests(store, sport_type):
+    """Recomputes the all-time bests of a sport from the cached efforts"""
+    store.execute('DELETE FROM best_efforts WHERE sport_type = ?', (sport_type,))
+    for activity_id, data in store.execute(
+            'SELECT id, data FROM efforts WHERE sport_type = ?', (sport_type,)).fetchall():
+        _merge_bests(store, activity_id, sport_type, _decode(data))
+
+
+def load_efforts(store, activity_id, streams_mtime=None):
+    """Cached efforts of an activity (None if absent or older than the streams file)"""
+    row = store.execute('SELECT streams_mtime, data FROM efforts WHERE id = ?', (activity_id,)).fetchone()
+    if row is None or (streams_mtime is not None and row[0] != streams_mtime):
+        return None
+    return _decode(row[1])
+
+
+def _sport_type(store, activity_id):
+    """Sport of a stored activity (summary, then details), None if not stored"""
+    row = store.execute('SELECT sport_type FROM activities WHERE id = ?', (activity_id,)).fetchone()
+    if row and row[0]:
+        return row[0]
+    row = store.execute('SELECT data FROM details WHERE id = ?', (activity_id,)).fetchone()
+    return json.loads(row[0]).get('sport_type') if row else None
+
+
+def get_efforts(store, activity_id, sport_type=None, streams_dir=STREAMS_DIR):
+    """
+    Efforts of an activity from the cache, computed (and cached) if missing
+    or stale; None if its streams are not stored
+    """
+    filepath = streams_path(activity_id, streams_dir)
+    if not os.path.exists(filepath):
+        return None
+    mtime = os.path.getmtime(filepath)
+    efforts = load_efforts(store, activity_id, mtime) if store is not None else None
+    if efforts is None:
+        efforts = activity_efforts(activity_id, streams_dir)
+        if store is not None:
+            sport_type = sport_type or _sport_type(store, activity_id) or 'Unknown'
+            save_efforts(store, activity_id, sport_type, efforts, mtime)
+    return efforts
+
+
+def update_efforts(store, streams_dir=STREAMS_DIR):
+    """
+    Computes efforts of every new or re-downloaded streams file of a stored
+    activity
+    Returns the number of activities processed
+    """
+    if not os.path.isdir(streams_dir):
+        return 0
+    cached = dict(store.execute('SELECT id, streams_mtime FROM efforts'))
+    processed = 0
+    for name in os.listdir(streams_dir):
+        match = STREAMS_FILE_PATTERN.match(name)
+        if not match:
+            continue
+        activity_id = int(match.group(1))
+        mtime = os.path.getmtime(os.path.join(streams_dir, name))
+        if cached.get(activity_id) == mtime:
+            continue
+        sport_type = _sport_type(store, activity_id)
+        if sport_type is None:
+            continue
+        efforts = activity_efforts(activity_id, streams_dir)
+        save_efforts(store, activity_id, sport_type, efforts, mtime)
+        processed += 1
+    return processed
+
+
+def all_time_bests(store):
+    """Returns {sport: {metric: {window: (value, activity_id)}}}"""
+    bests = {}
+    for sport_type, metric, window, value, activity_id in store.execute(
+            'SELECT sport_type, metric, window, value, activity_id FROM best_efforts '
+            'ORDER BY sport_type, metric, window'):
+        bests.setdefault(sport_type, {}).setdefault(metric, {})[window] = (value, activity_id)
+    return bests
+
+
+def load_all_time_bests(store, streams_dir=STREAMS_DIR):
+    """
+    All-time bests of the local store, after processing new streams files
+    (when numpy is available)
+    """
+    if HAS_NUMPY:
+        processed = update_efforts(store, streams_dir)
+        if processed:
+            print(f"[OK] Best efforts computed for {processed} activity(ies)")
+    return all_time_bests(store)
+
+
+def duration_label(seconds):
+    """60 -> '1 min', 7200 -> '2 h'"""
+    seconds = int(seconds)
+    if seconds >= 3600 and seconds % 3600 == 0:
+        return f'{seconds // 3600} h'
+    if seconds >= 60 and seconds % 60 == 0:
+        return f'{seconds // 60} min'
+    return f'{seconds} s'
+
+
+def format_time(seconds):
+    """Elapsed time as 1h02'03" or 4'05\""""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}'{secs:02d}\""
+    return f"{minutes}'{secs:02d}\""
+
+
+def _value(entry):
+    """Value of an effort entry (value or (value, activity_id))"""
+    return entry[0] if isinstance(entry, tuple) else entry
+
+
+def _write_tables(f, efforts, show_activity=False):
+    """Writes the duration and distance tables of a set of efforts"""
+    activity_col = ' Activity |' if show_activity else ''
+    activity_sep = '----------|' if show_activity else ''
+
+    durations = [d for d in REPORT_DURATIONS
+                 if any(d in efforts.get(m, {}) for m in DURATION_METRICS)]
+    if durations:
+        f.write(f"| Duration | Power | Heart Rate |{activity_col}\n")
+        f.write(f"|----------|-------|------------|{activity_sep}\n")
+        for duration in durations:
+            cells = []
+            activities = []
+            for metric, unit in (('watts', 'W'), ('heartrate', 'bpm')):
+                entry = efforts.get(metric, {}).get(duration)
+                cells.append(f"{_value(entry):.0f} {unit}" if entry else '-')
+                if isinstance(entry, tuple):
+                    activities.append(str(entry[1]))
+            row = f"| {duration_label(duration)} | {cells[0]} | {cells[1]} |"
+            if show_activity:
+                row += f" {', '.join(dict.fromkeys(activities))} |"
+            f.write(row + "\n")
+
+    pace = efforts.get('pace', {})
+    distances = [d for d in REPORT_DISTANCES if d in pace]
+    if distances:
+        if durations:
+            f.write("\n")
+        f.write(f"| Distance | Time | Pace |{activity_col}\n")
+        f.write(f"|----------|------|------|{activity_sep}\n")
+        for distance in distances:
+            seconds = _value(pace[distance])
+            row = (f"| {DISTANCE_LABELS.get(distance, f'{distance:.0f} m')} | {format_time(seconds)} | "
+                   f"{format_time(seconds / distance * 1000)}/km |")
+            if show_activity:
+                row += f" {pace[distance][1]} |"
+            f.write(row + "\n")
+
+
+def write_markdown_efforts(f, efforts):
+    """Writes the best efforts section of an activity report"""
+    if not efforts:
+        return
+    f.write("\n## Best Efforts\n\n")
+    _write_tables(f, efforts)
+
+
+def write_markdown_bests(f, bests):
+    """Writes the all-time best efforts section of the activities report"""
+    if not bests:
+        return
+    f.write(f"\n## All-Time Best Efforts (as of {datetime.now().strftime('%Y-%m-%d')})\n")
+    for sport_type in sorted(bests):
+        f.write(f"\n### {sport_type}\n\n")
+        _write_tables(f, bests[sport_type], show_activity=True)
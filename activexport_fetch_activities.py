@@ -5,21 +5,40 @@ Fetches all activities (complete history) and exports to multiple formats
 """
 
 import os
+import sys
 import json
 import csv
 import time
+import queue
 import argparse
+import threading
 from datetime import datetime
 import requests
-from activexport_auth import get_valid_access_token
+from activexport_aggregate import ActivityAggregator, aggregate
+from activexport_arrow import HAS_PYARROW, ParquetStreamWriter, FeatherStreamWriter
+from activexport_auth import get_valid_access_token, current_token_provider
+from activexport_backfill import DEFAULT_WORKERS, backfill_activities
+from activexport_checkpoint import CHECKPOINT_DIR, FetchCheckpoint, BackfillCheckpoint
+from activexport_curves import load_all_time_bests, write_markdown_bests
+from activexport_columnar import HAS_NUMPY, ActivityColumns, ColumnBuilder, write_markdown_sections
+from activexport_metrics import metrics, enable_metrics
+from activexport_output import COMPRESSIONS, check_compression, open_output, output_path
+from activexport_records import to_records, needs_raw
+from activexport_client import api_get
+from activexport_ratelimit import RateLimitExceeded, rate_limiter
+from activexport_search import search_records
+from activexport_store import (STORE_FILE, open_store, merge_activities, count_activities,
+                               get_latest_start_epoch, sorted_records, search_stored_records)
+from activexport_streams import STREAMS_DIR
 
 # Configuration
 DEFAULT_OUTPUT_DIR = './output'
-API_BASE = 'https://www.strava.com/api/v3'
 
-# Strava API limits
-RATE_LIMIT_15MIN = 100
-RATE_LIMIT_DAY = 1000
+# Records handed to the export writers at a time (see save_activities)
+EXPORT_PAGE_SIZE = 2000
+
+# Export files, in the order they are written
+EXPORT_FORMATS = ['json', 'ndjson', 'csv', 'markdown', 'parquet', 'feather']
 
 
 def parse_arguments():
@@ -29,7 +48,12 @@ def parse_arguments():
         epilog='''Examples:
   %(prog)s
   %(prog)s -f json csv
-  %(prog)s "trail" -f json -o ./my_exports/''',
+  %(prog)s "trail" -f json -o ./my_exports/
+  %(prog)s --sync -f csv
+  %(prog)s --backfill -j 8 -f csv
+  %(prog)s --stream -f ndjson -f csv
+  %(prog)s -f json --resume
+  %(prog)s --sync -f ndjson -f csv --compress zstd''',
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
 
@@ -37,16 +61,17 @@ def parse_arguments():
         'search',
         nargs='?',
         default=None,
-        help='Optional search term to filter activities by name'
+        help='Optional search term to filter activities by name (accent-insensitive, '
+             'prefix and typo tolerant; searches the local store offline when it exists)'
     )
 
     parser.add_argument(
         '-f', '--format',
         action='append',
-        choices=['json', 'csv', 'md', 'markdown'],
+        choices=['json', 'ndjson', 'csv', 'md', 'markdown', 'parquet', 'feather'],
         dest='formats',
         metavar='FORMAT',
-        help='Output format(s): json, csv, md/markdown (default: stdout only). Can be specified multiple times for multiple formats'
+        help='Output format(s): json, ndjson, csv, md/markdown, parquet, feather (default: stdout only). Can be specified multiple times for multiple formats'
     )
 
     parser.add_argument(
@@ -55,221 +80,449 @@ def parse_arguments():
         help=f'Output directory path (default: {DEFAULT_OUTPUT_DIR})'
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--compress',
+        choices=COMPRESSIONS,
+        help='Compress text exports (json, ndjson, csv, md) while writing them: gzip, zstd '
+             '(needs zstandard) or xz'
+    )
 
+    parser.add_argument(
+        '--export-threads',
+        action='store_true',
+        help='Encode and compress the JSON, NDJSON and compressed CSV exports in worker threads '
+             '(worth it with several formats and --compress on a multi-core machine)'
+    )
 
-def fetch_all_activities(page_size=200):
-    """
-    Fetches all athlete's activities
-    Strava API: max 200 activities per page
-    """
-    access_token = get_valid_access_token()
-    if not access_token:
-        print("[X] Unable to get valid token")
-        return None
+    mode = parser.add_mutually_exclusive_group()
 
-    headers = {'Authorization': f'Bearer {access_token}'}
-    all_activities = []
-    page = 1
-    request_count = 0
+    mode.add_argument(
+        '--sync',
+        action='store_true',
+        help='Incremental sync: only fetch activities newer than the local store, then work from the store'
+    )
 
-    print("\n" + "="*60)
-    print("FETCHING ACTIVITIES FROM STRAVA")
-    print("="*60 + "\n")
+    mode.add_argument(
+        '--backfill',
+        action='store_true',
+        help='First import: fetch the full history in date windows, concurrently, into the local store, '
+             'then work from the store like --sync'
+    )
 
-    while True:
-        print(f"[Page {page}] Fetching max {page_size} activities...")
+    mode.add_argument(
+        '--stream',
+        action='store_true',
+        help='Write each page to disk as soon as it is received, with flat memory use'
+    )
 
-        params = {
-            'per_page': page_size,
-            'page': page
-        }
+    parser.add_argument(
+        '--store',
+        default=STORE_FILE,
+        help=f'Local activity store file used by --sync (default: {STORE_FILE})'
+    )
 
-        try:
-            response = requests.get(
-                f'{API_BASE}/athlete/activities',
-                headers=headers,
-                params=params
-            )
-            response.raise_for_status()
-            request_count += 1
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Concurrent requests of --backfill (default: {DEFAULT_WORKERS})'
+    )
+
+    parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help='Save each page of a full fetch or --stream to a checkpoint, so an interrupted run '
+             'can continue with --resume'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue an interrupted full fetch (implies --checkpoint) or --backfill from its checkpoint '
+             'instead of starting over (an interrupted --sync always continues from the local store)'
+    )
+
+    parser.add_argument(
+        '--metrics',
+        action='append',
+        metavar='FILE',
+        help='Write run metrics (API latency, bytes, retries, 429s, export times) on exit: '
+             'Prometheus text format for .prom files, JSON otherwise. Can be specified multiple times'
+    )
+
+    return parser.parse_args()
 
-            activities = response.json()
+
+def iter_activity_pages(page_size=200, after=None, checkpoint=None):
+    """
+    Yields athlete's activities page by page, as soon as each page is received
+    Strava API: max 200 activities per page
+    If after (epoch seconds) is given, only activities started after it are fetched
+    With a checkpoint (see activexport_checkpoint, opt-in), each page is saved
+    as it is received: pages saved by an interrupted run are yielded first,
+    then fetching continues before the oldest of them
+    """
+    try:
+        access_token = get_valid_access_token()
+        if not access_token:
+            print("[X] Unable to get valid token")
+            return
+
+        total = 0
+        page = 1
+        request_count = 0
+        before = None
+        completed = False
+
+        if checkpoint is not None and checkpoint.count:
+            for activities in checkpoint.pages(page_size):
+                total += len(activities)
+                yield activities
+            # Activities started at the cursor are fetched again, then dropped by the checkpoint
+            before = checkpoint.cursor + 1
+            print(f"[OK] Resuming: {total} activities from the checkpoint, fetching activities before "
+                  f"{datetime.fromtimestamp(checkpoint.cursor).strftime('%d/%m/%Y %H:%M')}")
+
+        print("\n" + "="*60)
+        print("FETCHING ACTIVITIES FROM STRAVA")
+        print("="*60 + "\n")
+
+        while True:
+            print(f"[Page {page}] Fetching max {page_size} activities...")
+
+            params = {
+                'per_page': page_size,
+                'page': page
+            }
+            if after is not None:
+                params['after'] = after
+            if before is not None:
+                params['before'] = before
+
+            try:
+                # Asked per page: the provider refreshes the token if a long sync outlives it
+                access_token = current_token_provider().get_access_token()
+                response = api_get('/athlete/activities', access_token, params=params)
+                request_count += 1
+                response.raise_for_status()
+
+                activities = response.json()
+
+            except RateLimitExceeded as e:
+                print(f"[X] {e}")
+                break
+            except requests.exceptions.HTTPError as e:
+                print(f"[X] HTTP Error: {e}")
+                break
+            except Exception as e:
+                print(f"[X] Error: {e}")
+                break
 
             if not activities:
                 print(f"[OK] No additional activities (end of pagination)\n")
+                completed = True
                 break
 
-            all_activities.extend(activities)
+            # If fewer activities than requested = last page
+            last_page = len(activities) < page_size
+            if checkpoint is not None:
+                activities = checkpoint.record_page(activities)
+
+            total += len(activities)
             print(f"      -> {len(activities)} activities fetched")
-            print(f"      Cumulative total: {len(all_activities)} activities\n")
+            print(f"      Cumulative total: {total} activities\n")
 
-            # If fewer activities than requested = last page
-            if len(activities) < page_size:
+            yield activities
+
+            if last_page:
                 print(f"[OK] Last page reached\n")
+                completed = True
                 break
 
             page += 1
 
-            # Pause to respect API limits (caution)
-            if request_count % 10 == 0:
-                print(f"[PAUSE] 10 requests made, pausing 3s...\n")
-                time.sleep(3)
-
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                print(f"[X] API limit reached (429 Too Many Requests)")
-                print(f"    Waiting 15 minutes...")
-                time.sleep(900)
+        if checkpoint is not None:
+            if completed:
+                checkpoint.complete()
             else:
-                print(f"[X] HTTP Error: {e}")
-                break
-        except Exception as e:
-            print(f"[X] Error: {e}")
-            break
+                checkpoint.close()
+                print(f"[!] Fetch interrupted: {checkpoint.count} activities saved in {checkpoint.filepath}")
+                print("    Run again with --resume to continue from there\n")
+
+        print("="*60)
+        print(f"TOTAL: {total} activities fetched")
+        print(f"API requests used: {request_count}")
+        headroom_15min, headroom_day = rate_limiter.headroom()
+        print(f"Rate limit headroom: {headroom_15min} (15 min), {headroom_day} (day)")
+        print("="*60 + "\n")
+    finally:
+        # Also reached on an early return or when the caller stops iterating
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def open_checkpoint(args):
+    """
+    Page journal of a full fetch, only when asked for (--checkpoint or
+    --resume): every page is fsynced as it is received
+    """
+    if not (args.checkpoint or args.resume):
+        return None
+    checkpoint = FetchCheckpoint()
+    checkpoint.open(args.resume)
+    return checkpoint
 
-    print("="*60)
-    print(f"TOTAL: {len(all_activities)} activities fetched")
-    print(f"API requests used: {request_count}")
-    print("="*60 + "\n")
 
-    return all_activities
+def fetch_all_records(keep_raw=False, page_size=200, after=None, checkpoint=None):
+    """
+    Fetches all athlete's activities as compact records (see activexport_records)
+    Each page is converted as soon as it is received; the raw API dicts are
+    only kept if keep_raw is set
+    """
+    records = []
+    for activities in iter_activity_pages(page_size, after, checkpoint):
+        records.extend(to_records(activities, keep_raw))
+    return records
+
+
+def sync_activities(store_file=STORE_FILE, keep_raw=False, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Incremental sync: fetches activities newer than the local store
+    Each page is merged into the store as soon as it is received
+    checkpoint_dir is where a backfill of the same store keeps its checkpoint
+    Returns records of all stored activities (newest first)
+    """
+    store = open_store(store_file)
+    after = get_latest_start_epoch(store)
+
+    if BackfillCheckpoint(directory=checkpoint_dir).exists():
+        print("[!] An interrupted backfill left gaps in the store history, "
+              "run --backfill --resume to fill them")
+
+    if after is None:
+        print(f"[SYNC] Local store empty ({store_file}), fetching full history")
+        # Oldest first: an interrupted first sync resumes from the latest stored activity
+        after = 0
+    else:
+        print(f"[SYNC] {count_activities(store)} activities in store, fetching activities after "
+              f"{datetime.fromtimestamp(after).strftime('%d/%m/%Y %H:%M')}")
+
+    added = 0
+    for activities in iter_activity_pages(after=after):
+        added += merge_activities(store, activities)
+
+    print(f"[OK] Store updated: {added} new activities, {count_activities(store)} total ({store_file})\n")
+
+    records = sorted_records(store, keep_raw)
+    store.close()
+    return records
+
+
+CSV_HEADER = [
+    'date', 'name', 'type', 'distance_km', 'elevation_m',
+    'moving_time', 'elapsed_time', 'avg_pace', 'avg_hr', 'max_hr'
+]
+
+
+def csv_row(record):
+    """Builds the CSV row of an activity record"""
+    distance_km = record.distance / 1000
+    moving_time = record.moving_time
+
+    # Calculate average pace
+    avg_pace = ''
+    if moving_time > 0 and distance_km > 0:
+        pace_sec_km = moving_time / distance_km
+        pace_min = int(pace_sec_km // 60)
+        pace_sec = int(pace_sec_km % 60)
+        avg_pace = f"{pace_min}'{pace_sec:02d}\""
+
+    avg_hr = record.average_heartrate if record.average_heartrate is not None else ''
+    max_hr = record.max_heartrate if record.max_heartrate is not None else ''
+
+    return [
+        record.start.strftime('%Y-%m-%d'), record.name, record.sport_type,
+        f"{distance_km:.2f}", int(record.elevation),
+        moving_time, record.elapsed_time, avg_pace, avg_hr, max_hr
+    ]
+
+
+class ExportPage(list):
+    """
+    Page of records handed to every export writer
+    The JSON text of each activity is encoded once here and shared by the
+    JSON and NDJSON writers
+    """
+
+    def __init__(self, records, encode_json=False):
+        super().__init__(records)
+        self.json_lines = ([json.dumps(record.raw, ensure_ascii=False) for record in records]
+                           if encode_json else None)
+
+
+def json_lines(records):
+    """JSON text of the raw activities of a page (encoded once when it is an ExportPage)"""
+    lines = getattr(records, 'json_lines', None)
+    if lines is None:
+        lines = [json.dumps(record.raw, ensure_ascii=False) for record in records]
+    return lines
+
+
+class NdjsonStreamWriter:
+    """Streaming NDJSON writer: one activity per line, flushed page by page"""
+
+    def __init__(self, filepath, compress=None):
+        self.file = open_output(filepath, compress)
+        self.filepath = self.file.filepath
+        self.count = 0
+
+    def write_page(self, records):
+        if records:
+            self.file.write('\n'.join(json_lines(records)) + '\n')
+        self.count += len(records)
+        self.file.flush()
 
+    def close(self):
+        self.file.close()
+        print(f"[OK] NDJSON exported to: {self.filepath}")
+        print(f"     File size: {self.file.size_text()}")
 
-def export_to_json(activities, filepath):
-    """Export activities to JSON format"""
-    # Add metadata
-    data = {
-        'metadata': {
+    def discard(self):
+        self.file.discard()
+
+
+class JsonStreamWriter:
+    """
+    Streaming version of the JSON export envelope
+    Activities are written page by page; metadata (with the final count) is
+    written last, once the total is known
+    """
+
+    def __init__(self, filepath, compress=None):
+        self.file = open_output(filepath, compress)
+        self.filepath = self.file.filepath
+        self.count = 0
+        self.file.write('{\n  "activities": [')
+
+    def write_page(self, records):
+        if records:
+            self.file.write((',\n    ' if self.count else '\n    ') + ',\n    '.join(json_lines(records)))
+        self.count += len(records)
+        self.file.flush()
+
+    def close(self):
+        metadata = {
             'export_date': datetime.now().isoformat(),
-            'total_activities': len(activities),
+            'total_activities': self.count,
             'source': 'Strava API v3'
-        },
-        'activities': activities
-    }
+        }
+        self.file.write('\n  ],\n  "metadata": ')
+        self.file.write(json.dumps(metadata, ensure_ascii=False))
+        self.file.write('\n}\n')
+        self.file.close()
+        print(f"[OK] JSON exported to: {self.filepath}")
+        print(f"     File size: {self.file.size_text()}")
 
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    def discard(self):
+        self.file.discard()
 
-    file_size_mb = os.path.getsize(filepath) / 1024 / 1024
-    print(f"[OK] JSON exported to: {filepath}")
-    print(f"     File size: {file_size_mb:.2f} MB")
 
+class CsvStreamWriter:
+    """Streaming CSV writer, flushed page by page"""
 
-def export_to_csv(activities, filepath):
-    """Export activities to CSV format"""
-    if not activities:
-        return
+    def __init__(self, filepath, compress=None):
+        self.file = open_output(filepath, compress, newline='')
+        self.filepath = self.file.filepath
+        self.count = 0
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(CSV_HEADER)
+
+    def write_page(self, records):
+        self.writer.writerows(map(csv_row, records))
+        self.count += len(records)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        print(f"[OK] CSV exported to: {self.filepath}")
+        print(f"     File size: {self.file.size_text()}")
 
-    with open(filepath, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-
-        # Write header
-        writer.writerow([
-            'date', 'name', 'type', 'distance_km', 'elevation_m',
-            'moving_time', 'elapsed_time', 'avg_pace', 'avg_hr', 'max_hr'
-        ])
-
-        # Write activity data
-        for activity in activities:
-            date = datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
-            date_str = date.strftime('%Y-%m-%d')
-            name = activity.get('name', '')
-            sport_type = activity.get('sport_type', '')
-            distance_km = activity.get('distance', 0) / 1000
-            elevation_m = activity.get('total_elevation_gain', 0)
-            moving_time = activity.get('moving_time', 0)
-            elapsed_time = activity.get('elapsed_time', 0)
-
-            # Calculate average pace
-            avg_pace = ''
-            if moving_time > 0 and distance_km > 0:
-                pace_sec_km = moving_time / distance_km
-                pace_min = int(pace_sec_km // 60)
-                pace_sec = int(pace_sec_km % 60)
-                avg_pace = f"{pace_min}'{pace_sec:02d}\""
-
-            avg_hr = activity.get('average_heartrate', '')
-            max_hr = activity.get('max_heartrate', '')
-
-            writer.writerow([
-                date_str, name, sport_type, f"{distance_km:.2f}", int(elevation_m),
-                moving_time, elapsed_time, avg_pace, avg_hr, max_hr
-            ])
-
-    print(f"[OK] CSV exported to: {filepath}")
-
-
-def export_to_markdown(activities, filepath):
-    """Export activities to Markdown format"""
-    if not activities:
+    def discard(self):
+        self.file.discard()
+
+
+def export_to_markdown(records, filepath, aggregator=None, columns=None, bests=None, compress=None):
+    """
+    Export activities to Markdown format
+    Statistics come from the aggregator and columns when given (see
+    activexport_aggregate and activexport_columnar), the records are then only
+    used for the recent activities table
+    Training statistics sections are added when numpy is installed, all-time
+    best efforts when given (see activexport_curves)
+    """
+    if not records:
         return
 
-    with open(filepath, 'w', encoding='utf-8') as f:
+    if aggregator is None:
+        aggregator = aggregate(records)
+    if columns is None and HAS_NUMPY:
+        columns = ActivityColumns.from_records(records)
+
+    with open_output(filepath, compress) as f:
         # Header
         f.write("# ActivExport - Activities Export\n\n")
         f.write(f"**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"**Total Activities:** {len(activities)}\n\n")
+        f.write(f"**Total Activities:** {aggregator.count}\n\n")
 
         # Summary statistics
         f.write("## Summary Statistics\n\n")
-        total_distance = sum(a.get('distance', 0) for a in activities) / 1000
-        total_elevation = sum(a.get('total_elevation_gain', 0) for a in activities)
-        total_time = sum(a.get('moving_time', 0) for a in activities) / 3600
-
-        f.write(f"- **Total Distance:** {total_distance:,.1f} km\n")
-        f.write(f"- **Total Elevation:** {total_elevation:,.0f} m\n")
-        f.write(f"- **Total Time:** {total_time:,.1f} hours\n\n")
+        totals = aggregator.totals
+        f.write(f"- **Total Distance:** {totals['distance'] / 1000:,.1f} km\n")
+        f.write(f"- **Total Elevation:** {totals['elevation']:,.0f} m\n")
+        f.write(f"- **Total Time:** {totals['moving_time'] / 3600:,.1f} hours\n\n")
 
         # Activities by sport type
         f.write("## Activities by Sport Type\n\n")
-        sport_types = {}
-        for activity in activities:
-            sport = activity.get('sport_type', 'Unknown')
-            sport_types[sport] = sport_types.get(sport, 0) + 1
-
         f.write("| Sport Type | Count |\n")
         f.write("|------------|-------|\n")
-        for sport, count in sorted(sport_types.items(), key=lambda x: x[1], reverse=True):
-            f.write(f"| {sport} | {count} |\n")
+        for sport, sport_totals in aggregator.sports_by_count():
+            f.write(f"| {sport} | {sport_totals['count']} |\n")
+
+        # Activities by year
+        f.write("\n## Activities by Year\n\n")
+        f.write("| Year | Count | Distance | Elevation | Time |\n")
+        f.write("|------|-------|----------|-----------|------|\n")
+        for year, year_totals in sorted(aggregator.by_year.items(), reverse=True):
+            f.write(f"| {year} | {year_totals['count']} | {year_totals['distance'] / 1000:,.1f} km | "
+                    f"{year_totals['elevation']:,.0f} m | {year_totals['moving_time'] / 3600:,.1f} h |\n")
 
         # Recent activities table
         f.write("\n## Recent Activities\n\n")
         f.write("| Date | Name | Type | Distance | Elevation | Time |\n")
         f.write("|------|------|------|----------|-----------|------|\n")
 
-        for activity in activities[:50]:  # Limit to 50 most recent
-            date = datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
-            date_str = date.strftime('%Y-%m-%d')
-            name = activity.get('name', 'N/A')
-            sport_type = activity.get('sport_type', 'N/A')
-            distance_km = activity.get('distance', 0) / 1000
-            elevation_m = activity.get('total_elevation_gain', 0)
-            moving_time = activity.get('moving_time', 0)
-
+        for record in records[:50]:  # Limit to 50 most recent
             # Format time
-            hours = moving_time // 3600
-            minutes = (moving_time % 3600) // 60
+            hours = record.moving_time // 3600
+            minutes = (record.moving_time % 3600) // 60
             time_str = f"{hours:02d}h{minutes:02d}'"
 
-            f.write(f"| {date_str} | {name} | {sport_type} | {distance_km:.2f} km | {elevation_m:.0f} m | {time_str} |\n")
-
-    print(f"[OK] Markdown exported to: {filepath}")
+            f.write(f"| {record.start.strftime('%Y-%m-%d')} | {record.name} | {record.sport_type} | "
+                    f"{record.distance / 1000:.2f} km | {record.elevation:.0f} m | {time_str} |\n")
 
+        # Training statistics (weekly/monthly volume, load, year over year)
+        if columns is not None:
+            write_markdown_sections(f, columns)
 
-def save_activities(activities, formats, output_dir):
-    """Save activities to specified formats"""
-    if not activities:
-        print("[X] No activities to save")
-        return
+        # All-time best efforts from downloaded streams
+        write_markdown_bests(f, bests)
 
-    # Create output directory if needed
-    os.makedirs(output_dir, exist_ok=True)
+    print(f"[OK] Markdown exported to: {f.filepath}")
+    print(f"     File size: {f.size_text()}")
 
-    # Generate timestamp for filenames
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
-    # Normalize formats (treat 'md' and 'markdown' as same)
+def normalize_formats(formats):
+    """Normalize formats (treat 'md' and 'markdown' as same)"""
     normalized_formats = set()
     if formats:
         for fmt in formats:
@@ -277,27 +530,273 @@ def save_activities(activities, formats, output_dir):
                 normalized_formats.add('markdown')
             else:
                 normalized_formats.add(fmt)
+    return normalized_formats
+
+
+def check_formats(formats):
+    """Checks that optional dependencies of the requested formats are installed"""
+    missing = normalize_formats(formats) & {'parquet', 'feather'}
+    if missing and not HAS_PYARROW:
+        print(f"[X] pyarrow is required for {', '.join(sorted(missing))} export (pip install pyarrow)")
+        return False
+    return True
 
-    # Export to each format
-    if 'json' in normalized_formats:
-        filepath = os.path.join(output_dir, f'activexport_activities_{timestamp}.json')
-        export_to_json(activities, filepath)
 
-    if 'csv' in normalized_formats:
-        filepath = os.path.join(output_dir, f'activexport_activities_{timestamp}.csv')
-        export_to_csv(activities, filepath)
+def load_bests(formats, store_file=STORE_FILE, streams_dir=STREAMS_DIR):
+    """All-time best efforts for the Markdown report (None if not needed or no store)"""
+    if 'markdown' not in normalize_formats(formats) or not os.path.exists(store_file):
+        return None
+    store = open_store(store_file)
+    bests = load_all_time_bests(store, streams_dir)
+    store.close()
+    return bests
+
+
+class MarkdownStreamWriter:
+    """
+    Streaming Markdown writer
+    Statistics come from an aggregator fed by the caller; only the most recent
+    activities are kept, the report is written once the stream ends
+    """
+
+    def __init__(self, filepath, aggregator, bests=None, recent_limit=50, compress=None):
+        self.target = filepath
+        self.filepath = output_path(filepath, compress)
+        self.compress = compress
+        self.aggregator = aggregator
+        self.bests = bests
+        self.columns = ColumnBuilder() if HAS_NUMPY else None
+        self.recent_limit = recent_limit
+        self.recent = []
+
+    def write_page(self, records):
+        if self.columns is not None:
+            self.columns.add_many(records)
+        if len(self.recent) < self.recent_limit:
+            self.recent.extend(records[:self.recent_limit - len(self.recent)])
+
+    def close(self):
+        columns = self.columns.build() if self.columns is not None else None
+        export_to_markdown(self.recent, self.target, self.aggregator, columns, self.bests, self.compress)
+
+    def discard(self):
+        """Nothing is written before close"""
+
+
+class ThreadedWriter:
+    """
+    Runs an export writer in a worker thread fed through a short queue, so
+    its encoding and compression (zlib, lzma and zstd release the GIL)
+    overlap with the traversal and the other writers
+    """
+
+    def __init__(self, writer, fmt, depth=4):
+        self.writer = writer
+        self.fmt = fmt
+        self.filepath = writer.filepath
+        self.pages = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            page = self.pages.get()
+            if page is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                with metrics.timer('export_duration_seconds', format=self.fmt):
+                    self.writer.write_page(page)
+            except Exception as e:
+                self.error = e
+
+    def write_page(self, records):
+        if self.error is not None:
+            raise self.error
+        self.pages.put(records)
+
+    def _stop(self):
+        self.pages.put(None)
+        self.thread.join()
+
+    def close(self):
+        """Completes the file, or discards it if a page failed in the thread"""
+        self._stop()
+        try:
+            if self.error is not None:
+                raise self.error
+            with metrics.timer('export_duration_seconds', format=self.fmt):
+                self.writer.close()
+        except BaseException:
+            self.writer.discard()
+            raise
 
-    if 'markdown' in normalized_formats:
-        filepath = os.path.join(output_dir, f'activexport_activities_{timestamp}.md')
-        export_to_markdown(activities, filepath)
+    def discard(self):
+        self._stop()
+        self.writer.discard()
 
-    if normalized_formats:
+
+STREAM_WRITERS = {
+    'json': JsonStreamWriter,
+    'ndjson': NdjsonStreamWriter,
+    'csv': CsvStreamWriter,
+    'parquet': ParquetStreamWriter,
+    'feather': FeatherStreamWriter,
+}
+
+
+def open_writers(formats, output_dir, aggregator, bests=None, compress=None, threads=False):
+    """
+    Opens one streaming writer per (normalized) format, in EXPORT_FORMATS order
+    The Markdown writer reads its statistics from the aggregator, which the
+    caller feeds; with threads, JSON, NDJSON and compressed CSV writers run in
+    worker threads (see ThreadedWriter)
+    Returns (format, writer) pairs
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    writers = []
+    try:
+        for fmt in EXPORT_FORMATS:
+            if fmt not in formats:
+                continue
+            extension = 'md' if fmt == 'markdown' else fmt
+            filepath = os.path.join(output_dir, f'activexport_activities_{timestamp}.{extension}')
+            if fmt == 'markdown':
+                writer = MarkdownStreamWriter(filepath, aggregator, bests, compress=compress)
+            elif fmt in ('parquet', 'feather'):
+                writer = STREAM_WRITERS[fmt](filepath)
+            else:
+                writer = STREAM_WRITERS[fmt](filepath, compress)
+            if threads and (fmt in ('json', 'ndjson') or (fmt == 'csv' and compress)):
+                writer = ThreadedWriter(writer, fmt)
+            writers.append((fmt, writer))
+    except BaseException:
+        discard_writers(writers)
+        raise
+    return writers
+
+
+def write_page(writers, page):
+    """Hands a page of records to every writer (threaded writers time themselves)"""
+    for fmt, writer in writers:
+        if isinstance(writer, ThreadedWriter):
+            writer.write_page(page)
+        else:
+            with metrics.timer('export_duration_seconds', format=fmt):
+                writer.write_page(page)
+
+
+def close_writers(writers):
+    """
+    Completes every export file; a writer that fails does not keep the
+    others from completing, its error is raised once they are all closed
+    """
+    error = None
+    for fmt, writer in writers:
+        try:
+            if isinstance(writer, ThreadedWriter):
+                writer.close()
+            else:
+                with metrics.timer('export_duration_seconds', format=fmt):
+                    writer.close()
+        except Exception as e:
+            print(f"[X] {fmt} export failed: {e}")
+            error = error or e
+    if writers:
         print()
+    if error is not None:
+        raise error
+
 
+def discard_writers(writers):
+    """Drops every partial export file (the run failed before completing them)"""
+    for _, writer in writers:
+        try:
+            writer.discard()
+        except Exception:
+            pass
 
-def analyze_activities(activities):
-    """Displays summary of fetched activities"""
-    if not activities:
+
+def save_activities(records, formats, output_dir, aggregator=None, bests=None, compress=None,
+                    threads=False):
+    """
+    Save activity records to specified formats in a single pass: each page of
+    records is handed to the writer of every format, and what formats share
+    (the JSON text of each activity, the Markdown statistics) is computed once
+    JSON and NDJSON need records built with keep_raw (see needs_raw)
+    Text formats are compressed with compress when given (Parquet and
+    Feather are compressed internally); with threads, the heaviest writers
+    run in worker threads
+    Returns the paths of the files written
+    """
+    if not records:
+        print("[X] No activities to save")
+        return []
+
+    normalized_formats = normalize_formats(formats)
+    feed_aggregator = aggregator is None and 'markdown' in normalized_formats
+    if aggregator is None:
+        aggregator = ActivityAggregator()
+    encode_json = needs_raw(normalized_formats)
+
+    writers = open_writers(normalized_formats, output_dir, aggregator, bests, compress, threads)
+    try:
+        for start in range(0, len(records), EXPORT_PAGE_SIZE):
+            page = ExportPage(records[start:start + EXPORT_PAGE_SIZE], encode_json)
+            if feed_aggregator:
+                aggregator.add_many(page)
+            write_page(writers, page)
+    except BaseException:
+        discard_writers(writers)
+        raise
+    close_writers(writers)
+
+    return [writer.filepath for _, writer in writers]
+
+
+def stream_activities(pages, formats, output_dir, search_term=None, bests=None, compress=None,
+                      threads=False):
+    """
+    Streams pages of activities to the specified formats
+    Each page is written to disk as soon as it is received, so memory stays
+    flat; the files are renamed into place once the stream ends, and
+    discarded if it raises (progress is kept by the fetch checkpoint)
+    Returns the aggregator fed with every written activity
+    """
+    normalized_formats = normalize_formats(formats)
+    aggregator = ActivityAggregator()
+    keep_raw = needs_raw(normalized_formats)
+
+    writers = open_writers(normalized_formats, output_dir, aggregator, bests, compress, threads)
+    try:
+        for activities in pages:
+            records = to_records(activities, keep_raw)
+            if search_term:
+                records = search_records(records, search_term)
+            aggregator.add_many(records)
+            write_page(writers, ExportPage(records, keep_raw))
+    except BaseException:
+        discard_writers(writers)
+        raise
+    close_writers(writers)
+
+    return aggregator
+
+
+def analyze_activities(records, aggregator=None):
+    """
+    Displays summary of fetched activities
+    Uses the aggregator when given instead of re-scanning the records
+    """
+    if aggregator is None:
+        if not records:
+            return
+        aggregator = aggregate(records)
+    if not aggregator.count:
         return
 
     print("="*60)
@@ -305,86 +804,126 @@ def analyze_activities(activities):
     print("="*60 + "\n")
 
     # By sport type
-    sport_types = {}
-    for activity in activities:
-        sport = activity.get('sport_type', 'Unknown')
-        sport_types[sport] = sport_types.get(sport, 0) + 1
-
     print("Distribution by sport type:")
-    for sport, count in sorted(sport_types.items(), key=lambda x: x[1], reverse=True):
-        print(f"   {sport:20s}: {count:4d} activities")
+    for sport, sport_totals in aggregator.sports_by_count():
+        print(f"   {sport:20s}: {sport_totals['count']:4d} activities")
 
     # Covered period
-    dates = [datetime.fromisoformat(a['start_date'].replace('Z', '+00:00'))
-             for a in activities if 'start_date' in a]
-
-    if dates:
+    if aggregator.first_date:
         print(f"\nCovered period:")
-        print(f"   First activity: {min(dates).strftime('%d/%m/%Y')}")
-        print(f"   Last activity: {max(dates).strftime('%d/%m/%Y')}")
+        print(f"   First activity: {aggregator.first_date.strftime('%d/%m/%Y')}")
+        print(f"   Last activity: {aggregator.last_date.strftime('%d/%m/%Y')}")
 
     # Global statistics
-    total_distance = sum(a.get('distance', 0) for a in activities) / 1000
-    total_elevation = sum(a.get('total_elevation_gain', 0) for a in activities)
-    total_time = sum(a.get('moving_time', 0) for a in activities) / 3600
-
+    totals = aggregator.totals
     print(f"\nGlobal statistics:")
-    print(f"   Total distance: {total_distance:.1f} km")
-    print(f"   Total elevation: {total_elevation:.0f} m")
-    print(f"   Total time: {total_time:.1f} hours")
+    print(f"   Total distance: {totals['distance'] / 1000:.1f} km")
+    print(f"   Total elevation: {totals['elevation']:.0f} m")
+    print(f"   Total time: {totals['moving_time'] / 3600:.1f} hours")
 
     print("\n" + "="*60 + "\n")
 
 
-def find_activity_by_name(activities, search_term):
-    """Searches for an activity by name"""
-    matches = [a for a in activities if search_term.lower() in a.get('name', '').lower()]
+def display_record(record):
+    """Displays a one-activity summary"""
+    print(f"   [{record.start.strftime('%d/%m/%Y')}] {record.name}")
+    print(f"      {record.distance/1000:.2f} km - {record.elevation:.0f} m elevation")
+
+
+def find_activity_by_name(records, search_term, store_file=None):
+    """
+    Searches for activities by name, best matches first
+    Uses the search index of the local store when given, otherwise indexes
+    the records in memory
+    """
+    start = time.perf_counter()
+    if store_file:
+        store = open_store(store_file)
+        by_id = {r.id: r for r in records}
+        matches = [by_id.get(r.id, r) for r in search_stored_records(store, search_term)]
+        store.close()
+    else:
+        matches = search_records(records, search_term)
+    elapsed_ms = (time.perf_counter() - start) * 1000
 
     if matches:
-        print(f"\n{len(matches)} activity(ies) found containing '{search_term}':\n")
-        for activity in matches[:10]:  # Max 10 results
-            date = datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
-            print(f"   [{date.strftime('%d/%m/%Y')}] {activity['name']}")
-            print(f"      {activity.get('distance', 0)/1000:.2f} km - {activity.get('total_elevation_gain', 0):.0f} m elevation")
-            print(f"      ID: {activity['id']}")
+        print(f"\n{len(matches)} activity(ies) found matching '{search_term}' in {elapsed_ms:.1f} ms:\n")
+        for record in matches[:10]:  # Max 10 results
+            display_record(record)
+            print(f"      ID: {record.id}")
             print()
         return matches
     else:
-        print(f"\n[X] No activity found containing '{search_term}'")
+        print(f"\n[X] No activity found matching '{search_term}'")
         return []
 
 
 if __name__ == '__main__':
     # Parse arguments
     args = parse_arguments()
+    enable_metrics(args.metrics)
 
-    # Fetch all activities
-    activities = fetch_all_activities()
+    if not check_formats(args.formats) or not check_compression(args.compress):
+        sys.exit(1)
+
+    # Streaming mode: pages go straight to disk, nothing kept in memory
+    if args.stream:
+        aggregator = stream_activities(iter_activity_pages(checkpoint=open_checkpoint(args)), args.formats,
+                                       args.output, args.search, load_bests(args.formats, args.store),
+                                       args.compress, args.export_threads)
+        print(f"[OK] {aggregator.count} activities streamed\n")
+        analyze_activities(None, aggregator)
+        sys.exit(0 if aggregator.count else 1)
+
+    # Raw API JSON is only kept when a JSON export needs it
+    keep_raw = needs_raw(normalize_formats(args.formats))
+
+    # A search runs offline against the local store when there is one
+    search_store = args.store if args.search and os.path.exists(args.store) else None
+
+    # Backfill the store, then sync it as usual (only newer activities are left)
+    if args.backfill:
+        if not backfill_activities(args.store, args.workers, args.resume):
+            sys.exit(1)
+        args.sync = True
+
+    # Fetch all activities (or only new ones when syncing the local store)
+    if args.sync:
+        activities = sync_activities(args.store, keep_raw)
+        search_store = args.store
+    elif search_store:
+        print(f"[OK] Searching the local store ({search_store}), use --sync to fetch new activities first")
+        store = open_store(search_store)
+        activities = sorted_records(store, keep_raw)
+        store.close()
+    else:
+        activities = fetch_all_records(keep_raw, checkpoint=open_checkpoint(args))
 
     if activities:
         # Filter by search term if provided
         if args.search:
-            filtered_activities = find_activity_by_name(activities, args.search)
+            filtered_activities = find_activity_by_name(activities, args.search, search_store)
             export_activities = filtered_activities if filtered_activities else activities
         else:
             export_activities = activities
 
+        # Single aggregation pass shared by the Markdown export and the analysis
+        aggregator = aggregate(export_activities)
+
         # Save to specified formats if any
         if args.formats:
-            save_activities(export_activities, args.formats, args.output)
+            save_activities(export_activities, args.formats, args.output, aggregator,
+                            load_bests(args.formats, args.store), args.compress, args.export_threads)
 
         # Always display analysis
-        analyze_activities(export_activities)
+        analyze_activities(export_activities, aggregator)
 
         # Show recent examples if not searching
         if not args.search:
             print("RECENT ACTIVITY EXAMPLES:\n")
-            for activity in export_activities[:5]:
-                date = datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
-                print(f"   [{date.strftime('%d/%m/%Y')}] {activity['name']}")
-                print(f"      {activity.get('distance', 0)/1000:.2f} km - {activity.get('total_elevation_gain', 0):.0f} m elevation")
+            for record in export_activities[:5]:
+                display_record(record)
                 print()
     else:
         print("[X] Failed to fetch activities")
-        import sys
         sys.exit(1)
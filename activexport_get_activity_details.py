@@ -5,40 +5,64 @@ Exports activity details to multiple formats
 """
 
 import os
+import sys
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import requests
-from activexport_auth import get_valid_access_token
+from activexport_auth import (get_valid_access_token, get_athlete_id, bind_token_provider,
+                              current_token_provider)
+from activexport_cache import get_cache, disable_cache
+from activexport_checkpoint import BatchCheckpoint, checkpoint_key
+from activexport_client import api_get, configure_session
+from activexport_curves import HAS_NUMPY, get_efforts, write_markdown_efforts
+from activexport_metrics import metrics, enable_metrics
+from activexport_output import COMPRESSIONS, check_compression, open_output
+from activexport_ratelimit import RateLimitExceeded
+from activexport_store import STORE_FILE, open_store, get_activity_ids, save_details
+from activexport_streams import STREAMS_DIR, save_activity_streams
+from activexport_tracks import TRACK_FORMATS, export_track
 
 # Configuration
 DEFAULT_OUTPUT_DIR = './output'
-API_BASE = 'https://www.strava.com/api/v3'
+DEFAULT_WORKERS = 4
 
 
 def parse_arguments():
     """Parse command-line arguments"""
     parser = argparse.ArgumentParser(
-        description='Fetch detailed information for a specific activity.',
+        description='Fetch detailed information for one or many activities.',
         epilog='''Examples:
   %(prog)s 6018412458
   %(prog)s 6018412458 -f json md
-  %(prog)s 6018412458 -f json -o ./my_exports/''',
+  %(prog)s 6018412458 -f json -o ./my_exports/
+  %(prog)s 6018412458 6018412459 6018412460 -f json
+  %(prog)s --ids-file ids.txt -f json -j 8
+  cat ids.txt | %(prog)s --ids-file - -f md
+  %(prog)s --all-stored -f json
+  %(prog)s 6018412458 --streams
+  %(prog)s --all-stored -f gpx -o ./tracks/
+  %(prog)s --all-stored --streams --checkpoint
+  %(prog)s --all-stored --streams --resume
+  %(prog)s --all-stored -f json -f gpx --compress gzip''',
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
 
     parser.add_argument(
-        'activity_id',
-        help='Activity ID'
+        'activity_ids',
+        nargs='*',
+        metavar='activity_id',
+        help='Activity ID(s)'
     )
 
     parser.add_argument(
         '-f', '--format',
         action='append',
-        choices=['json', 'md', 'markdown'],
+        choices=['json', 'md', 'markdown', 'gpx', 'tcx'],
         dest='formats',
         metavar='FORMAT',
-        help='Output format(s): json, md/markdown (default: stdout only). Can be specified multiple times for multiple formats'
+        help='Output format(s): json, md/markdown, gpx, tcx (default: stdout only). Can be specified multiple times for multiple formats. '
+             'GPX/TCX tracks are built from the activity streams, downloaded if needed'
     )
 
     parser.add_argument(
@@ -47,31 +71,255 @@ def parse_arguments():
         help=f'Output directory path (default: {DEFAULT_OUTPUT_DIR})'
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--compress',
+        choices=COMPRESSIONS,
+        help='Compress exports while writing them: gzip, zstd (needs zstandard) or xz'
+    )
+
+    parser.add_argument(
+        '--ids-file',
+        metavar='FILE',
+        help='Read activity IDs from a file, one per line (use - for stdin)'
+    )
+
+    parser.add_argument(
+        '--all-stored',
+        action='store_true',
+        help='Fetch details for every activity in the local store (see --sync)'
+    )
+
+    parser.add_argument(
+        '--store',
+        default=STORE_FILE,
+        help=f'Local activity store used by --all-stored; fetched details are recorded in it when it exists (default: {STORE_FILE})'
+    )
+
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Number of concurrent requests in batch mode (default: {DEFAULT_WORKERS})'
+    )
+
+    parser.add_argument(
+        '--streams',
+        action='store_true',
+        help='Also download time series (GPS, HR, cadence, altitude, power) as binary streams files'
+    )
+
+    parser.add_argument(
+        '--streams-dir',
+        default=STREAMS_DIR,
+        help=f'Directory of binary streams files (default: {STREAMS_DIR})'
+    )
 
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Bypass the on-disk response cache and always query the API (streams are downloaded again)'
+    )
 
-def get_activity_details(activity_id):
-    """Fetches complete details of an activity"""
+    parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help='Batch mode: save each activity done, so an interrupted run (e.g. stopped by the daily '
+             'API limit) can continue with --resume'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Batch mode: skip activities already done by an interrupted run of the same batch '
+             '(same activities and options, implies --checkpoint)'
+    )
+
+    parser.add_argument(
+        '--metrics',
+        action='append',
+        metavar='FILE',
+        help='Write run metrics (API latency, bytes, retries, 429s, export times) on exit: '
+             'Prometheus text format for .prom files, JSON otherwise. Can be specified multiple times'
+    )
+
+    args = parser.parse_args()
+    if not (args.activity_ids or args.ids_file or args.all_stored):
+        parser.error('at least one activity ID, --ids-file or --all-stored is required')
+    return args
+
+
+def read_activity_ids(args):
+    """Collects activity IDs from argv, a file/stdin and the local store (deduplicated)"""
+    activity_ids = list(args.activity_ids)
+
+    if args.ids_file:
+        if args.ids_file == '-':
+            lines = sys.stdin.read().split()
+        else:
+            with open(args.ids_file, 'r', encoding='utf-8') as f:
+                lines = f.read().split()
+        activity_ids.extend(line.strip() for line in lines if line.strip())
+
+    if args.all_stored:
+        store = open_store(args.store)
+        activity_ids.extend(str(activity_id) for activity_id in get_activity_ids(store))
+        store.close()
+
+    return list(dict.fromkeys(activity_ids))
+
+
+def fetch_activity_details(activity_id, access_token, cache_scope=None):
+    """
+    Fetches complete details of an activity (raises on error)
+    Served from the response cache when a cache_scope (athlete) is given
+    """
+    response = api_get(f'/activities/{activity_id}', access_token, cache_scope=cache_scope)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_activity(activity_id, access_token=None, cache_scope=None, streams_dir=None, refresh=False):
+    """
+    Fetches details of an activity, and its streams when a streams_dir is given
+    (streams already downloaded are kept unless refresh is set)
+    Without an access_token, the current athlete's token provider is used
+    (long batches keep working across token expiry)
+    Returns (activity, streams result of save_activity_streams)
+    """
+    access_token = access_token or current_token_provider().get_access_token()
+    activity = fetch_activity_details(activity_id, access_token, cache_scope)
+    streams = None
+    if streams_dir:
+        streams = save_activity_streams(activity_id, access_token, streams_dir, refresh)
+    return activity, streams
+
+
+def display_streams_result(activity_id, streams):
+    """Displays where streams were saved"""
+    if streams is None:
+        print(f"      Streams already stored for {activity_id}")
+        return
+    filepath, size, json_size = streams
+    print(f"[OK] Streams saved to: {filepath} ({size / 1024:.0f} KB, {json_size / 1024:.0f} KB as JSON)")
+
+
+def get_best_efforts(activity, efforts_dir, store=None):
+    """
+    Best efforts of an activity from its downloaded streams, cached in the
+    store when given (None without streams or numpy)
+    """
+    if not efforts_dir or not HAS_NUMPY:
+        return None
+    return get_efforts(store, activity['id'], activity.get('sport_type'), efforts_dir)
+
+
+def get_activity_details(activity_id, streams_dir=None, refresh=False):
+    """Fetches complete details of an activity (and its streams if a streams_dir is given)"""
     access_token = get_valid_access_token()
     if not access_token:
         print("[X] Unable to get valid token")
         return None
 
-    headers = {'Authorization': f'Bearer {access_token}'}
-
     try:
-        response = requests.get(
-            f'{API_BASE}/activities/{activity_id}',
-            headers=headers
-        )
-        response.raise_for_status()
-        return response.json()
+        activity, streams = fetch_activity(activity_id, access_token, get_athlete_id(),
+                                           streams_dir, refresh)
+        if streams_dir:
+            display_streams_result(activity_id, streams)
+        return activity
 
     except Exception as e:
         print(f"[X] Error: {e}")
         return None
 
 
+def get_activities_details(activity_ids, formats, output_dir, workers=DEFAULT_WORKERS, store=None,
+                           streams_dir=None, refresh=False, efforts_dir=None, checkpoint=None,
+                           compress=None):
+    """
+    Fetches details of many activities concurrently
+    Each activity is saved as soon as its result arrives (and recorded in the
+    local store if one is given); streams are downloaded by the same worker
+    when a streams_dir is given, best efforts computed from efforts_dir
+    Saved activities are marked done in the checkpoint (see
+    activexport_checkpoint), which is removed once every activity is done
+    Returns the number of activities fetched
+    """
+    access_token = get_valid_access_token()
+    if not access_token:
+        print("[X] Unable to get valid token")
+        return 0
+
+    print("\n" + "="*60)
+    print(f"FETCHING {len(activity_ids)} ACTIVITY DETAILS ({workers} workers)")
+    print("="*60 + "\n")
+
+    configure_session(pool_size=workers)
+    cache_scope = get_athlete_id()
+    fetched = 0
+    failed = 0
+    stopped = False
+
+    # Workers use the tokens of the athlete this batch runs for
+    with ThreadPoolExecutor(max_workers=workers, initializer=bind_token_provider,
+                            initargs=(current_token_provider(),)) as executor:
+        futures = {
+            executor.submit(fetch_activity, activity_id, None, cache_scope,
+                            streams_dir, refresh): activity_id
+            for activity_id in activity_ids
+        }
+
+        for future in as_completed(futures):
+            activity_id = futures[future]
+            if future.cancelled():
+                continue
+
+            try:
+                activity, streams = future.result()
+            except RateLimitExceeded as e:
+                if not stopped:
+                    stopped = True
+                    print(f"[X] {e}")
+                    print("    Cancelling remaining activities...")
+                    for pending in futures:
+                        pending.cancel()
+                continue
+            except Exception as e:
+                print(f"[X] Activity {activity_id}: {e}")
+                failed += 1
+                continue
+
+            fetched += 1
+            print(f"[{fetched}/{len(activity_ids)}] {activity.get('name', 'N/A')} (ID: {activity_id})")
+            if streams_dir:
+                display_streams_result(activity_id, streams)
+            if store is not None:
+                save_details(store, activity)
+            efforts = get_best_efforts(activity, efforts_dir, store)
+            if formats:
+                save_activity(activity, formats, output_dir, efforts, streams_dir, compress)
+            if checkpoint is not None:
+                checkpoint.mark_done(activity_id)
+
+    print("="*60)
+    print(f"TOTAL: {fetched} activities fetched, {failed} failed, "
+          f"{len(activity_ids) - fetched - failed} not fetched")
+    cache = get_cache()
+    if cache is not None:
+        print(f"CACHE: {cache.hits} fresh, {cache.revalidated} revalidated (304), "
+              f"{cache.misses} downloaded")
+    print("="*60 + "\n")
+
+    if checkpoint is not None:
+        if fetched == len(activity_ids):
+            checkpoint.complete()
+        else:
+            checkpoint.close()
+            print(f"[!] {len(activity_ids) - fetched} activities left, progress saved in {checkpoint.filepath}")
+            print("    Run the same command with --resume to continue from there\n")
+
+    return fetched
+
+
 def display_activity(activity):
     """Displays activity details"""
     if not activity:
@@ -137,25 +385,24 @@ def display_activity(activity):
     print("\n" + "="*60 + "\n")
 
 
-def export_to_json(activity, filepath):
+def export_to_json(activity, filepath, compress=None):
     """Export activity to JSON format"""
     if not activity:
         return
 
-    with open(filepath, 'w', encoding='utf-8') as f:
+    with open_output(filepath, compress) as f:
         json.dump(activity, f, indent=2, ensure_ascii=False)
 
-    file_size_kb = os.path.getsize(filepath) / 1024
-    print(f"[OK] JSON exported to: {filepath}")
-    print(f"     File size: {file_size_kb:.2f} KB")
+    print(f"[OK] JSON exported to: {f.filepath}")
+    print(f"     File size: {f.size_text()}")
 
 
-def export_to_markdown(activity, filepath):
-    """Export activity to Markdown format"""
+def export_to_markdown(activity, filepath, efforts=None, compress=None):
+    """Export activity to Markdown format (with best efforts when given)"""
     if not activity:
         return
 
-    with open(filepath, 'w', encoding='utf-8') as f:
+    with open_output(filepath, compress) as f:
         # Header
         name = activity.get('name', 'N/A')
         f.write(f"# Activity Details: {name}\n\n")
@@ -237,11 +484,18 @@ def export_to_markdown(activity, filepath):
             except UnicodeEncodeError:
                 f.write("[Contains special characters]\n")
 
-    print(f"[OK] Markdown exported to: {filepath}")
+        # Best efforts from the activity streams
+        write_markdown_efforts(f, efforts)
+
+    print(f"[OK] Markdown exported to: {f.filepath}")
+    print(f"     File size: {f.size_text()}")
 
 
-def save_activity(activity, formats, output_dir):
-    """Save activity to specified formats"""
+def save_activity(activity, formats, output_dir, efforts=None, streams_dir=STREAMS_DIR, compress=None):
+    """
+    Save activity to specified formats (GPX/TCX tracks from the streams in streams_dir),
+    compressed with compress when given
+    """
     if not activity:
         print("[X] No activity to save")
         return
@@ -263,11 +517,19 @@ def save_activity(activity, formats, output_dir):
     # Export to each format
     if 'json' in normalized_formats:
         filepath = os.path.join(output_dir, f'activity_{activity_id}.json')
-        export_to_json(activity, filepath)
+        with metrics.timer('export_duration_seconds', format='json'):
+            export_to_json(activity, filepath, compress)
 
     if 'markdown' in normalized_formats:
         filepath = os.path.join(output_dir, f'activity_{activity_id}.md')
-        export_to_markdown(activity, filepath)
+        with metrics.timer('export_duration_seconds', format='markdown'):
+            export_to_markdown(activity, filepath, efforts, compress)
+
+    for fmt in TRACK_FORMATS:
+        if fmt in normalized_formats:
+            filepath = os.path.join(output_dir, f'activity_{activity_id}.{fmt}')
+            with metrics.timer('export_duration_seconds', format=fmt):
+                export_track(activity, fmt, filepath, streams_dir or STREAMS_DIR, compress)
 
     if normalized_formats:
         print()
@@ -276,18 +538,74 @@ def save_activity(activity, formats, output_dir):
 if __name__ == '__main__':
     # Parse arguments
     args = parse_arguments()
+    enable_metrics(args.metrics)
+    if not check_compression(args.compress):
+        sys.exit(1)
+
+    # --all-stored reads the store, it is not created empty here
+    if args.all_stored and not os.path.exists(args.store):
+        print(f"[X] No local store found ({args.store})")
+        print("    Run first: python activexport_fetch_activities.py --sync")
+        sys.exit(1)
+    activity_ids = read_activity_ids(args)
+
+    if args.no_cache:
+        disable_cache()
+
+    # Fetched details are recorded in the local store when it exists
+    store = open_store(args.store) if os.path.exists(args.store) else None
+
+    # Streams are downloaded on request, or when GPX/TCX tracks need them
+    wants_tracks = any(fmt in TRACK_FORMATS for fmt in args.formats or [])
+    streams_dir = args.streams_dir if args.streams or wants_tracks else None
+
+    # Best efforts are computed from downloaded streams for the Markdown
+    # report, and cached in the store
+    wants_markdown = any(fmt in ('md', 'markdown') for fmt in args.formats or [])
+    efforts_dir = args.streams_dir if wants_markdown or store is not None else None
+
+    # Batch mode: many activities fetched concurrently
+    if len(activity_ids) != 1 or args.ids_file or args.all_stored:
+        if not activity_ids:
+            print("[X] No activity ID to fetch")
+            sys.exit(1)
+
+        # Progress saved on request; activities done by an interrupted run
+        # of the same batch are skipped with --resume
+        checkpoint = None
+        if args.checkpoint or args.resume:
+            checkpoint = BatchCheckpoint(checkpoint_key(
+                sorted(activity_ids), sorted(args.formats or []), os.path.abspath(args.output),
+                args.compress, streams_dir and os.path.abspath(streams_dir)))
+            done = checkpoint.open(args.resume)
+            if done is None:
+                sys.exit(1)
+            if done:
+                activity_ids = [activity_id for activity_id in activity_ids if activity_id not in done]
+                print(f"[OK] Resuming: {len(done)} activities already done, {len(activity_ids)} left")
+                if not activity_ids:
+                    checkpoint.complete()
+                    sys.exit(0)
+
+        if not get_activities_details(activity_ids, args.formats, args.output, args.workers, store,
+                                      streams_dir, args.no_cache, efforts_dir, checkpoint, args.compress):
+            sys.exit(1)
+        sys.exit(0)
 
     # Fetch activity details
-    activity = get_activity_details(args.activity_id)
+    activity = get_activity_details(activity_ids[0], streams_dir, args.no_cache)
 
     if activity:
+        if store is not None:
+            save_details(store, activity)
+
         # Always display to stdout
         display_activity(activity)
 
         # Save to specified formats if any
+        efforts = get_best_efforts(activity, efforts_dir, store)
         if args.formats:
-            save_activity(activity, args.formats, args.output)
+            save_activity(activity, args.formats, args.output, efforts, args.streams_dir, args.compress)
     else:
         print("[X] Failed to fetch activity details")
-        import sys
         sys.exit(1)
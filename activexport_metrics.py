@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Run metrics
+Counters and latency histograms for API calls and export stages, written on
+exit as a JSON summary or in the Prometheus text format (node_exporter
+textfile collector) when --metrics is given
+"""
+
+import os
+import re
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from activexport_ratelimit import rate_limiter
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = 'activexport_'
+
+HELP = {
+    'api_requests_total': ('counter', 'API requests by endpoint and HTTP status'),
+    'api_request_duration_seconds': ('histogram', 'API request latency by endpoint'),
+    'api_response_bytes_total': ('counter', 'API response body bytes received (decompressed)'),
+    'api_retries_total': ('counter', 'Transport-level retries (5xx, connection resets)'),
+    'api_throttled_total': ('counter', 'API responses with status 429'),
+    'cache_requests_total': ('counter', 'Cacheable API calls by result (hit, revalidated, miss)'),
+    'token_refreshes_total': ('counter', 'OAuth access token refreshes'),
+    'webhook_events_total': ('counter', 'Webhook events by object type and result'),
+    'export_duration_seconds': ('histogram', 'Time spent writing exports by format'),
+    'rate_limit_headroom': ('gauge', 'Remaining API requests in the rate limit window'),
+    'rate_limit_sleep_seconds_total': ('counter', 'Time spent waiting for the rate limit'),
+    'run_duration_seconds': ('gauge', 'Wall time of the run'),
+    'last_run_timestamp_seconds': ('gauge', 'End time of the last run (epoch seconds)'),
+}
+
+
+def endpoint_name(path):
+    """API path with IDs replaced ('/activities/{id}/streams'), used as a label"""
+    path = re.sub(r'^https?://[^/]+(/api/v3)?', '', path.split('?')[0])
+    return re.sub(r'/\d+', '/{id}', path)
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics)"""
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimated quantile, interpolated within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            if count and cumulative + count >= rank:
+                return min(lower + (bound - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'mean': round(self.sum / self.count, 4) if self.count else None,
+            'p50': round(self.quantile(0.5), 4) if self.count else None,
+            'p95': round(self.quantile(0.95), 4) if self.count else None,
+            'max': round(self.max, 4),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe metrics registry; recording is a no-op until enabled, so
+    runs without --metrics pay nothing
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.started_at = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of a block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe_request(self, path, response, elapsed):
+        """Records one API exchange (latency, status, bytes, retries)"""
+        if not self.enabled:
+            return
+        endpoint = endpoint_name(path)
+        self.observe('api_request_duration_seconds', elapsed, endpoint=endpoint)
+        self.inc('api_requests_total', endpoint=endpoint, status=str(response.status_code))
+
+        # Decompressed body: the size on the wire is not known for chunked gzip responses
+        self.inc('api_response_bytes_total', len(response.content), endpoint=endpoint)
+        retries = getattr(getattr(response, 'raw', None), 'retries', None)
+        if retries is not None and retries.history:
+            self.inc('api_retries_total', len(retries.history), endpoint=endpoint)
+        if response.status_code == 429:
+            self.inc('api_throttled_total')
+
+    def _total(self, name):
+        return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def _by_label(self, name, label):
+        totals = {}
+        for (key, labels), value in self.counters.items():
+            if key == name:
+                group = dict(labels).get(label)
+                totals[group] = totals.get(group, 0) + value
+        return totals
+
+    def _samples(self):
+        """Gauges computed at write time from the rate limiter and the clock"""
+        now = time.time()
+        headroom_15min, headroom_day = rate_limiter.headroom()
+        return now, [
+            ('rate_limit_headroom', (('window', '15min'),), headroom_15min),
+            ('rate_limit_headroom', (('window', 'day'),), headroom_day),
+            ('rate_limit_sleep_seconds_total', (), round(rate_limiter.sleep_time, 3)),
+            ('run_duration_seconds', (), round(now - self.started_at, 3)),
+            ('last_run_timestamp_seconds', (), int(now)),
+        ]
+
+    def summary(self):
+        """Metrics as a JSON-friendly dict"""
+        with self.lock:
+            wall = time.time() - self.started_at
+            request_time = sum(h.sum for (name, _), h in self.histograms.items()
+                               if name == 'api_request_duration_seconds')
+
+            endpoints = {}
+            for (name, labels), histogram in self.histograms.items():
+                if name == 'api_request_duration_seconds':
+                    endpoints[dict(labels)['endpoint']] = {'latency': histogram.summary()}
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if 'endpoint' not in labels:
+                    continue
+                endpoint = endpoints.setdefault(labels['endpoint'], {})
+                if name == 'api_requests_total':
+                    endpoint.setdefault('status', {})[labels['status']] = value
+                elif name == 'api_response_bytes_total':
+                    endpoint['bytes'] = value
+                elif name == 'api_retries_total':
+                    endpoint['retries'] = value
+
+            headroom_15min, headroom_day = rate_limiter.headroom()
+            return {
+                'run': {
+                    'started_at': int(self.started_at),
+                    'wall_seconds': round(wall, 3),
+                    'request_seconds': round(request_time, 3),
+                    'rate_limit_sleep_seconds': round(rate_limiter.sleep_time, 3),
+                    'working_seconds': round(wall - rate_limiter.sleep_time, 3),
+                },
+                'api': {
+                    'requests': self._total('api_requests_total'),
+                    'bytes': self._total('api_response_bytes_total'),
+                    'retries': self._total('api_retries_total'),
+                    'throttled': self._total('api_throttled_total'),
+                    'endpoints': endpoints,
+                },
+                'cache': self._by_label('cache_requests_total', 'result'),
+                'token_refreshes': self._total('token_refreshes_total'),
+                'rate_limit': {'headroom_15min': headroom_15min, 'headroom_day': headroom_day},
+                'exports': {dict(labels)['format']: histogram.summary()
+                            for (name, labels), histogram in self.histograms.items()
+                            if name == 'export_duration_seconds'},
+            }
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        def label_text(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+        with self.lock:
+            _, gauges = self._samples()
+            series = {}
+            for (name, labels), value in self.counters.items():
+                series.setdefault(name, []).append(f'{PREFIX}{name}{label_text(labels)} {value}')
+            for name, labels, value in gauges:
+                series.setdefault(name, []).append(f'{PREFIX}{name}{label_text(labels)} {value}')
+            for (name, labels), histogram in self.histograms.items():
+                lines = series.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}{name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{PREFIX}{name}_bucket{label_text(labels, [("le", "+Inf")])} {histogram.count}')
+                lines.append(f'{PREFIX}{name}_sum{label_text(labels)} {histogram.sum:.6f}')
+                lines.append(f'{PREFIX}{name}_count{label_text(labels)} {histogram.count}')
+
+        output = []
+        for name in sorted(series):
+            kind, description = HELP.get(name, ('untyped', name))
+            output.append(f'# HELP {PREFIX}{name} {description}')
+            output.append(f'# TYPE {PREFIX}{name} {kind}')
+            output.extend(series[name])
+        return '\n'.join(output) + '\n'
+
+    def write(self, filepath):
+        """
+        Writes the metrics (Prometheus text for .prom files, JSON otherwise)
+        Replaced atomically, as the textfile collector requires
+        """
+        if filepath.endswith('.prom'):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2) + '\n'
+
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        tmp_path = f'{filepath}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, filepath)
+
+
+# Shared registry for all scripts of this process
+metrics = Metrics()
+
+
+def enable_metrics(filepaths):
+    """Starts recording; the metrics files are written when the process exits"""
+    if not filepaths:
+        return
+
+    def write_all():
+        for filepath in filepaths:
+            metrics.write(filepath)
+            print(f"[OK] Metrics written to: {filepath}")
+
+    metrics.enable()
+    atexit.register(write_all)
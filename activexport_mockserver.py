@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Local mock Strava API server
+Serves activity pages, activity details, streams and the OAuth endpoints from
+deterministic synthetic fixtures, with optional latency, 429 injection and
+rate limit headers, so the scripts can be run and benchmarked offline
+"""
+
+import re
+import gzip
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+from activexport_ratelimit import WINDOW_15MIN, WINDOW_DAY
+
+DEFAULT_PORT = 8010
+DEFAULT_ACTIVITIES = 1000
+
+# Synthetic history: activities evenly spread over the years before today
+HISTORY_SPAN = 10 * 365 * 24 * 3600
+FIRST_ID = 10_000_000_000
+ATHLETE_ID = 1000
+TOKEN_LIFETIME = 6 * 3600
+
+# Strava caps page size at 200
+MAX_PAGE_SIZE = 200
+
+# Responses smaller than this are sent uncompressed
+GZIP_MIN_SIZE = 1024
+
+# sport_type: (speed range m/s, names)
+SPORTS = {
+    'Run': ((2.6, 3.8), ['Morning Run', 'Lunch Run', 'Evening Run', 'Sortie longue', 'Fractionné']),
+    'Ride': ((6.0, 9.5), ['Morning Ride', 'Sortie vélo', 'Col du Galibier', 'Gravel du dimanche']),
+    'Walk': ((1.1, 1.6), ['Afternoon Walk', 'Balade']),
+    'Hike': ((0.9, 1.4), ['Randonnée', 'Mountain Hike']),
+    'Swim': ((0.7, 1.2), ['Natation', 'Pool Swim']),
+    'VirtualRide': ((7.0, 10.0), ['Zwift - Watopia', 'Home trainer']),
+}
+SPORT_WEIGHTS = [45, 30, 10, 6, 5, 4]
+INDOOR_SPORTS = {'Swim', 'VirtualRide'}
+
+# Streams are drawn from this many synthetic recordings per sport, encoded
+# once, so serving them stays cheap next to the client being measured
+STREAM_RECORDINGS = 8
+
+ACTIVITY_PATH = re.compile(r'^/api/v3/activities/(\d+)(/streams)?$')
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Fixtures:
+    """
+    Synthetic activity history, generated on demand from (seed, index) so
+    100k activities cost no memory; index 0 is the most recent activity
+    """
+
+    def __init__(self, count=DEFAULT_ACTIVITIES, seed=0, end_epoch=None):
+        self.count = count
+        self.seed = seed
+        self.end_epoch = end_epoch or int(time.time()) // 86400 * 86400
+        self.step = max(HISTORY_SPAN // max(count, 1), 1)
+
+    def activity_id(self, index):
+        return FIRST_ID + self.count - index
+
+    def index_of(self, activity_id):
+        """Index of an activity ID (None if unknown)"""
+        index = FIRST_ID + self.count - activity_id
+        return index if 0 <= index < self.count else None
+
+    def start_epoch(self, index):
+        return self.end_epoch - (index + 1) * self.step
+
+    def _rng(self, index, salt=0):
+        return random.Random(self.seed * 1_000_003 + index * 7 + salt)
+
+    def summary(self, index):
+        """Activity as listed by /athlete/activities"""
+        rng = self._rng(index)
+        sport = rng.choices(list(SPORTS), SPORT_WEIGHTS)[0]
+        (low, high), names = SPORTS[sport]
+        speed = rng.uniform(low, high)
+        moving_time = rng.randint(20, 180) * 60
+        elapsed_time = moving_time + rng.randint(0, 20) * 60
+        has_heartrate = rng.random() < 0.8
+        start = self.start_epoch(index)
+        activity = {
+            'resource_state': 2,
+            'athlete': {'id': ATHLETE_ID, 'resource_state': 1},
+            'name': rng.choice(names),
+            'distance': round(speed * moving_time, 1),
+            'moving_time': moving_time,
+            'elapsed_time': elapsed_time,
+            'total_elevation_gain': 0.0 if sport in INDOOR_SPORTS else round(rng.uniform(0, 1500), 1),
+            'type': sport,
+            'sport_type': sport,
+            'id': self.activity_id(index),
+            'start_date': _iso(start),
+            'start_date_local': _iso(start + 3600),
+            'timezone': '(GMT+01:00) Europe/Paris',
+            'trainer': sport in INDOOR_SPORTS,
+            'kudos_count': rng.randint(0, 40),
+            'achievement_count': rng.randint(0, 10),
+            'average_speed': round(speed, 3),
+            'max_speed': round(speed * rng.uniform(1.2, 1.8), 3),
+            'has_heartrate': has_heartrate,
+            'gear_id': f'g{rng.randint(1, 4)}' if sport in ('Run', 'Ride') else None,
+        }
+        if has_heartrate:
+            activity['average_heartrate'] = round(rng.uniform(120, 160), 1)
+            activity['max_heartrate'] = float(rng.randint(165, 195))
+        return activity
+
+    def detail(self, index):
+        """Activity as returned by /activities/{id}"""
+        activity = self.summary(index)
+        rng = self._rng(index, 1)
+        activity.update({
+            'resource_state': 3,
+            'description': rng.choice(['', 'Bonnes sensations', 'Legs felt heavy', 'Avec le club']),
+            'calories': round(activity['moving_time'] * rng.uniform(8, 14) / 60, 1),
+            'device_name': rng.choice(['Garmin Forerunner 965', 'Wahoo ELEMNT', 'Strava App']),
+            'elev_high': round(rng.uniform(100, 2500), 1),
+            'elev_low': round(rng.uniform(0, 100), 1),
+            'splits_metric': [
+                {'split': km + 1, 'distance': 1000.0,
+                 'moving_time': round(1000 / activity['average_speed'])}
+                for km in range(int(activity['distance'] // 1000))
+            ],
+            'segment_efforts': [],
+        })
+        if activity['sport_type'] in ('Ride', 'VirtualRide'):
+            activity['average_watts'] = round(rng.uniform(150, 260), 1)
+        return activity
+
+    def recording(self, index):
+        """Synthetic recording used for the streams of an activity"""
+        activity = self.summary(index)
+        return activity['sport_type'], activity['has_heartrate'], index % STREAM_RECORDINGS
+
+    def streams(self, recording, keys):
+        """Streams (key_by_type) of a recording, sampled every second"""
+        sport, has_heartrate, variant = recording
+        rng = random.Random(f'{self.seed}:{sport}:{variant}')
+        (low, high), _ = SPORTS[sport]
+        speed = rng.uniform(low, high)
+        points = rng.randint(20, 180) * 60
+        indoor = sport in INDOOR_SPORTS
+
+        lat, lng = 45.0 + rng.uniform(-1, 1), 6.0 + rng.uniform(-1, 1)
+        heading = rng.uniform(0, 2 * math.pi)
+        altitude = rng.uniform(100, 1500)
+        distance = 0.0
+        series = {key: [] for key in ('time', 'latlng', 'distance', 'altitude', 'velocity_smooth',
+                                      'heartrate', 'cadence', 'watts', 'moving', 'grade_smooth')}
+        for t in range(points):
+            velocity = max(speed * (1 + 0.15 * math.sin(t / 97) + rng.uniform(-0.05, 0.05)), 0.1)
+            grade = 6 * math.sin(t / 613)
+            distance += velocity
+            altitude += velocity * grade / 100
+            heading += rng.uniform(-0.05, 0.05)
+            lat += velocity * math.cos(heading) / 111_320
+            lng += velocity * math.sin(heading) / (111_320 * math.cos(math.radians(lat)))
+            series['time'].append(t)
+            series['latlng'].append([round(lat, 6), round(lng, 6)])
+            series['distance'].append(round(distance, 1))
+            series['altitude'].append(round(altitude, 1))
+            series['velocity_smooth'].append(round(velocity, 2))
+            series['heartrate'].append(int(130 + 25 * (1 - math.exp(-t / 600)) + rng.uniform(-3, 3)))
+            series['cadence'].append(int((85 if sport == 'Run' else 88) + rng.uniform(-4, 4)))
+            series['watts'].append(int(max(200 + 4 * grade * 10 + rng.uniform(-30, 30), 0)))
+            series['moving'].append(True)
+            series['grade_smooth'].append(round(grade, 1))
+
+        if indoor:
+            del series['latlng']
+        if not has_heartrate:
+            del series['heartrate']
+        if sport not in ('Ride', 'VirtualRide'):
+            del series['watts']
+
+        return {
+            key: {'data': data, 'series_type': 'distance', 'original_size': points, 'resolution': 'high'}
+            for key, data in series.items() if key in keys
+        }
+
+    def page(self, page, per_page, after=None, before=None):
+        """
+        Activities of one page, newest first (oldest first when after is
+        given, as the Strava API does)
+        """
+        # Indexes are in decreasing start date order: [low, high) match the bounds
+        low, high = 0, self.count
+        if before is not None:
+            low = max(math.floor((self.end_epoch - before) / self.step), 0)
+        if after is not None:
+            high = min(max(math.ceil((self.end_epoch - after) / self.step) - 1, 0), self.count)
+
+        offset = (page - 1) * per_page
+        if after is not None:
+            indexes = range(high - 1 - offset, max(high - 1 - offset - per_page, low - 1), -1)
+        else:
+            indexes = range(low + offset, min(low + offset + per_page, high))
+        return [self.summary(index) for index in indexes]
+
+    def athlete(self):
+        return {'id': ATHLETE_ID, 'username': 'mock_athlete', 'resource_state': 3,
+                'firstname': 'Mock', 'lastname': 'Athlete', 'city': 'Grenoble', 'country': 'France'}
+
+
+class MockStravaServer(ThreadingHTTPServer):
+    """
+    Threaded mock API server
+    Enforces Strava-like 15-minute / daily read limits (natural windows) and
+    reports them in the rate limit headers; stats are served on /_mock/stats
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0.0, error_rate=0.0,
+                 limit_15min=100_000, limit_day=1_000_000, retry_after=1, token_lifetime=TOKEN_LIFETIME):
+        super().__init__(address, MockStravaHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limit_15min = limit_15min
+        self.limit_day = limit_day
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.lock = threading.Lock()
+        self.random = random.Random(fixtures.seed)
+        self.usage_15min = 0
+        self.usage_day = 0
+        self.window_15min = None
+        self.window_day = None
+        self.encoded_streams = {}
+        self.requests = Counter()
+        self.throttled = 0
+        self.bytes_sent = 0
+
+    def consume(self):
+        """
+        Counts one API request against the limits
+        Returns (status, headers): 429 when limited or injected, else 200
+        """
+        with self.lock:
+            now = time.time()
+            window_15min = int(now // WINDOW_15MIN) * WINDOW_15MIN
+            window_day = int(now // WINDOW_DAY) * WINDOW_DAY
+            if window_15min != self.window_15min:
+                self.window_15min, self.usage_15min = window_15min, 0
+            if window_day != self.window_day:
+                self.window_day, self.usage_day = window_day, 0
+
+            limited = self.usage_15min >= self.limit_15min or self.usage_day >= self.limit_day
+            self.usage_15min += 1
+            self.usage_day += 1
+            injected = not limited and self.random.random() < self.error_rate
+            if limited or injected:
+                self.throttled += 1
+
+            limits = f'{self.limit_15min},{self.limit_day}'
+            usage = f'{self.usage_15min},{self.usage_day}'
+
+        headers = {
+            'X-RateLimit-Limit': limits, 'X-RateLimit-Usage': usage,
+            'X-ReadRateLimit-Limit': limits, 'X-ReadRateLimit-Usage': usage,
+        }
+        if injected:
+            # Injected errors are transient: tell the client when to retry
+            headers['Retry-After'] = str(self.retry_after)
+        return (429 if limited or injected else 200), headers
+
+    def streams_body(self, index, keys):
+        """Encoded streams response of an activity (JSON bytes)"""
+        key = (self.fixtures.recording(index), frozenset(keys))
+        body = self.encoded_streams.get(key)
+        if body is None:
+            body = json.dumps(self.fixtures.streams(*key), separators=(',', ':')).encode('utf-8')
+            self.encoded_streams[key] = body
+        return body
+
+    def issue_token(self, include_athlete):
+        """OAuth token response; the access token encodes its expiry"""
+        expires_at = int(time.time()) + self.token_lifetime
+        token = {
+            'token_type': 'Bearer',
+            'access_token': f'mock-{expires_at}-{self.random.getrandbits(64):016x}',
+            'refresh_token': f'mock-refresh-{self.random.getrandbits(64):016x}',
+            'expires_at': expires_at,
+            'expires_in': self.token_lifetime,
+        }
+        if include_athlete:
+            token['athlete'] = self.fixtures.athlete()
+        return token
+
+    def stats(self):
+        with self.lock:
+            return {'activities': self.fixtures.count, 'requests': dict(self.requests),
+                    'total_requests': sum(self.requests.values()), 'throttled': self.throttled,
+                    'bytes_sent': self.bytes_sent}
+
+
+def _token_expired(authorization):
+    """True if the bearer token is a mock token past its expiry"""
+    match = re.match(r'Bearer mock-(\d+)-', authorization or '')
+    return match is not None and int(match.group(1)) < time.time()
+
+
+class MockStravaHandler(BaseHTTPRequestHandler):
+    """Routes mock API requests"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body=None, headers=None):
+        """Sends a JSON response (body may be already encoded bytes)"""
+        data = b''
+        if isinstance(body, bytes):
+            data = body
+        elif body is not None:
+            data = json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        compress = len(data) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            data = gzip.compress(data, compresslevel=1)
+
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.bytes_sent += len(data)
+
+    def _route(self, path, query):
+        """Returns (endpoint name, handler) of an API path (None if unknown)"""
+        fixtures = self.server.fixtures
+        if path == '/api/v3/athlete':
+            return 'athlete', lambda: (fixtures.athlete(), None)
+        if path == '/api/v3/athlete/activities':
+            def activities():
+                per_page = min(int(query.get('per_page', ['30'])[0]), MAX_PAGE_SIZE)
+                page = max(int(query.get('page', ['1'])[0]), 1)
+                after = int(query['after'][0]) if 'after' in query else None
+                before = int(query['before'][0]) if 'before' in query else None
+                return fixtures.page(page, per_page, after, before), None
+            return 'activities', activities
+
+        match = ACTIVITY_PATH.match(path)
+        if match:
+            index = fixtures.index_of(int(match.group(1)))
+            if index is None:
+                return ('streams' if match.group(2) else 'activity'), lambda: None
+            if match.group(2):
+                keys = query.get('keys', ['time,distance'])[0].split(',')
+                return 'streams', lambda: (self.server.streams_body(index, keys), None)
+            etag = '"' + hashlib.sha1(f'{fixtures.seed}:{index}'.encode()).hexdigest() + '"'
+            return 'activity', lambda: (fixtures.detail(index), etag)
+        return None, None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/_mock/stats':
+            self._send(200, self.server.stats())
+            return
+        if url.path == '/oauth/authorize':
+            # Authorizes immediately: redirects to the app with a code
+            redirect_uri = query.get('redirect_uri', ['http://localhost:8000/callback'])[0]
+            location = f"{redirect_uri}?{urlencode({'state': '', 'code': 'mock-code', 'scope': 'read,activity:read_all'})}"
+            self._send(302, headers={'Location': location})
+            return
+
+        endpoint, handler = self._route(url.path, query)
+        if endpoint is None:
+            self._send(404, {'message': 'Record Not Found', 'errors': []})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests[endpoint] += 1
+
+        if _token_expired(self.headers.get('Authorization')):
+            self._send(401, {'message': 'Authorization Error',
+                             'errors': [{'resource': 'AccessToken', 'code': 'invalid'}]})
+            return
+
+        status, headers = self.server.consume()
+        if status == 429:
+            self._send(429, {'message': 'Rate Limit Exceeded', 'errors': []}, headers)
+            return
+
+        result = handler()
+        if result is None:
+            self._send(404, {'message': 'Record Not Found', 'errors': []}, headers)
+            return
+
+        body, etag = result
+        if etag:
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, headers=headers)
+                return
+        self._send(200, body, headers)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+
+        if url.path != '/oauth/token':
+            self._send(404, {'message': 'Record Not Found', 'errors': []})
+            return
+
+        with self.server.lock:
+            self.server.requests['token'] += 1
+        grant_type = form.get('grant_type', [''])[0]
+        if grant_type not in ('authorization_code', 'refresh_token'):
+            self._send(400, {'message': 'Bad Request',
+                             'errors': [{'resource': 'RequestToken', 'field': 'grant_type', 'code': 'invalid'}]})
+            return
+        # Like Strava, only the authorization code exchange returns the athlete
+        self._send(200, self.server.issue_token(grant_type == 'authorization_code'))
+
+    def log_message(self, format, *args):
+        """Suppresses HTTP server logs"""
+        pass
+
+
+def start_server(fixtures, host='localhost', port=DEFAULT_PORT, **options):
+    """Starts a mock server in a background thread, returns the server"""
+    server = MockStravaServer((host, port), fixtures, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def parse_rate_limit(value):
+    """Parses a '15min,daily' limit argument"""
+    try:
+        short, long = value.split(',')
+        return int(short), int(long)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected '15min,daily' limits, got '{value}'")
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Local mock Strava API server (synthetic activities)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python activexport_mockserver.py                          # 1000 activities on port 8010
+  python activexport_mockserver.py -n 100000                # 100k activities
+  python activexport_mockserver.py --latency 0.05           # 50 ms per request
+  python activexport_mockserver.py --error-rate 0.02        # 2%% of requests get a 429
+  python activexport_mockserver.py --rate-limit 100,1000    # Strava default read limits
+
+Point the scripts at the server:
+  ACTIVEXPORT_API_BASE=http://localhost:8010/api/v3
+  ACTIVEXPORT_OAUTH_BASE=http://localhost:8010/oauth
+        """
+    )
+
+    parser.add_argument('-n', '--activities', type=int, default=DEFAULT_ACTIVITIES,
+                        help=f'Number of synthetic activities (default: {DEFAULT_ACTIVITIES})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port to listen on (default: {DEFAULT_PORT}, 0 for any free port)')
+    parser.add_argument('--host', default='localhost',
+                        help='Address to listen on (default: localhost)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Fixture seed (default: 0)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Delay added to every API request, in seconds (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of API requests answered with a 429 (default: 0)')
+    parser.add_argument('--rate-limit', type=parse_rate_limit, default=(100_000, 1_000_000),
+                        help="Enforced '15min,daily' read limits (default: 100000,1000000)")
+    parser.add_argument('--token-lifetime', type=int, default=TOKEN_LIFETIME,
+                        help=f'Lifetime of issued access tokens, in seconds (default: {TOKEN_LIFETIME})')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    args = parse_arguments()
+    limit_15min, limit_day = args.rate_limit
+    server = MockStravaServer((args.host, args.port), Fixtures(args.activities, args.seed),
+                              latency=args.latency, error_rate=args.error_rate,
+                              limit_15min=limit_15min, limit_day=limit_day,
+                              token_lifetime=args.token_lifetime)
+    host, port = server.server_address[:2]
+
+    print("\n" + "="*60)
+    print("ActivExport - Mock Strava API")
+    print("="*60 + "\n")
+    print(f"[OK] Serving {args.activities} synthetic activities on http://{host}:{port}")
+    print(f"     ACTIVEXPORT_API_BASE=http://{host}:{port}/api/v3")
+    print(f"     ACTIVEXPORT_OAUTH_BASE=http://{host}:{port}/oauth")
+    print("     Press Ctrl+C to stop\n", flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[OK] Server stopped")
+    finally:
+        server.server_close()
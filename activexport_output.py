@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Export files
+Text exports are written to a temporary file renamed into place once
+complete (readers never see a half-written export), optionally compressed
+on the fly (gzip, xz, or zstd when zstandard is installed)
+"""
+
+import io
+import os
+import gzip
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HAS_ZSTD = zstandard is not None
+
+COMPRESSIONS = ['gzip', 'zstd', 'xz']
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'xz': '.xz'}
+
+# Large writes keep the compressors fed with whole blocks
+BUFFER_SIZE = 256 * 1024
+
+
+def check_compression(compress):
+    """Checks that the optional dependency of the requested compression is installed"""
+    if compress == 'zstd' and not HAS_ZSTD:
+        print("[X] zstandard is required for zstd compression (pip install zstandard)")
+        return False
+    return True
+
+
+def output_path(filepath, compress=None):
+    """Final path of an export ('.gz', '.zst' or '.xz' appended when compressed)"""
+    return filepath + EXTENSIONS[compress] if compress else filepath
+
+
+def temp_path(filepath):
+    """Temporary path next to the final one (same filesystem, so the rename is atomic)"""
+    return f'{filepath}.{os.getpid()}.tmp'
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f'{size / 1024 / 1024:.2f} MB'
+    return f'{size / 1024:.2f} KB'
+
+
+class _CountingStream(io.RawIOBase):
+    """Passes bytes to the compressor (or the file), counting them"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.count = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.sink.write(data)
+        self.count += len(data)
+        return len(data)
+
+
+def _compressor(raw, compress, filename):
+    if compress == 'gzip':
+        return gzip.GzipFile(filename=filename, mode='wb', fileobj=raw, compresslevel=6)
+    if compress == 'xz':
+        return lzma.LZMAFile(raw, 'wb')
+    if compress == 'zstd':
+        return zstandard.ZstdCompressor(level=6).stream_writer(raw, closefd=False)
+    return None
+
+
+class OutputFile:
+    """
+    Text export written atomically, compressed while it is written
+    Use as a context manager: the file is renamed into place when the block
+    completes, discarded if it raises
+    After closing, size is the file size and raw_size the uncompressed size
+    """
+
+    def __init__(self, filepath, compress=None, newline=None):
+        self.filepath = output_path(filepath, compress)
+        self.compress = compress
+        self.tmp_path = temp_path(self.filepath)
+        self.raw = open(self.tmp_path, 'wb')
+        self.compressor = _compressor(self.raw, compress, os.path.basename(filepath))
+        self.counter = _CountingStream(self.compressor or self.raw)
+        self.file = io.TextIOWrapper(io.BufferedWriter(self.counter, BUFFER_SIZE),
+                                     encoding='utf-8', newline=newline)
+        self.size = None
+        self.raw_size = None
+
+    def write(self, text):
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """Completes the compressed stream and renames the file into place"""
+        self.file.close()
+        if self.compressor is not None:
+            self.compressor.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        os.replace(self.tmp_path, self.filepath)
+        self.raw_size = self.counter.count
+        self.size = os.path.getsize(self.filepath)
+
+    def discard(self):
+        """Drops a partial export"""
+        try:
+            self.file.close()
+            if self.compressor is not None:
+                self.compressor.close()
+        finally:
+            self.raw.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def size_text(self):
+        """'1.20 MB', with the uncompressed size and ratio when compressed"""
+        if not self.compress:
+            return format_size(self.size)
+        ratio = self.raw_size / self.size if self.size else 0
+        return f"{format_size(self.size)} ({format_size(self.raw_size)} uncompressed, {self.compress} {ratio:.1f}x)"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+
+def open_output(filepath, compress=None, newline=None):
+    """Opens a text export (see OutputFile)"""
+    return OutputFile(filepath, compress, newline)
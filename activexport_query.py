@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Query the local activity store
+Filters, sorts and aggregates stored activities without any API call
+"""
+
+import os
+import sys
+import time
+import argparse
+from activexport_records import needs_raw
+from activexport_store import (STORE_FILE, SORT_COLUMNS, GROUP_BY, open_store,
+                               query_records, aggregate_activities)
+from activexport_fetch_activities import (DEFAULT_OUTPUT_DIR, check_formats, display_record,
+                                          load_bests, normalize_formats, save_activities)
+from activexport_output import COMPRESSIONS, check_compression
+
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Query activities from the local store (see activexport_fetch_activities.py --sync).',
+        epilog='''Examples:
+  %(prog)s --sport TrailRun --year 2023 --min-km 20
+  %(prog)s --sort distance --limit 10
+  %(prog)s --year 2024 --group-by month
+  %(prog)s --sport Run --after 2024-01-01 -f csv -f md
+  %(prog)s --year 2024 -f ndjson --compress gzip''',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument('--sport', help='Sport type (e.g. Run, TrailRun, Ride)')
+    parser.add_argument('--year', type=int, help='Activities of a given year')
+    parser.add_argument('--after', help='Activities on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--before', help='Activities before this date (YYYY-MM-DD)')
+    parser.add_argument('--min-km', type=float, help='Minimum distance (km)')
+    parser.add_argument('--max-km', type=float, help='Maximum distance (km)')
+    parser.add_argument('--gear', help='Gear ID (e.g. g12345678)')
+    parser.add_argument('--name', help='Name contains (case-insensitive)')
+
+    parser.add_argument(
+        '--sort',
+        choices=SORT_COLUMNS,
+        default='start_date',
+        help='Sort column (default: start_date)'
+    )
+
+    parser.add_argument(
+        '--asc',
+        action='store_true',
+        help='Sort ascending (default: descending)'
+    )
+
+    parser.add_argument('--limit', type=int, help='Maximum number of activities')
+
+    parser.add_argument(
+        '--group-by',
+        choices=sorted(GROUP_BY),
+        help='Display totals per group instead of activities'
+    )
+
+    parser.add_argument(
+        '-f', '--format',
+        action='append',
+        choices=['json', 'ndjson', 'csv', 'md', 'markdown', 'parquet', 'feather'],
+        dest='formats',
+        metavar='FORMAT',
+        help='Export the query result: json, ndjson, csv, md/markdown, parquet, feather. Can be specified multiple times'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        default=DEFAULT_OUTPUT_DIR,
+        help=f'Output directory path (default: {DEFAULT_OUTPUT_DIR})'
+    )
+
+    parser.add_argument(
+        '--compress',
+        choices=COMPRESSIONS,
+        help='Compress exports while writing them: gzip, zstd (needs zstandard) or xz'
+    )
+
+    parser.add_argument(
+        '--export-threads',
+        action='store_true',
+        help='Encode and compress the JSON, NDJSON and compressed CSV exports in worker threads'
+    )
+
+    parser.add_argument(
+        '--store',
+        default=STORE_FILE,
+        help=f'Local activity store file (default: {STORE_FILE})'
+    )
+
+    return parser.parse_args()
+
+
+def build_filters(args):
+    """Converts command-line arguments to store query filters"""
+    after = args.after
+    before = args.before
+    if args.year:
+        after = after or f'{args.year}-01-01'
+        before = before or f'{args.year + 1}-01-01'
+
+    return {
+        'sport': args.sport,
+        'after': after,
+        'before': before,
+        'min_distance': args.min_km * 1000 if args.min_km is not None else None,
+        'max_distance': args.max_km * 1000 if args.max_km is not None else None,
+        'gear_id': args.gear,
+        'name': args.name,
+    }
+
+
+def display_records(records, limit=50):
+    """Displays matching activities"""
+    for record in records[:limit]:
+        display_record(record)
+        print(f"      {record.sport_type} - ID: {record.id}")
+
+    if len(records) > limit:
+        print(f"\n   ... {len(records) - limit} more (use -f to export them all)")
+    print()
+
+
+def display_aggregates(rows, group_by):
+    """Displays per-group totals"""
+    print(f"   {group_by:20s} {'count':>6s} {'km':>10s} {'D+ m':>10s} {'hours':>8s}")
+    for group, count, distance_km, elevation_m, hours in rows:
+        print(f"   {str(group or 'N/A'):20s} {count:6d} {distance_km or 0:10.1f} "
+              f"{elevation_m or 0:10.0f} {hours or 0:8.1f}")
+    print()
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    args = parse_arguments()
+
+    if not check_formats(args.formats) or not check_compression(args.compress):
+        sys.exit(1)
+
+    if not os.path.exists(args.store):
+        print(f"[X] No local store found ({args.store})")
+        print("    Run first: python activexport_fetch_activities.py --sync")
+        sys.exit(1)
+
+    store = open_store(args.store)
+    filters = build_filters(args)
+    start = time.perf_counter()
+
+    if args.group_by:
+        rows = aggregate_activities(store, args.group_by, **filters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"\n{len(rows)} group(s) in {elapsed_ms:.1f} ms:\n")
+        display_aggregates(rows, args.group_by)
+    else:
+        keep_raw = needs_raw(normalize_formats(args.formats))
+        records = query_records(store, keep_raw, args.sort, not args.asc, args.limit, **filters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"\n{len(records)} activity(ies) found in {elapsed_ms:.1f} ms:\n")
+        display_records(records)
+
+        if args.formats:
+            save_activities(records, args.formats, args.output, bests=load_bests(args.formats, args.store),
+                            compress=args.compress, threads=args.export_threads)
+
+    store.close()
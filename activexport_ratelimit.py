@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Strava API rate limit scheduler
+Tracks the 15-minute and daily windows from Strava's rate limit headers
+"""
+
+import time
+import threading
+from datetime import datetime
+
+# Strava API limits (read), used until the first response headers are seen
+RATE_LIMIT_15MIN = 100
+RATE_LIMIT_DAY = 1000
+
+# Strava windows reset on natural 15-minute marks and at midnight UTC
+WINDOW_15MIN = 15 * 60
+WINDOW_DAY = 24 * 3600
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the daily quota is exhausted"""
+
+    def __init__(self, reset_at, reason="Daily API limit reached"):
+        self.reset_at = reset_at
+        reset_str = datetime.fromtimestamp(reset_at).strftime('%d/%m/%Y %H:%M')
+        super().__init__(f"{reason}, quota resets at {reset_str}")
+
+
+def _window_start(now, window):
+    """Returns the start (epoch seconds) of the window containing now"""
+    return int(now // window) * window
+
+
+def _parse_pair(value):
+    """Parses a '15min,daily' header value"""
+    try:
+        short, long = value.split(',')
+        return int(short), int(long)
+    except (AttributeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Rate limit scheduler shared by all API calls
+    Runs at full speed while budget remains and only waits for the next window
+    boundary once the 15-minute budget is used up
+    """
+
+    def __init__(self, limit_15min=RATE_LIMIT_15MIN, limit_day=RATE_LIMIT_DAY):
+        self.lock = threading.Lock()
+        self.limit_15min = limit_15min
+        self.limit_day = limit_day
+        self.usage_15min = 0
+        self.usage_day = 0
+        self.request_count = 0
+        self.sleep_time = 0.0
+        # Optional scheduler sharing the budget between callers (see activexport_team)
+        self.scheduler = None
+        now = time.time()
+        self.window_15min = _window_start(now, WINDOW_15MIN)
+        self.window_day = _window_start(now, WINDOW_DAY)
+
+    def _roll_windows(self, now):
+        """
+        Resets usage counters when a window boundary has passed
+        Returns whether the (15-minute, daily) windows rolled over
+        """
+        rolled_15min = rolled_day = False
+        window_15min = _window_start(now, WINDOW_15MIN)
+        if window_15min != self.window_15min:
+            self.window_15min = window_15min
+            self.usage_15min = 0
+            rolled_15min = True
+
+        window_day = _window_start(now, WINDOW_DAY)
+        if window_day != self.window_day:
+            self.window_day = window_day
+            self.usage_day = 0
+            rolled_day = True
+        return rolled_15min, rolled_day
+
+    def _sleep(self, seconds, reason):
+        """Sleeps outside the lock, reporting why"""
+        minutes, secs = divmod(int(seconds), 60)
+        print(f"[PAUSE] {reason}, waiting {minutes}m{secs:02d}s...")
+        time.sleep(seconds)
+        with self.lock:
+            self.sleep_time += seconds
+
+    def acquire(self):
+        """
+        Reserves budget for one request
+        Waits for the next 15-minute window if needed, raises RateLimitExceeded
+        if the daily quota is exhausted
+        """
+        if self.scheduler is not None:
+            self.scheduler.schedule(self._acquire)
+        else:
+            self._acquire()
+
+    def _acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self._roll_windows(now)
+
+                if self.usage_day >= self.limit_day:
+                    raise RateLimitExceeded(self.window_day + WINDOW_DAY)
+
+                if self.usage_15min < self.limit_15min:
+                    self.usage_15min += 1
+                    self.usage_day += 1
+                    self.request_count += 1
+                    return
+
+                wait = self.window_15min + WINDOW_15MIN - now + 1
+                reason = f"15-minute limit reached ({self.usage_15min}/{self.limit_15min})"
+
+            self._sleep(wait, reason)
+
+    def update(self, response):
+        """
+        Updates limits and usage from the rate limit headers of a response
+        Within a window, usage never goes below the local count: with
+        concurrent workers a response may predate requests reserved since
+        """
+        headers = response.headers
+        # Read limits are the binding ones for this tool; fall back to overall limits
+        limit = _parse_pair(headers.get('X-ReadRateLimit-Limit')) or \
+            _parse_pair(headers.get('X-RateLimit-Limit'))
+        usage = _parse_pair(headers.get('X-ReadRateLimit-Usage')) or \
+            _parse_pair(headers.get('X-RateLimit-Usage'))
+
+        with self.lock:
+            rolled_15min, rolled_day = self._roll_windows(time.time())
+            if limit:
+                self.limit_15min, self.limit_day = limit
+            if usage:
+                usage_15min, usage_day = usage
+                self.usage_15min = usage_15min if rolled_15min else max(self.usage_15min, usage_15min)
+                self.usage_day = usage_day if rolled_day else max(self.usage_day, usage_day)
+
+    def backoff(self, response):
+        """
+        Waits after a 429 response
+        Honours Retry-After, otherwise waits for the next 15-minute window
+        """
+        self.update(response)
+
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            self._sleep(int(retry_after), "API limit reached (429), Retry-After")
+            return
+
+        with self.lock:
+            now = time.time()
+            if self.usage_day >= self.limit_day:
+                raise RateLimitExceeded(self.window_day + WINDOW_DAY)
+            self.usage_15min = self.limit_15min
+            wait = self.window_15min + WINDOW_15MIN - now + 1
+
+        self._sleep(wait, "API limit reached (429 Too Many Requests)")
+
+    def headroom(self):
+        """Returns remaining (15-minute, daily) requests"""
+        with self.lock:
+            self._roll_windows(time.time())
+            return (self.limit_15min - self.usage_15min, self.limit_day - self.usage_day)
+
+
+# Shared scheduler for all scripts of this process
+rate_limiter = RateLimiter()
+
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Compact activity records
+Converts Strava API activity dicts once into small records with pre-parsed
+timestamps and numeric fields; the raw JSON is only kept when needed
+"""
+
+from datetime import datetime, timezone
+
+# Formats that export the raw Strava JSON
+RAW_FORMATS = {'json', 'ndjson'}
+
+
+def parse_epoch(start_date):
+    """Parses an API ISO date ('2021-09-25T08:00:00Z') to epoch seconds"""
+    return int(datetime.fromisoformat(start_date.replace('Z', '+00:00')).timestamp())
+
+
+class ActivityRecord:
+    """Activity summary fields used by the exporters and the analysis"""
+
+    __slots__ = ('id', 'name', 'sport_type', 'start_epoch', 'distance', 'moving_time',
+                 'elapsed_time', 'elevation', 'average_heartrate', 'max_heartrate',
+                 'gear_id', 'raw')
+
+    def __init__(self, id, name, sport_type, start_epoch, distance=0.0, moving_time=0,
+                 elapsed_time=0, elevation=0.0, average_heartrate=None, max_heartrate=None,
+                 gear_id=None, raw=None):
+        self.id = id
+        self.name = name
+        self.sport_type = sport_type
+        self.start_epoch = start_epoch
+        self.distance = distance
+        self.moving_time = moving_time
+        self.elapsed_time = elapsed_time
+        self.elevation = elevation
+        self.average_heartrate = average_heartrate
+        self.max_heartrate = max_heartrate
+        self.gear_id = gear_id
+        self.raw = raw
+
+    @classmethod
+    def from_api(cls, activity, keep_raw=False):
+        """Builds a record from a Strava API activity dict"""
+        return cls(
+            activity['id'],
+            activity.get('name', ''),
+            activity.get('sport_type', 'Unknown'),
+            parse_epoch(activity['start_date']),
+            activity.get('distance', 0) or 0,
+            activity.get('moving_time', 0) or 0,
+            activity.get('elapsed_time', 0) or 0,
+            activity.get('total_elevation_gain', 0) or 0,
+            activity.get('average_heartrate'),
+            activity.get('max_heartrate'),
+            activity.get('gear_id'),
+            activity if keep_raw else None
+        )
+
+    @property
+    def start(self):
+        """Start date as an aware UTC datetime"""
+        return datetime.fromtimestamp(self.start_epoch, timezone.utc)
+
+
+def to_records(activities, keep_raw=False):
+    """Converts API activity dicts to records"""
+    return [ActivityRecord.from_api(activity, keep_raw) for activity in activities]
+
+
+def needs_raw(formats):
+    """Returns True if one of the (normalized) formats exports the raw JSON"""
+    return bool(RAW_FORMATS & set(formats or ()))
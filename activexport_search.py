@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Activity name search
+Inverted token index stored in SQLite (the local store, or an in-memory
+database), with accent folding, prefix matching and typo tolerance
+"""
+
+import re
+import sqlite3
+import unicodedata
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT NOT NULL,
+    activity_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    PRIMARY KEY (term, activity_id, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_search_terms_activity ON search_terms (activity_id, field);
+
+CREATE TABLE IF NOT EXISTS search_variants (
+    variant TEXT NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (variant, term)
+) WITHOUT ROWID;
+"""
+
+# Indexed fields and their weight in the ranking
+FIELD_WEIGHTS = {'name': 2, 'description': 1}
+
+# Match kinds and their score
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+# Shortest query token matched as a prefix / with a typo
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+
+TOKEN_PATTERN = re.compile(r'\w+')
+LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae'})
+
+
+def fold(text):
+    """Lowercases and strips accents ('Cœur Échappé' -> 'coeur echappe')"""
+    decomposed = unicodedata.normalize('NFKD', text.casefold().translate(LIGATURES))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Returns the folded tokens of a text"""
+    return TOKEN_PATTERN.findall(fold(text or ''))
+
+
+def _deletes(term):
+    """Variants of a term with one character removed"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion, substitution or transposition"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+    if len(a) < len(b):
+        a, b = b, a
+    return a[i + 1:] == b[i:]
+
+
+def create_search_index(conn):
+    """Creates the search tables if needed"""
+    conn.executescript(SCHEMA)
+
+
+def index_documents(conn, documents, field='name'):
+    """
+    Indexes (activity_id, text) pairs for a field, replacing previous entries
+    Runs in the caller's transaction
+    """
+    rows = []
+    for activity_id, text in documents:
+        conn.execute('DELETE FROM search_terms WHERE activity_id = ? AND field = ?', (activity_id, field))
+        rows.extend((term, activity_id, field) for term in set(tokenize(text)))
+
+    conn.executemany('INSERT OR IGNORE INTO search_terms VALUES (?, ?, ?)', rows)
+
+    # Deletion variants for typo-tolerant lookups (stale variants are harmless)
+    terms = {row[0] for row in rows if len(row[0]) >= MIN_FUZZY_LENGTH - 1}
+    conn.executemany(
+        'INSERT OR IGNORE INTO search_variants VALUES (?, ?)',
+        ((variant, term) for term in terms for variant in _deletes(term) | {term})
+    )
+
+
+def remove_documents(conn, activity_id):
+    """Removes an activity from the index"""
+    conn.execute('DELETE FROM search_terms WHERE activity_id = ?', (activity_id,))
+
+
+def _match_token(conn, token):
+    """Returns {activity_id: score} for one query token"""
+    scores = {}
+
+    def add(sql, params, kind):
+        for term, activity_id, field in conn.execute(sql, params):
+            score = (EXACT if term == token else kind) * FIELD_WEIGHTS.get(field, 1)
+            if score > scores.get(activity_id, 0):
+                scores[activity_id] = score
+
+    if len(token) >= MIN_PREFIX_LENGTH:
+        # Terms sharing the prefix are contiguous in the primary key
+        add('SELECT term, activity_id, field FROM search_terms WHERE term >= ? AND term < ?',
+            (token, token + '\U0010ffff'), PREFIX)
+    else:
+        add('SELECT term, activity_id, field FROM search_terms WHERE term = ?', (token,), EXACT)
+
+    if len(token) >= MIN_FUZZY_LENGTH:
+        variants = list(_deletes(token) | {token})
+        placeholders = ', '.join('?' * len(variants))
+        candidates = {row[0] for row in conn.execute(
+            f'SELECT term FROM search_variants WHERE variant IN ({placeholders})', variants)}
+        for term in candidates:
+            if term != token and not term.startswith(token) and _one_edit(token, term):
+                add('SELECT term, activity_id, field FROM search_terms WHERE term = ?', (term,), FUZZY)
+
+    return scores
+
+
+def search(conn, query, limit=None):
+    """
+    Searches the index; every query token must match (exactly, as a prefix or
+    with one typo)
+    Returns activity IDs, best matches first (then newest)
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    totals = None
+    for token in dict.fromkeys(tokens):
+        scores = _match_token(conn, token)
+        if totals is None:
+            totals = scores
+        else:
+            totals = {i: totals[i] + s for i, s in scores.items() if i in totals}
+        if not totals:
+            return []
+
+    ranked = sorted(totals, key=lambda i: (totals[i], i), reverse=True)
+    return ranked[:limit] if limit else ranked
+
+
+def search_records(records, query, limit=None):
+    """Searches a list of activity records through a temporary in-memory index"""
+    conn = sqlite3.connect(':memory:')
+    create_search_index(conn)
+    index_documents(conn, ((r.id, r.name) for r in records))
+    by_id = {r.id: r for r in records}
+    matches = [by_id[i] for i in search(conn, query, limit)]
+    conn.close()
+    return matches
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Local daemon
+Long-running process that keeps the tokens, the pooled HTTP session and an
+in-memory index of activity records resident, syncs the store in the
+background on a schedule, and answers a small local HTTP/JSON API (list and
+filter activities, details, aggregates, exports) in milliseconds
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+import requests
+from activexport_auth import get_athlete_id, get_valid_access_token
+from activexport_fetch_activities import (DEFAULT_OUTPUT_DIR, check_formats, load_bests,
+                                          normalize_formats, save_activities, sync_activities)
+from activexport_get_activity_details import fetch_activity_details
+from activexport_metrics import metrics, enable_metrics
+from activexport_output import COMPRESSIONS, check_compression
+from activexport_query import build_filters
+from activexport_ratelimit import RateLimitExceeded, rate_limiter
+from activexport_records import needs_raw
+from activexport_search import search
+from activexport_store import (STORE_FILE, GROUP_BY, open_store, sorted_records,
+                               get_records, load_details, save_details)
+
+load_dotenv()
+
+DEFAULT_PORT = 8030
+
+# Minutes between background syncs
+DEFAULT_INTERVAL = 60
+
+# Activities returned by /activities when no limit is given (limit=0: all)
+DEFAULT_LIMIT = 100
+
+# Optional bearer token required by the API (e.g. when listening beyond localhost)
+API_TOKEN = os.getenv('ACTIVEXPORT_SERVE_TOKEN')
+
+EXPORT_FORMATS = ['json', 'ndjson', 'csv', 'md', 'markdown', 'parquet', 'feather']
+
+# Request parameters accepted as filters (same names as activexport_query.py options)
+FILTER_PARAMS = ('sport', 'year', 'after', 'before', 'min_km', 'max_km', 'gear', 'name')
+
+# Record attribute of each sort column
+SORT_ATTRIBUTES = {
+    'start_date': 'start_epoch',
+    'distance': 'distance',
+    'moving_time': 'moving_time',
+    'elapsed_time': 'elapsed_time',
+    'total_elevation_gain': 'elevation',
+    'name': 'name',
+    'sport_type': 'sport_type',
+}
+
+# Group of a record for each grouping key (see activexport_store.GROUP_BY)
+GROUP_KEYS = {
+    'sport': lambda record: record.sport_type,
+    'year': lambda record: record.start.strftime('%Y'),
+    'month': lambda record: record.start.strftime('%Y-%m'),
+    'gear': lambda record: record.gear_id,
+}
+
+
+def _date_epoch(value):
+    """Parses a YYYY-MM-DD filter date (UTC, as stored) to epoch seconds"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+
+def _count_param(params, key, default):
+    """Non-negative integer request parameter (offset, limit)"""
+    value = params.get(key, default)
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {key}: {value}")
+    if count < 0:
+        raise ValueError(f"Invalid {key}: {value} (expected 0 or more)")
+    return count
+
+
+def record_matcher(sport=None, after=None, before=None, min_distance=None,
+                   max_distance=None, gear_id=None, name=None):
+    """Predicate on records for the store query filters (see activexport_store.query_records)"""
+    after_epoch = _date_epoch(after) if after else None
+    before_epoch = _date_epoch(before) if before else None
+    name = name.casefold() if name else None
+
+    def match(record):
+        return ((not sport or record.sport_type == sport)
+                and (after_epoch is None or record.start_epoch >= after_epoch)
+                and (before_epoch is None or record.start_epoch < before_epoch)
+                and (min_distance is None or record.distance >= min_distance)
+                and (max_distance is None or record.distance <= max_distance)
+                and (not gear_id or record.gear_id == gear_id)
+                and (name is None or name in (record.name or '').casefold()))
+    return match
+
+
+def record_summary(record):
+    """Activity summary fields of a record, as returned by the API"""
+    return {
+        'id': record.id,
+        'name': record.name,
+        'sport_type': record.sport_type,
+        'start_date': record.start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'distance': record.distance,
+        'moving_time': record.moving_time,
+        'elapsed_time': record.elapsed_time,
+        'total_elevation_gain': record.elevation,
+        'average_heartrate': record.average_heartrate,
+        'max_heartrate': record.max_heartrate,
+        'gear_id': record.gear_id,
+    }
+
+
+class ActivityIndex:
+    """
+    Activity records held in memory, newest first
+    Replaced as a whole after each sync: readers keep working on the list
+    they started with
+    """
+
+    def __init__(self):
+        self.records = []
+        self.by_id = {}
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def load(self, records):
+        by_id = {record.id: record for record in records}
+        self.records, self.by_id = records, by_id
+        self.loaded_at = time.time()
+
+    def select(self, filters, ids=None, sort=None, descending=True):
+        """
+        Records matching the filters, newest first, or in the order of ids
+        (search results) when given; sorted by a SORT_COLUMNS column if sort is set
+        """
+        match = record_matcher(**filters)
+        if ids is not None:
+            by_id = self.by_id
+            records = [by_id[i] for i in ids if i in by_id and match(by_id[i])]
+        else:
+            records = [record for record in self.records if match(record)]
+
+        if sort is not None:
+            if sort not in SORT_ATTRIBUTES:
+                raise ValueError(f"Unknown sort column: {sort}")
+            attribute = SORT_ATTRIBUTES[sort]
+            missing = '' if attribute in ('name', 'sport_type') else 0
+            records.sort(key=lambda record: getattr(record, attribute) or missing, reverse=descending)
+        return records
+
+    def aggregate(self, group_by, filters):
+        """
+        Per-group totals of the records matching the filters
+        Rows as in activexport_store.aggregate_activities
+        """
+        if group_by not in GROUP_KEYS:
+            raise ValueError(f"Unknown grouping: {group_by} (expected {', '.join(sorted(GROUP_BY))})")
+        key = GROUP_KEYS[group_by]
+        groups = {}
+        for record in self.select(filters):
+            totals = groups.setdefault(key(record), [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += record.distance
+            totals[2] += record.elevation
+            totals[3] += record.moving_time
+        return [(group, count, distance / 1000, elevation, moving_time / 3600)
+                for group, (count, distance, elevation, moving_time)
+                in sorted(groups.items(), key=lambda item: (item[0] is not None, item[0] or ''))]
+
+
+class BackgroundSync:
+    """
+    Syncs the store every interval minutes (0: only on request) and reloads
+    the index; the metrics files are rewritten after each sync
+    """
+
+    def __init__(self, index, store_file=STORE_FILE, interval=DEFAULT_INTERVAL, metrics_files=None):
+        self.index = index
+        self.store_file = store_file
+        self.interval = interval * 60 if interval else None
+        self.metrics_files = metrics_files
+        self.wake = threading.Event()
+        self.running = False
+        self.last = None
+        self.next_at = None
+
+    def request(self):
+        """Starts a sync now; returns False if one is already running"""
+        if self.running:
+            return False
+        self.wake.set()
+        return True
+
+    def run(self):
+        if self.interval is None:
+            self.wake.wait()
+        while True:
+            self.wake.clear()
+            self.sync()
+            self.next_at = time.time() + self.interval if self.interval else None
+            self.wake.wait(self.interval)
+
+    def sync(self):
+        self.running = True
+        started_at = time.time()
+        error = None
+        before = len(self.index)
+        try:
+            self.index.load(sync_activities(self.store_file))
+        except Exception as e:
+            print(f"[X] Sync failed: {e}")
+            error = str(e)
+        finally:
+            self.running = False
+
+        self.last = {
+            'started_at': int(started_at),
+            'seconds': round(time.time() - started_at, 3),
+            'added': len(self.index) - before,
+            'error': error,
+        }
+        for filepath in self.metrics_files or ():
+            metrics.write(filepath)
+
+
+class ServeHandler(BaseHTTPRequestHandler):
+    """
+    Local API
+      GET  /status              index size, last/next sync, rate limit headroom
+      GET  /activities          list and filter activities (query parameters)
+      GET  /activities/{id}     activity details (stored, fetched once otherwise)
+      GET  /aggregates          per-group totals (group_by=sport|year|month|gear)
+      POST /sync                start a sync now
+      POST /exports             export matching activities (JSON body)
+    """
+
+    def _send_json(self, status, body=None, headers=None):
+        content = json.dumps(body or {}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _authorized(self):
+        token = self.server.api_token
+        if not token:
+            return True
+        header = self.headers.get('Authorization') or ''
+        if secrets.compare_digest(header, f'Bearer {token}'):
+            return True
+        self._send_json(401, {'error': 'Missing or wrong bearer token'})
+        return False
+
+    def _handle(self, routes):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            for pattern, handler in routes:
+                match = re.fullmatch(pattern, url.path)
+                if match:
+                    handler(params, *match.groups())
+                    return
+            self._send_json(404, {'error': f'Unknown endpoint: {url.path}'})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except RateLimitExceeded as e:
+            self._send_json(429, {'error': str(e)},
+                            {'Retry-After': str(max(int(e.reset_at - time.time()), 1))})
+        except Exception as e:
+            # Store busy or unreadable, disk full...: the client still gets an answer
+            print(f"[X] {self.command} {url.path}: {e}")
+            self._send_json(500, {'error': f'Internal error: {e}'})
+
+    def do_GET(self):
+        self._handle([
+            ('/status', self.get_status),
+            ('/activities', self.get_activities),
+            (r'/activities/(\d+)', self.get_activity),
+            ('/aggregates', self.get_aggregates),
+        ])
+
+    def do_POST(self):
+        self._handle([
+            ('/sync', self.post_sync),
+            ('/exports', self.post_exports),
+        ])
+
+    def get_status(self, params):
+        server = self.server
+        headroom_15min, headroom_day = rate_limiter.headroom()
+        self._send_json(200, {
+            'activities': len(server.index),
+            'index_loaded_at': int(server.index.loaded_at) if server.index.loaded_at else None,
+            'sync': {
+                'running': server.syncer.running,
+                'last': server.syncer.last,
+                'next_at': int(server.syncer.next_at) if server.syncer.next_at else None,
+            },
+            'rate_limit': {'headroom_15min': headroom_15min, 'headroom_day': headroom_day},
+            'uptime_seconds': int(time.time() - server.started_at),
+        })
+
+    def get_activities(self, params):
+        records = self.server.select(params)
+        offset = _count_param(params, 'offset', 0)
+        limit = _count_param(params, 'limit', DEFAULT_LIMIT)
+        page = records[offset:offset + limit] if limit else records[offset:]
+        self._send_json(200, {
+            'total': len(records),
+            'offset': offset,
+            'count': len(page),
+            'activities': [record_summary(record) for record in page],
+        })
+
+    def get_activity(self, params, activity_id):
+        activity_id = int(activity_id)
+        server = self.server
+        if params.get('refresh') not in ('1', 'true'):
+            with server.store_lock:
+                activity = load_details(server.store, activity_id)
+            if activity is not None:
+                self._send_json(200, activity)
+                return
+
+        access_token = get_valid_access_token()
+        if not access_token:
+            self._send_json(503, {'error': 'Not authenticated, run activexport_auth.py first'})
+            return
+        try:
+            activity = fetch_activity_details(activity_id, access_token, get_athlete_id())
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else 502
+            self._send_json(404 if status == 404 else 502, {'error': str(e)})
+            return
+        except requests.exceptions.RequestException as e:
+            self._send_json(502, {'error': str(e)})
+            return
+
+        with server.store_lock:
+            save_details(server.store, activity)
+        self._send_json(200, activity)
+
+    def get_aggregates(self, params):
+        group_by = params.get('group_by', 'sport')
+        rows = self.server.index.aggregate(group_by, parse_filters(params))
+        self._send_json(200, {
+            'group_by': group_by,
+            'groups': [{'group': group, 'count': count, 'distance_km': round(distance_km, 2),
+                        'elevation_m': round(elevation_m), 'moving_time_hours': round(hours, 2)}
+                       for group, count, distance_km, elevation_m, hours in rows],
+        })
+
+    def post_sync(self, params):
+        if self.server.syncer.request():
+            self._send_json(202, {'status': 'started'})
+        else:
+            self._send_json(409, {'status': 'running'})
+
+    def post_exports(self, params):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise ValueError("Request body must be a JSON object")
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+
+        formats = body.get('formats')
+        if isinstance(formats, str):
+            formats = [formats]
+        if not formats or not set(formats) <= set(EXPORT_FORMATS):
+            raise ValueError(f"formats must be a list of: {', '.join(EXPORT_FORMATS)}")
+        compress = body.get('compress')
+        if compress is not None and compress not in COMPRESSIONS:
+            raise ValueError(f"compress must be one of: {', '.join(COMPRESSIONS)}")
+        if not check_formats(formats) or not check_compression(compress):
+            self._send_json(501, {'error': 'Missing optional dependency (see the daemon console)'})
+            return
+
+        self._send_json(200, self.server.export(formats, compress, body))
+
+    def log_message(self, format, *args):
+        """Suppresses HTTP server logs"""
+        pass
+
+
+def parse_filters(params):
+    """Store query filters from request parameters (see FILTER_PARAMS)"""
+    values = {key: params.get(key) for key in FILTER_PARAMS}
+    for key, convert in (('year', int), ('min_km', float), ('max_km', float)):
+        if values[key] is not None:
+            try:
+                values[key] = convert(values[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid {key}: {values[key]}")
+    return build_filters(argparse.Namespace(**values))
+
+
+class ServeServer(ThreadingHTTPServer):
+    """
+    Daemon state shared by the request handlers
+    The store connection is shared by all threads, one query at a time
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, index, syncer, store_file=STORE_FILE, output_dir=DEFAULT_OUTPUT_DIR,
+                 api_token=None):
+        super().__init__(address, ServeHandler)
+        self.index = index
+        self.syncer = syncer
+        self.store_file = store_file
+        self.store = open_store(store_file, shared=True)
+        self.store_lock = threading.Lock()
+        self.export_lock = threading.Lock()
+        self.output_dir = output_dir
+        self.api_token = api_token
+        self.started_at = time.time()
+
+    def select(self, params):
+        """Records matching request parameters: filters, q (name search), sort, asc"""
+        filters = parse_filters(params)
+        ids = None
+        if params.get('q'):
+            with self.store_lock:
+                ids = search(self.store, params['q'])
+        sort = params.get('sort')
+        if sort is None and ids is None:
+            sort = 'start_date' if params.get('asc') in ('1', 'true') else None
+        descending = params.get('asc') not in ('1', 'true')
+        return self.index.select(filters, ids, sort, descending)
+
+    def export(self, formats, compress, options):
+        """Exports the activities matching the options (filters, q, sort) to the output directory"""
+        start = time.perf_counter()
+        params = {key: str(value) for key, value in options.items()
+                  if value is not None and not isinstance(value, (list, dict))}
+        records = self.select(params)
+        if records and needs_raw(normalize_formats(formats)):
+            with self.store_lock:
+                records = get_records(self.store, [record.id for record in records], keep_raw=True)
+        with self.export_lock:
+            files = save_activities(records, formats, self.output_dir,
+                                    bests=load_bests(formats, self.store_file), compress=compress)
+        return {'count': len(records), 'files': files,
+                'seconds': round(time.perf_counter() - start, 3)}
+
+
+def run_daemon(args):
+    """Loads the index, starts the background sync and serves until interrupted"""
+    enable_metrics(args.metrics)
+    index = ActivityIndex()
+    start = time.perf_counter()
+    store = open_store(args.store)
+    index.load(sorted_records(store))
+    store.close()
+
+    syncer = BackgroundSync(index, args.store, args.interval, args.metrics)
+    server = ServeServer((args.host, args.port), index, syncer, args.store, args.output, API_TOKEN)
+
+    print("\n" + "="*60)
+    print("ACTIVEXPORT DAEMON")
+    print("="*60 + "\n")
+    print(f"[OK] Index loaded: {len(index)} activities in {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"({args.store})")
+    print(f"[OK] API on http://{args.host}:{args.port}"
+          f"{' (bearer token required)' if API_TOKEN else ''}")
+    if args.interval:
+        print(f"[OK] Background sync every {args.interval} min")
+    else:
+        print("[OK] Background sync disabled (POST /sync to sync)")
+    if args.host not in ('localhost', '127.0.0.1', '::1') and not API_TOKEN:
+        print("[!] Listening beyond localhost without ACTIVEXPORT_SERVE_TOKEN: anyone reaching the port can read your activities")
+    print()
+
+    threading.Thread(target=syncer.run, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[OK] Stopped")
+    finally:
+        server.server_close()
+        server.store.close()
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Local daemon: background sync and a local HTTP/JSON API over the activity store',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python activexport_serve.py                              # API on localhost:8030, sync every hour
+  python activexport_serve.py --interval 15 --metrics activexport.prom
+  python activexport_serve.py --interval 0                 # Serve the store, sync only on POST /sync
+
+Queries:
+  curl 'http://localhost:8030/activities?sport=TrailRun&year=2023&min_km=20'
+  curl 'http://localhost:8030/activities?q=sancy&limit=5'
+  curl 'http://localhost:8030/aggregates?group_by=month&year=2024'
+  curl 'http://localhost:8030/activities/6018412458'
+  curl -X POST http://localhost:8030/sync
+  curl -X POST http://localhost:8030/exports -d '{"formats": ["csv"], "sport": "Run", "compress": "gzip"}'
+        """
+    )
+
+    parser.add_argument('--host', type=str, default='localhost',
+                        help='Interface to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f'Minutes between background syncs, 0 to sync only on request (default: {DEFAULT_INTERVAL})')
+    parser.add_argument('--store', type=str, default=STORE_FILE,
+                        help=f'Local activity store (default: {STORE_FILE})')
+    parser.add_argument('-o', '--output', type=str, default=DEFAULT_OUTPUT_DIR,
+                        help=f'Directory of exports made with POST /exports (default: {DEFAULT_OUTPUT_DIR})')
+    parser.add_argument('--metrics', type=str, action='append',
+                        help='Write run metrics to FILE after each sync '
+                             '(.prom: Prometheus text, otherwise JSON), repeatable')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    args = parse_arguments()
+
+    try:
+        run_daemon(args)
+    except OSError as e:
+        print(f"[X] Error: {e}")
+        sys.exit(1)
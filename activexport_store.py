@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Local activity store
+SQLite database of activity summaries and details, keyed by activity ID,
+used for incremental sync, local queries and name search
+"""
+
+import os
+import json
+import sqlite3
+from datetime import datetime
+from activexport_records import ActivityRecord, parse_epoch
+from activexport_curves import create_efforts_tables, remove_efforts
+from activexport_search import create_search_index, index_documents, remove_documents, search
+
+STORE_FILE = 'activexport_store.db'
+LEGACY_STORE_FILE = 'activexport_store.json'
+
+# Seconds a connection waits while another one writes the store
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    start_date TEXT NOT NULL,
+    start_epoch INTEGER NOT NULL,
+    name TEXT,
+    sport_type TEXT,
+    distance REAL,
+    moving_time INTEGER,
+    elapsed_time INTEGER,
+    total_elevation_gain REAL,
+    average_heartrate REAL,
+    max_heartrate REAL,
+    gear_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activities_start_date ON activities (start_date);
+CREATE INDEX IF NOT EXISTS idx_activities_sport_type ON activities (sport_type, start_date);
+CREATE INDEX IF NOT EXISTS idx_activities_distance ON activities (distance);
+CREATE INDEX IF NOT EXISTS idx_activities_gear_id ON activities (gear_id);
+
+CREATE TABLE IF NOT EXISTS details (
+    id INTEGER PRIMARY KEY,
+    fetched_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+# Columns accepted for sorting query results
+SORT_COLUMNS = ['start_date', 'distance', 'moving_time', 'elapsed_time',
+                'total_elevation_gain', 'name', 'sport_type']
+
+# Columns loaded into compact records (see activexport_records)
+RECORD_COLUMNS = ('id, name, sport_type, start_epoch, distance, moving_time, elapsed_time, '
+                  'total_elevation_gain, average_heartrate, max_heartrate, gear_id')
+
+# Grouping keys for aggregates
+GROUP_BY = {
+    'sport': 'sport_type',
+    'year': 'substr(start_date, 1, 4)',
+    'month': 'substr(start_date, 1, 7)',
+    'gear': 'gear_id',
+}
+
+
+def open_store(store_file=STORE_FILE, shared=False):
+    """
+    Opens (and creates if needed) the local store
+    A store from the previous JSON format is imported on first use, and the
+    search index is built if the store predates it
+    A shared connection can be used from several threads (callers serialize
+    access, see activexport_serve); it switches the store to WAL mode, so its
+    reads do not wait for the writes of another connection (a sync)
+    """
+    is_new = not os.path.exists(store_file)
+    store = sqlite3.connect(store_file, timeout=BUSY_TIMEOUT, check_same_thread=not shared)
+    if shared:
+        store.execute('PRAGMA journal_mode=WAL')
+    store.executescript(SCHEMA)
+    create_search_index(store)
+    create_efforts_tables(store)
+
+    if not is_new and not store.execute('SELECT 1 FROM search_terms LIMIT 1').fetchone():
+        rebuild_search_index(store)
+
+    legacy_file = os.path.join(os.path.dirname(store_file), LEGACY_STORE_FILE)
+    if is_new and os.path.exists(legacy_file):
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            activities = json.load(f).get('activities', [])
+        merge_activities(store, activities)
+        print(f"[OK] Imported {len(activities)} activities from {legacy_file}")
+
+    return store
+
+
+def _activity_row(activity):
+    """Builds the indexed columns of an activity summary"""
+    return (
+        activity['id'],
+        activity['start_date'],
+        parse_epoch(activity['start_date']),
+        activity.get('name', ''),
+        activity.get('sport_type', ''),
+        activity.get('distance', 0),
+        activity.get('moving_time', 0),
+        activity.get('elapsed_time', 0),
+        activity.get('total_elevation_gain', 0),
+        activity.get('average_heartrate'),
+        activity.get('max_heartrate'),
+        activity.get('gear_id'),
+        json.dumps(activity, ensure_ascii=False)
+    )
+
+
+def merge_activities(store, activities):
+    """
+    Adds or updates activity summaries in the store
+    Returns the number of activities not previously stored
+    """
+    activities = list(activities)
+    before = count_activities(store)
+    with store:
+        store.executemany(
+            'INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (_activity_row(activity) for activity in activities)
+        )
+        index_documents(store, ((a['id'], a.get('name', '')) for a in activities), 'name')
+    return count_activities(store) - before
+
+
+def delete_activity(store, activity_id):
+    """Removes an activity (summary and details) from the store"""
+    with store:
+        store.execute('DELETE FROM activities WHERE id = ?', (activity_id,))
+        store.execute('DELETE FROM details WHERE id = ?', (activity_id,))
+        remove_efforts(store, activity_id)
+        remove_documents(store, activity_id)
+
+
+def count_activities(store):
+    """Returns the number of stored activities"""
+    return store.execute('SELECT COUNT(*) FROM activities').fetchone()[0]
+
+
+def get_latest_start_epoch(store):
+    """Returns the newest stored start date as epoch seconds (None if empty)"""
+    return store.execute('SELECT MAX(start_epoch) FROM activities').fetchone()[0]
+
+
+def get_activity_ids(store):
+    """Returns stored activity IDs, newest first"""
+    return [row[0] for row in store.execute('SELECT id FROM activities ORDER BY start_date DESC')]
+
+
+def get_activity_ids_without_details(store):
+    """Returns IDs of stored activities whose details are not stored yet, newest first"""
+    return [row[0] for row in store.execute(
+        'SELECT id FROM activities WHERE id NOT IN (SELECT id FROM details) ORDER BY start_date DESC')]
+
+
+def sorted_records(store, keep_raw=False):
+    """Returns records of stored activities sorted newest first"""
+    return query_records(store, keep_raw)
+
+
+def _where_clause(sport=None, after=None, before=None, min_distance=None,
+                  max_distance=None, gear_id=None, name=None):
+    """Builds the WHERE clause of a query (dates as YYYY-MM-DD, distances in meters)"""
+    conditions = []
+    params = []
+    if sport:
+        conditions.append('sport_type = ?')
+        params.append(sport)
+    if after:
+        conditions.append('start_date >= ?')
+        params.append(after)
+    if before:
+        conditions.append('start_date < ?')
+        params.append(before)
+    if min_distance is not None:
+        conditions.append('distance >= ?')
+        params.append(min_distance)
+    if max_distance is not None:
+        conditions.append('distance <= ?')
+        params.append(max_distance)
+    if gear_id:
+        conditions.append('gear_id = ?')
+        params.append(gear_id)
+    if name:
+        conditions.append('name LIKE ?')
+        params.append(f'%{name}%')
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+
+def query_records(store, keep_raw=False, sort='start_date', descending=True, limit=None, **filters):
+    """
+    Returns compact records (see activexport_records) of stored activities
+    matching the filters; the raw JSON is only loaded if keep_raw is set
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {sort}")
+
+    where, params = _where_clause(**filters)
+    columns = RECORD_COLUMNS + (', data' if keep_raw else '')
+    sql = f"SELECT {columns} FROM activities {where} ORDER BY {sort} {'DESC' if descending else 'ASC'}"
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    records = []
+    for row in store.execute(sql, params):
+        raw = json.loads(row[11]) if keep_raw else None
+        records.append(ActivityRecord(*row[:11], raw=raw))
+    return records
+
+
+def query_activities(store, sort='start_date', descending=True, limit=None, **filters):
+    """
+    Returns stored activities matching the filters
+    Filters: sport, after, before, min_distance, max_distance, gear_id, name
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {sort}")
+
+    where, params = _where_clause(**filters)
+    sql = f"SELECT data FROM activities {where} ORDER BY {sort} {'DESC' if descending else 'ASC'}"
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    return [json.loads(row[0]) for row in store.execute(sql, params)]
+
+
+def search_stored_records(store, query, keep_raw=False, limit=None):
+    """
+    Returns records of stored activities matching a name search, best first
+    (accent-insensitive, prefix and typo tolerant, see activexport_search)
+    """
+    return get_records(store, search(store, query, limit), keep_raw)
+
+
+def get_records(store, ids, keep_raw=False):
+    """Returns records of stored activities in the order of ids (unknown IDs are skipped)"""
+    columns = RECORD_COLUMNS + (', data' if keep_raw else '')
+    by_id = {}
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        sql = f"SELECT {columns} FROM activities WHERE id IN ({', '.join('?' * len(chunk))})"
+        for row in store.execute(sql, chunk):
+            raw = json.loads(row[11]) if keep_raw else None
+            by_id[row[0]] = ActivityRecord(*row[:11], raw=raw)
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def rebuild_search_index(store):
+    """Indexes every stored activity name and detail description"""
+    with store:
+        index_documents(store, store.execute('SELECT id, name FROM activities').fetchall(), 'name')
+        descriptions = ((row[0], json.loads(row[1]).get('description') or '')
+                        for row in store.execute('SELECT id, data FROM details').fetchall())
+        index_documents(store, descriptions, 'description')
+
+
+def aggregate_activities(store, group_by='sport', **filters):
+    """
+    Returns per-group totals of stored activities matching the filters
+    Rows: (group, count, distance_km, elevation_m, moving_time_hours)
+    """
+    key = GROUP_BY[group_by]
+    where, params = _where_clause(**filters)
+    sql = f"""
+        SELECT {key} AS grp, COUNT(*), SUM(distance) / 1000.0,
+               SUM(total_elevation_gain), SUM(moving_time) / 3600.0
+        FROM activities {where}
+        GROUP BY grp
+        ORDER BY grp
+    """
+    return store.execute(sql, params).fetchall()
+
+
+def save_details(store, activity):
+    """Stores the complete details of an activity"""
+    with store:
+        store.execute(
+            'INSERT OR REPLACE INTO details VALUES (?, ?, ?)',
+            (activity['id'], datetime.now().isoformat(), json.dumps(activity, ensure_ascii=False))
+        )
+        index_documents(store, [(activity['id'], activity.get('description') or '')], 'description')
+
+
+def load_details(store, activity_id):
+    """Returns the stored details of an activity (None if not stored)"""
+    row = store.execute('SELECT data FROM details WHERE id = ?', (activity_id,)).fetchone()
+    return json.loads(row[0]) if row else None
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Activity streams (GPS, HR, cadence, altitude, power...)
+Downloads /activities/{id}/streams and stores each series as a typed,
+contiguous binary array in one file per activity, readable through mmap
+without parsing or copying
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+from activexport_client import api_get
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STREAMS_DIR = 'activexport_streams'
+
+# Stream types requested from the API
+STREAM_KEYS = ['time', 'latlng', 'distance', 'altitude', 'velocity_smooth', 'heartrate',
+               'cadence', 'watts', 'temp', 'moving', 'grade_smooth']
+
+# Stored series and their array typecode (latlng is split into lat and lng)
+SERIES_TYPES = {
+    'time': 'i',             # int32, seconds since start
+    'lat': 'f',              # float32, degrees
+    'lng': 'f',
+    'distance': 'f',         # float32, meters
+    'altitude': 'f',         # float32, meters
+    'velocity_smooth': 'f',  # float32, m/s
+    'grade_smooth': 'f',     # float32, percent
+    'heartrate': 'B',        # uint8, bpm
+    'cadence': 'B',          # uint8, rpm
+    'watts': 'H',            # uint16, W
+    'temp': 'b',             # int8, °C
+    'moving': 'B',           # uint8, 0/1
+}
+
+# File layout: magic, header length (uint32 LE), JSON header, then every
+# series little-endian and 8-byte aligned at the offsets given by the header
+MAGIC = b'AXS1'
+ALIGNMENT = 8
+
+
+def streams_path(activity_id, streams_dir=STREAMS_DIR):
+    """Path of the streams file of an activity"""
+    return os.path.join(streams_dir, f'activity_{activity_id}.axs')
+
+
+def fetch_activity_streams(activity_id, access_token):
+    """
+    Fetches all streams of an activity (raises on error)
+    Returns (streams keyed by type, size of the JSON response in bytes)
+    """
+    response = api_get(f'/activities/{activity_id}/streams', access_token,
+                       params={'keys': ','.join(STREAM_KEYS), 'key_by_type': 'true'})
+    response.raise_for_status()
+    return response.json(), len(response.content)
+
+
+def _series(streams):
+    """Converts API streams into {name: typed array}"""
+    series = {}
+    for key, stream in streams.items():
+        data = stream.get('data') if isinstance(stream, dict) else None
+        if not data:
+            continue
+        if key == 'latlng':
+            series['lat'] = array('f', (point[0] if point else 0.0 for point in data))
+            series['lng'] = array('f', (point[1] if point else 0.0 for point in data))
+        elif key in SERIES_TYPES:
+            typecode = SERIES_TYPES[key]
+            if typecode in 'bBH':
+                # Small integer types: round and clamp to the type range
+                low, high = {'b': (-128, 127), 'B': (0, 255), 'H': (0, 65535)}[typecode]
+                data = (min(max(int(round(v or 0)), low), high) for v in data)
+            elif typecode == 'i':
+                data = (int(v or 0) for v in data)
+            else:
+                data = (v or 0.0 for v in data)
+            series[key] = array(typecode, data)
+    return series
+
+
+def write_streams(filepath, streams):
+    """
+    Writes API streams (key_by_type) to a binary streams file
+    Returns the size of the file in bytes
+    """
+    series = _series(streams)
+
+    # Lay out the series after the header, each one aligned
+    index = {}
+    offset = 0
+    for name, values in series.items():
+        index[name] = {'type': values.typecode, 'offset': offset, 'length': len(values)}
+        offset += len(values) * values.itemsize
+        offset += -offset % ALIGNMENT
+
+    header = json.dumps({'version': 1, 'series': index}).encode('utf-8')
+    data_start = len(MAGIC) + 4 + len(header)
+    padding = -data_start % ALIGNMENT
+
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    tmp_path = f'{filepath}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header) + padding))
+        f.write(header + b' ' * padding)
+        for values in series.values():
+            if sys.byteorder != 'little':
+                values = array(values.typecode, values)
+                values.byteswap()
+            f.write(values.tobytes())
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+    os.replace(tmp_path, filepath)
+    return os.path.getsize(filepath)
+
+
+class StreamsFile:
+    """
+    Memory-mapped streams file
+    streams['heartrate'] is a zero-copy memoryview; streams.numpy('heartrate')
+    is a zero-copy NumPy array (requires numpy)
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.file = open(filepath, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:4] != MAGIC:
+            self.close()
+            raise ValueError(f"Not an ActivExport streams file: {filepath}")
+        header_length = struct.unpack_from('<I', self.map, 4)[0]
+        self.data_start = 8 + header_length
+        self.series = json.loads(bytes(self.map[8:self.data_start]))['series']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.series
+
+    def __len__(self):
+        """Number of points"""
+        return max((s['length'] for s in self.series.values()), default=0)
+
+    @property
+    def names(self):
+        return list(self.series)
+
+    def _bounds(self, name):
+        info = self.series[name]
+        start = self.data_start + info['offset']
+        return info['type'], start, start + info['length'] * array(info['type']).itemsize
+
+    def __getitem__(self, name):
+        typecode, start, end = self._bounds(name)
+        if sys.byteorder != 'little':
+            values = array(typecode, self.map[start:end])
+            values.byteswap()
+            return memoryview(values)
+        return memoryview(self.map)[start:end].cast(typecode)
+
+    def numpy(self, name):
+        """Series as a read-only NumPy array backed by the mapped file"""
+        if np is None:
+            raise ImportError("numpy is required for NumPy stream access (pip install numpy)")
+        typecode, start, end = self._bounds(name)
+        dtype = np.dtype(typecode).newbyteorder('<')
+        return np.frombuffer(self.map, dtype=dtype, count=(end - start) // dtype.itemsize, offset=start)
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Views still reference the mapping; it is released with them
+            pass
+        self.file.close()
+
+
+def open_streams(activity_id, streams_dir=STREAMS_DIR):
+    """Opens the streams file of an activity (None if not downloaded)"""
+    filepath = streams_path(activity_id, streams_dir)
+    return StreamsFile(filepath) if os.path.exists(filepath) else None
+
+
+def save_activity_streams(activity_id, access_token, streams_dir=STREAMS_DIR, refresh=False):
+    """
+    Downloads the streams of an activity unless already stored
+    Returns (file path, file size, JSON size) or None if already stored
+    """
+    filepath = streams_path(activity_id, streams_dir)
+    if os.path.exists(filepath) and not refresh:
+        return None
+    streams, json_size = fetch_activity_streams(activity_id, access_token)
+    return filepath, write_streams(filepath, streams), json_size
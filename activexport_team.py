@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Multi-athlete exports
+Registry of athletes authorized under the same Strava application, and a
+scheduler running their sync, detail and stream jobs side by side while
+sharing the application's 15-minute and daily quota fairly (or by priority),
+each athlete with its own tokens, store and output tree
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from activexport_auth import (TokenProvider, bind_token_provider, current_token_provider,
+                              initial_authentication, load_tokens, save_tokens, TOKEN_FILE)
+from activexport_checkpoint import CHECKPOINT_DIR
+from activexport_client import configure_session
+from activexport_fetch_activities import (check_formats, load_bests, needs_raw, normalize_formats,
+                                          save_activities, sync_activities)
+from activexport_get_activity_details import get_activities_details
+from activexport_metrics import enable_metrics
+from activexport_output import COMPRESSIONS, check_compression
+from activexport_ratelimit import WINDOW_DAY, RateLimitExceeded, rate_limiter
+from activexport_store import STORE_FILE, open_store, get_activity_ids, get_activity_ids_without_details
+from activexport_streams import STREAMS_DIR, streams_path
+
+ATHLETES_DIR = 'activexport_athletes'
+REGISTRY_FILE = os.path.join(ATHLETES_DIR, 'athletes.json')
+DEFAULT_OUTPUT_DIR = './output'
+
+# Athletes processed at the same time, and concurrent requests of each detail job
+DEFAULT_JOBS = 4
+DEFAULT_WORKERS = 2
+
+POLICIES = ['fair', 'priority']
+
+
+class Athlete:
+    """An athlete of the registry, with its own files under ATHLETES_DIR/<id>/"""
+
+    def __init__(self, athlete_id, name='', weight=1, directory=ATHLETES_DIR):
+        self.id = str(athlete_id)
+        self.name = name or self.id
+        self.weight = weight
+        self.dir = os.path.join(directory, self.id)
+        self.token_file = os.path.join(self.dir, TOKEN_FILE)
+        self.store_file = os.path.join(self.dir, STORE_FILE)
+        self.streams_dir = os.path.join(self.dir, STREAMS_DIR)
+        self.checkpoint_dir = os.path.join(self.dir, CHECKPOINT_DIR)
+        self.provider = TokenProvider(self.token_file)
+
+    def output_dir(self, base):
+        return os.path.join(base, self.id)
+
+
+def load_registry(registry_file=REGISTRY_FILE):
+    """Returns the registered athletes, in registration order"""
+    if not os.path.exists(registry_file):
+        return []
+    with open(registry_file, 'r', encoding='utf-8') as f:
+        entries = json.load(f).get('athletes', {})
+    directory = os.path.dirname(registry_file)
+    return [Athlete(athlete_id, entry.get('name', ''), entry.get('weight', 1), directory)
+            for athlete_id, entry in entries.items()]
+
+
+def save_registry(athletes, registry_file=REGISTRY_FILE):
+    os.makedirs(os.path.dirname(registry_file) or '.', exist_ok=True)
+    entries = {athlete.id: {'name': athlete.name, 'weight': athlete.weight} for athlete in athletes}
+    tmp_path = f'{registry_file}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'athletes': entries}, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, registry_file)
+
+
+def register_athlete(token_file, weight=1, registry_file=REGISTRY_FILE):
+    """
+    Adds (or updates) the athlete of a token file to the registry; the
+    tokens are copied into the athlete's directory
+    Returns the athlete, None if the token file has no athlete
+    """
+    tokens = load_tokens(token_file)
+    athlete_info = (tokens or {}).get('athlete') or {}
+    if 'id' not in athlete_info:
+        print(f"[X] No athlete in {token_file}")
+        return None
+
+    name = f"{athlete_info.get('firstname', '')} {athlete_info.get('lastname', '')}".strip()
+    athletes = [a for a in load_registry(registry_file) if a.id != str(athlete_info['id'])]
+    athlete = Athlete(athlete_info['id'], name, weight, os.path.dirname(registry_file))
+    os.makedirs(athlete.dir, exist_ok=True)
+    save_tokens(tokens, athlete.token_file)
+    athletes.append(athlete)
+    save_registry(athletes, registry_file)
+    return athlete
+
+
+def remove_athlete(athlete_id, registry_file=REGISTRY_FILE):
+    """Removes an athlete from the registry and deletes its tokens (its store is kept)"""
+    athletes = load_registry(registry_file)
+    removed = [a for a in athletes if a.id == str(athlete_id)]
+    if not removed:
+        return False
+    save_registry([a for a in athletes if a.id != str(athlete_id)], registry_file)
+    if os.path.exists(removed[0].token_file):
+        os.remove(removed[0].token_file)
+    return True
+
+
+class FairScheduler:
+    """
+    Shares the application quota between athletes (plugged into the rate
+    limiter, see RateLimiter.scheduler)
+    Requests are granted one at a time; when several athletes are waiting,
+    'fair' serves the one that used the least quota relative to its weight,
+    'priority' the one with the highest weight
+    With 'fair', each athlete is also entitled to its weighted share of the
+    daily quota: it can go beyond it only as long as the quota left still
+    covers the unused shares of athletes whose jobs have not finished
+    """
+
+    def __init__(self, athletes, limiter=rate_limiter, policy='fair'):
+        self.limiter = limiter
+        self.policy = policy
+        self.condition = threading.Condition()
+        self.athletes = {athlete.provider: athlete for athlete in athletes}
+        self.weights = {athlete.id: max(athlete.weight, 0.01) for athlete in athletes}
+        self.total_weight = sum(self.weights.values())
+        self.used = {athlete.id: 0 for athlete in athletes}
+        self.used_today = {athlete.id: 0 for athlete in athletes}
+        self.waiting = {athlete.id: 0 for athlete in athletes}
+        self.active = set(self.weights)
+        self.busy = False
+        self.day = limiter.window_day
+
+    def _roll_day(self):
+        day = self.limiter.window_day
+        if day != self.day:
+            self.day = day
+            self.used_today = dict.fromkeys(self.used_today, 0)
+
+    def _share(self, key):
+        return self.limiter.limit_day * self.weights[key] / self.total_weight
+
+    def _check_quota(self, key):
+        """Raises RateLimitExceeded if the athlete would eat into others' daily share"""
+        if self.policy != 'fair' or self.used_today[key] < self._share(key):
+            return
+        _, headroom_day = self.limiter.headroom()
+        reserved = sum(max(self._share(other) - self.used_today[other], 0)
+                       for other in self.active if other != key)
+        if headroom_day - reserved < 1:
+            raise RateLimitExceeded(self.day + WINDOW_DAY,
+                                    f"Daily share of athlete {key} used "
+                                    f"({self.used_today[key]}/{self._share(key):.0f} requests)")
+
+    def _next(self):
+        """Athlete served next among those waiting"""
+        waiting = [key for key, count in self.waiting.items() if count]
+        if self.policy == 'priority':
+            return max(waiting, key=lambda key: (self.weights[key], -self.used[key]))
+        return min(waiting, key=lambda key: self.used[key] / self.weights[key])
+
+    def schedule(self, acquire):
+        """Runs the rate limiter's acquire when it is the calling athlete's turn"""
+        athlete = self.athletes.get(current_token_provider())
+        if athlete is None:
+            acquire()
+            return
+        key = athlete.id
+
+        with self.condition:
+            self.waiting[key] += 1
+            try:
+                while True:
+                    self._roll_day()
+                    self._check_quota(key)
+                    if not self.busy and self._next() == key:
+                        break
+                    self.condition.wait()
+            finally:
+                self.waiting[key] -= 1
+                self.condition.notify_all()
+            self.busy = True
+
+        try:
+            # May sleep until the next 15-minute window; the others keep their place
+            acquire()
+        except BaseException:
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            self.busy = False
+            self.used[key] += 1
+            self.used_today[key] += 1
+            self.condition.notify_all()
+
+    def finish(self, athlete):
+        """The athlete's jobs are done: its unused daily share goes to the others"""
+        with self.condition:
+            self.active.discard(athlete.id)
+            self.condition.notify_all()
+
+
+class AthleteOutput:
+    """
+    Console output shared by the athletes' threads: every line is prefixed
+    with the name of the athlete whose thread printed it
+    """
+
+    def __init__(self, stream, athletes):
+        self.stream = stream
+        self.names = {athlete.provider: athlete.name for athlete in athletes}
+        self.lock = threading.Lock()
+        self.buffers = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.buffers, 'text', '') + text
+        *lines, self.buffers.text = buffer.split('\n')
+        name = self.names.get(current_token_provider())
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.stream.write(f'[{name}] {line}\n' if name and line else f'{line}\n')
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_athlete(athlete, args, scheduler):
+    """
+    Runs the jobs of one athlete in the current thread: sync of its store,
+    export of its activities, then details (and streams) it does not have yet
+    Details already stored and streams already downloaded are skipped, so an
+    interrupted run simply continues where it stopped
+    Returns a summary dict
+    """
+    bind_token_provider(athlete.provider)
+    result = {'activities': 0, 'details': 0, 'error': None}
+    try:
+        if args.sync or args.formats:
+            records = sync_activities(athlete.store_file, needs_raw(normalize_formats(args.formats)),
+                                      athlete.checkpoint_dir)
+            result['activities'] = len(records)
+            if records and args.formats:
+                save_activities(records, args.formats, athlete.output_dir(args.output),
+                                bests=load_bests(args.formats, athlete.store_file, athlete.streams_dir),
+                                compress=args.compress)
+
+        if args.details or args.streams:
+            store = open_store(athlete.store_file)
+            activity_ids = get_activity_ids_without_details(store)
+            if args.streams:
+                missing = set(activity_ids)
+                activity_ids += [activity_id for activity_id in get_activity_ids(store)
+                                 if activity_id not in missing
+                                 and not os.path.exists(streams_path(activity_id, athlete.streams_dir))]
+            if args.limit:
+                activity_ids = activity_ids[:args.limit]
+            if activity_ids:
+                result['details'] = get_activities_details(
+                    activity_ids, None, athlete.output_dir(args.output), args.workers, store=store,
+                    streams_dir=athlete.streams_dir if args.streams else None)
+            else:
+                print("[OK] Details and streams up to date")
+            store.close()
+    except Exception as e:
+        print(f"[X] {e}")
+        result['error'] = str(e)
+    finally:
+        scheduler.finish(athlete)
+    return result
+
+
+def run_team(athletes, args):
+    """Runs every athlete's jobs, args.jobs athletes at a time, under one shared quota"""
+    scheduler = FairScheduler(athletes, policy=args.policy)
+    rate_limiter.scheduler = scheduler
+    configure_session(pool_size=args.jobs * args.workers)
+
+    print("\n" + "="*60)
+    print(f"TEAM EXPORT: {len(athletes)} athletes ({args.jobs} at a time, {args.policy} sharing)")
+    print("="*60 + "\n")
+
+    stdout = sys.stdout
+    sys.stdout = AthleteOutput(stdout, athletes)
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            results = dict(zip(athletes, executor.map(lambda a: run_athlete(a, args, scheduler),
+                                                      athletes)))
+    finally:
+        sys.stdout = stdout
+        rate_limiter.scheduler = None
+
+    print("\n" + "="*60)
+    print("TEAM SUMMARY")
+    print("="*60)
+    for athlete, result in results.items():
+        status = f"[X] {result['error']}" if result['error'] else "[OK]"
+        print(f"{athlete.name[:24]:24s} weight {athlete.weight:<4g} {scheduler.used[athlete.id]:6d} requests  "
+              f"{result['activities']:6d} activities  {result['details']:5d} details  {status}")
+    headroom_15min, headroom_day = rate_limiter.headroom()
+    print(f"\nRate limit headroom: {headroom_15min} (15 min), {headroom_day} (day)")
+    print("="*60 + "\n")
+    return results
+
+
+def display_registry(athletes):
+    if not athletes:
+        print("No athlete registered (python activexport_team.py --add)")
+        return
+    total_weight = sum(athlete.weight for athlete in athletes)
+    for athlete in athletes:
+        tokens = 'tokens OK' if os.path.exists(athlete.token_file) else 'NO TOKENS'
+        print(f"[{athlete.id}] {athlete.name}  weight {athlete.weight:g} "
+              f"({athlete.weight / total_weight:.0%} of the daily quota), {tokens}")
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Export the activities of several athletes sharing one Strava application',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python activexport_team.py --add                      # Authorize an athlete (browser)
+  python activexport_team.py --import activexport_tokens.json --weight 2
+  python activexport_team.py --list
+  python activexport_team.py --sync -f json -f csv      # Sync and export every athlete
+  python activexport_team.py --sync --details --streams # Also details and streams
+  python activexport_team.py --sync --athlete 12345 --athlete 67890
+  python activexport_team.py --streams --policy priority
+        """
+    )
+
+    registry = parser.add_argument_group('athlete registry')
+    registry.add_argument('--add', action='store_true',
+                          help='Authorize a new athlete (opens the browser) and register it')
+    registry.add_argument('--import', type=str, dest='import_file', metavar='TOKEN_FILE',
+                          help='Register the athlete of an existing token file')
+    registry.add_argument('--weight', type=float, default=1,
+                          help='Quota share (fair) or priority of the added athlete (default: 1)')
+    registry.add_argument('--remove', type=str, metavar='ATHLETE_ID',
+                          help='Unregister an athlete (its store and exports are kept)')
+    registry.add_argument('--list', action='store_true',
+                          help='Show the registered athletes')
+
+    jobs = parser.add_argument_group('jobs')
+    jobs.add_argument('--sync', action='store_true',
+                      help="Sync each athlete's local store")
+    jobs.add_argument('-f', '--format', action='append', dest='formats', metavar='FORMAT',
+                      choices=['json', 'ndjson', 'csv', 'md', 'markdown', 'parquet', 'feather'],
+                      help='Export each athlete\'s activities (implies --sync). Can be specified multiple times')
+    jobs.add_argument('--compress', choices=COMPRESSIONS,
+                      help='Compress text exports: gzip, zstd (needs zstandard) or xz')
+    jobs.add_argument('--details', action='store_true',
+                      help='Fetch details of stored activities not fetched yet')
+    jobs.add_argument('--streams', action='store_true',
+                      help='Also download streams not downloaded yet')
+    jobs.add_argument('--limit', type=int,
+                      help='Max activity details per athlete in this run')
+    jobs.add_argument('--athlete', type=str, action='append', metavar='ATHLETE_ID',
+                      help='Only run these athletes (default: all)')
+    jobs.add_argument('--policy', choices=POLICIES, default='fair',
+                      help='Quota sharing: fair (weighted shares) or priority (default: fair)')
+    jobs.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                      help=f'Athletes processed at the same time (default: {DEFAULT_JOBS})')
+    jobs.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                      help=f'Concurrent detail requests per athlete (default: {DEFAULT_WORKERS})')
+    jobs.add_argument('-o', '--output', type=str, default=DEFAULT_OUTPUT_DIR,
+                      help=f'Output directory, one subdirectory per athlete (default: {DEFAULT_OUTPUT_DIR})')
+    jobs.add_argument('--metrics', type=str, action='append',
+                      help='Write run metrics to FILE on exit (.prom: Prometheus text, otherwise JSON), '
+                           'repeatable')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    args = parse_arguments()
+
+    if args.add or args.import_file:
+        token_file = args.import_file
+        if args.add:
+            token_file = os.path.join(ATHLETES_DIR, 'new_athlete_tokens.json')
+            os.makedirs(ATHLETES_DIR, exist_ok=True)
+            if not initial_authentication(token_file):
+                sys.exit(1)
+        athlete = register_athlete(token_file, args.weight)
+        if args.add:
+            os.remove(token_file)
+        if athlete is None:
+            sys.exit(1)
+        print(f"[OK] Athlete registered: {athlete.name} ({athlete.id}), weight {athlete.weight:g}")
+        sys.exit(0)
+
+    if args.remove:
+        if not remove_athlete(args.remove):
+            print(f"[X] Unknown athlete: {args.remove}")
+            sys.exit(1)
+        print(f"[OK] Athlete {args.remove} removed")
+        sys.exit(0)
+
+    athletes = load_registry()
+    if args.athlete:
+        athletes = [athlete for athlete in athletes if athlete.id in args.athlete]
+
+    if args.list or not (args.sync or args.formats or args.details or args.streams):
+        display_registry(athletes)
+        sys.exit(0)
+
+    if not athletes:
+        print("[X] No athlete to run (python activexport_team.py --add)")
+        sys.exit(1)
+    if not check_formats(args.formats) or not check_compression(args.compress):
+        sys.exit(1)
+
+    enable_metrics(args.metrics)
+    results = run_team(athletes, args)
+    sys.exit(1 if any(result['error'] for result in results.values()) else 0)
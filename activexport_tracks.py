@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+ActivExport - GPX / TCX track export
+Turns stored activity streams (see activexport_streams) into standard track
+files, written in chunks straight from the memory-mapped streams so memory
+stays flat whatever the length of the activity
+"""
+
+import os
+import time
+from xml.sax.saxutils import escape, quoteattr
+from activexport_records import parse_epoch
+from activexport_streams import STREAMS_DIR, open_streams
+from activexport_output import open_output, output_path
+
+# Track points formatted before each write
+CHUNK_POINTS = 1000
+
+# Strava sport types -> TCX sports (anything else is 'Other')
+TCX_SPORTS = {
+    'Run': 'Running', 'TrailRun': 'Running', 'VirtualRun': 'Running', 'Walk': 'Running',
+    'Hike': 'Running', 'Ride': 'Biking', 'MountainBikeRide': 'Biking', 'GravelRide': 'Biking',
+    'EBikeRide': 'Biking', 'EMountainBikeRide': 'Biking', 'VirtualRide': 'Biking',
+}
+
+TRACK_FORMATS = ('gpx', 'tcx')
+
+
+def _timestamp(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def _has_position(lat, lng):
+    return lat != 0.0 or lng != 0.0
+
+
+def _series(streams, name):
+    """A series of the streams file, None if not recorded"""
+    return streams[name] if name in streams else None
+
+
+def _write_chunked(f, points, format_point):
+    """Formats and writes track points CHUNK_POINTS at a time"""
+    chunk = []
+    for i in points:
+        chunk.append(format_point(i))
+        if len(chunk) >= CHUNK_POINTS:
+            f.write(''.join(chunk))
+            chunk = []
+    f.write(''.join(chunk))
+
+
+def write_gpx(activity, streams, filepath, compress=None):
+    """
+    Writes a GPX 1.1 track (position, elevation, time, heart rate, cadence)
+    Returns the number of track points (0 if the activity has no GPS data)
+    """
+    if 'lat' not in streams or 'time' not in streams:
+        return 0
+
+    start = parse_epoch(activity['start_date'])
+    name = escape(activity.get('name', ''))
+    t, lat, lng = streams['time'], streams['lat'], streams['lng']
+    altitude = _series(streams, 'altitude')
+    heartrate = _series(streams, 'heartrate')
+    cadence = _series(streams, 'cadence')
+
+    def format_point(i):
+        point = f'   <trkpt lat="{lat[i]:.6f}" lon="{lng[i]:.6f}">'
+        if altitude is not None:
+            point += f'<ele>{altitude[i]:.1f}</ele>'
+        point += f'<time>{_timestamp(start + t[i])}</time>'
+        if heartrate is not None or cadence is not None:
+            point += '<extensions><gpxtpx:TrackPointExtension>'
+            if heartrate is not None and heartrate[i]:
+                point += f'<gpxtpx:hr>{heartrate[i]}</gpxtpx:hr>'
+            if cadence is not None:
+                point += f'<gpxtpx:cad>{cadence[i]}</gpxtpx:cad>'
+            point += '</gpxtpx:TrackPointExtension></extensions>'
+        return point + '</trkpt>\n'
+
+    count = sum(1 for i in range(len(t)) if _has_position(lat[i], lng[i]))
+    if not count:
+        return 0
+
+    with open_output(filepath, compress) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<gpx version="1.1" creator="ActivExport" xmlns="http://www.topografix.com/GPX/1/1" '
+                'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n')
+        f.write(f' <metadata><name>{name}</name><time>{_timestamp(start)}</time></metadata>\n')
+        f.write(f' <trk>\n  <name>{name}</name>\n  <type>{escape(activity.get("sport_type", ""))}</type>\n')
+        f.write('  <trkseg>\n')
+        _write_chunked(f, (i for i in range(len(t)) if _has_position(lat[i], lng[i])), format_point)
+        f.write('  </trkseg>\n </trk>\n</gpx>\n')
+    return count
+
+
+def write_tcx(activity, streams, filepath, compress=None):
+    """
+    Writes a TCX activity with one lap (position, altitude, distance, heart
+    rate, cadence, power); indoor activities are written without positions
+    Returns the number of track points
+    """
+    if 'time' not in streams:
+        return 0
+
+    start = parse_epoch(activity['start_date'])
+    sport = TCX_SPORTS.get(activity.get('sport_type'), 'Other')
+    t = streams['time']
+    lat = _series(streams, 'lat')
+    lng = _series(streams, 'lng')
+    altitude = _series(streams, 'altitude')
+    distance = _series(streams, 'distance')
+    heartrate = _series(streams, 'heartrate')
+    cadence = _series(streams, 'cadence')
+    watts = _series(streams, 'watts')
+
+    # Running cadence belongs to the TPX extension, bike cadence to the trackpoint
+    run_cadence = cadence if sport == 'Running' else None
+    bike_cadence = cadence if sport != 'Running' else None
+
+    def format_point(i):
+        point = f'     <Trackpoint><Time>{_timestamp(start + t[i])}</Time>'
+        if lat is not None and _has_position(lat[i], lng[i]):
+            point += (f'<Position><LatitudeDegrees>{lat[i]:.6f}</LatitudeDegrees>'
+                      f'<LongitudeDegrees>{lng[i]:.6f}</LongitudeDegrees></Position>')
+        if altitude is not None:
+            point += f'<AltitudeMeters>{altitude[i]:.1f}</AltitudeMeters>'
+        if distance is not None:
+            point += f'<DistanceMeters>{distance[i]:.1f}</DistanceMeters>'
+        if heartrate is not None and heartrate[i]:
+            point += f'<HeartRateBpm><Value>{heartrate[i]}</Value></HeartRateBpm>'
+        if bike_cadence is not None:
+            point += f'<Cadence>{bike_cadence[i]}</Cadence>'
+        if watts is not None or run_cadence is not None:
+            point += '<Extensions><ns3:TPX>'
+            if watts is not None:
+                point += f'<ns3:Watts>{watts[i]}</ns3:Watts>'
+            if run_cadence is not None:
+                point += f'<ns3:RunCadence>{run_cadence[i]}</ns3:RunCadence>'
+            point += '</ns3:TPX></Extensions>'
+        return point + '</Trackpoint>\n'
+
+    start_time = _timestamp(start)
+    with open_output(filepath, compress) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" '
+                'xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n')
+        f.write(f' <Activities>\n  <Activity Sport={quoteattr(sport)}>\n   <Id>{start_time}</Id>\n')
+        f.write(f'   <Lap StartTime="{start_time}">\n')
+        f.write(f'    <TotalTimeSeconds>{activity.get("elapsed_time", 0)}</TotalTimeSeconds>\n')
+        f.write(f'    <DistanceMeters>{activity.get("distance", 0):.1f}</DistanceMeters>\n')
+        f.write(f'    <Calories>{int(activity.get("calories") or 0)}</Calories>\n')
+        if activity.get('average_heartrate'):
+            f.write(f'    <AverageHeartRateBpm><Value>{round(activity["average_heartrate"])}</Value>'
+                    f'</AverageHeartRateBpm>\n')
+        if activity.get('max_heartrate'):
+            f.write(f'    <MaximumHeartRateBpm><Value>{round(activity["max_heartrate"])}</Value>'
+                    f'</MaximumHeartRateBpm>\n')
+        f.write('    <Intensity>Active</Intensity>\n    <TriggerMethod>Manual</TriggerMethod>\n')
+        f.write('    <Track>\n')
+        _write_chunked(f, range(len(t)), format_point)
+        f.write('    </Track>\n   </Lap>\n')
+        f.write(f'   <Notes>{escape(activity.get("name", ""))}</Notes>\n')
+        f.write('  </Activity>\n </Activities>\n</TrainingCenterDatabase>\n')
+    return len(t)
+
+
+WRITERS = {'gpx': write_gpx, 'tcx': write_tcx}
+
+
+def export_track(activity, fmt, filepath, streams_dir=STREAMS_DIR, compress=None):
+    """
+    Exports the stored streams of an activity as a GPX or TCX track
+    (compressed with compress when given, e.g. .gpx.gz as accepted by Strava uploads)
+    Returns True if the file was written
+    """
+    streams = open_streams(activity['id'], streams_dir)
+    if streams is None:
+        print(f"[X] No streams stored for activity {activity['id']} (use --streams)")
+        return False
+
+    with streams:
+        points = WRITERS[fmt](activity, streams, filepath, compress)
+
+    if not points:
+        print(f"[X] Activity {activity['id']} has no {'GPS track' if fmt == 'gpx' else 'time series'}")
+        return False
+
+    filepath = output_path(filepath, compress)
+    file_size_kb = os.path.getsize(filepath) / 1024
+    print(f"[OK] {fmt.upper()} exported to: {filepath} ({points} points, {file_size_kb:.0f} KB)")
+    return True
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+ActivExport - Webhook receiver
+Long-running server for Strava push subscriptions: answers the subscription
+handshake, queues activity create/update/delete events and applies each one
+to the local store with a single targeted API call, so ingestion costs scale
+with new activity instead of history size
+Includes a replayer that posts events to a receiver, for local testing
+"""
+
+import os
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+import requests
+import activexport_client
+from activexport_auth import CLIENT_ID, CLIENT_SECRET, get_athlete_id, current_token_provider
+from activexport_checkpoint import CHECKPOINT_DIR
+from activexport_client import api_get, get_session, http_post
+from activexport_metrics import metrics, enable_metrics
+from activexport_ratelimit import RateLimitExceeded
+from activexport_store import (STORE_FILE, open_store, merge_activities, delete_activity,
+                               count_activities, save_details)
+from activexport_streams import STREAMS_DIR, streams_path, save_activity_streams
+
+load_dotenv()
+
+DEFAULT_PORT = 8020
+WEBHOOK_PATH = '/webhook'
+
+# Shared secret echoed by Strava during the subscription handshake
+VERIFY_TOKEN = os.getenv('ACTIVEXPORT_WEBHOOK_VERIFY_TOKEN')
+
+# Events received but not yet applied survive a restart
+JOURNAL_FILE = os.path.join(CHECKPOINT_DIR, 'webhook_events.ndjson')
+
+# Failed events (other than rate limiting) are retried this many times
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30
+
+# Strava expects an answer to event POSTs within 2 seconds
+RESPONSE_DEADLINE = 2.0
+
+OBJECT_TYPES = ('activity', 'athlete')
+ASPECT_TYPES = ('create', 'update', 'delete')
+
+# Fields of detailed activities not part of the summaries kept in the store
+# (the complete details are stored separately)
+DETAIL_FIELDS = ('description', 'calories', 'segment_efforts', 'splits_metric', 'splits_standard',
+                 'laps', 'best_efforts', 'photos', 'gear', 'device_name', 'embed_token',
+                 'similar_activities', 'available_zones', 'stats_visibility', 'hide_from_home')
+
+
+def parse_event(body):
+    """
+    Validates an event posted by Strava
+    Returns the event dict, or None if it is not a well-formed event
+    """
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(event, dict):
+        return None
+    if event.get('object_type') not in OBJECT_TYPES or event.get('aspect_type') not in ASPECT_TYPES:
+        return None
+    if not isinstance(event.get('object_id'), int):
+        return None
+    return event
+
+
+class EventQueue:
+    """
+    Pending events, coalesced per object: several events for the same
+    activity before it is processed cost a single API call
+    Events are journaled (fsync) before being acknowledged, and the journal
+    is cleared whenever the queue is drained
+    """
+
+    def __init__(self, journal_file=JOURNAL_FILE):
+        self.journal_file = journal_file
+        self.journal = None
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.received = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _key(event):
+        return event['object_type'], event['object_id']
+
+    def _add(self, event):
+        key = self._key(event)
+        if key in self.pending:
+            self.coalesced += 1
+            previous = self.pending[key]
+            # A create followed by updates is still a create (streams are downloaded)
+            if previous['aspect_type'] == 'create' and event['aspect_type'] == 'update':
+                event = {**event, 'aspect_type': 'create'}
+        self.pending[key] = event
+
+    def _write(self, event):
+        self.journal.write(json.dumps(event) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def open(self):
+        """
+        Loads the events left by a previous run (torn last line dropped)
+        Returns the number of pending events
+        """
+        os.makedirs(os.path.dirname(self.journal_file) or '.', exist_ok=True)
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    event = parse_event(line)
+                    if event is not None:
+                        self._add(event)
+        # Rewritten compacted
+        self.journal = open(self.journal_file, 'w', encoding='utf-8')
+        for event in self.pending.values():
+            self._write(event)
+        return len(self.pending)
+
+    def put(self, event):
+        """Journals and queues an event"""
+        with self.condition:
+            self._write(event)
+            self._add(event)
+            self.received += 1
+            self.condition.notify()
+
+    def _due(self):
+        """Key of the oldest event due now (None if none), and when the next one is due"""
+        now = time.time()
+        next_at = None
+        for key, event in self.pending.items():
+            not_before = event.get('not_before', 0)
+            if not_before <= now:
+                return key, None
+            next_at = not_before if next_at is None else min(next_at, not_before)
+        return None, next_at
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest pending event (None on timeout)
+        Events retried later (not_before) let the others go first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                key, next_at = self._due()
+                if key is not None:
+                    return self.pending.pop(key)
+                delay = None if next_at is None else next_at - time.time()
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    delay = remaining if delay is None else min(delay, remaining)
+                self.condition.wait(delay)
+
+    def retry(self, event):
+        """Queues an event again (still in the journal), unless a newer one arrived"""
+        with self.condition:
+            self.pending.setdefault(self._key(event), event)
+            self.condition.notify()
+
+    def task_done(self):
+        """Clears the journal once every event has been applied"""
+        with self.condition:
+            if not self.pending:
+                self.journal.seek(0)
+                self.journal.truncate()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.pending)
+
+
+def activity_summary(activity):
+    """Summary of a detailed activity, as stored by the list fetch"""
+    return {key: value for key, value in activity.items() if key not in DETAIL_FIELDS}
+
+
+def apply_event(store, event, streams_dir=None):
+    """
+    Applies an event to the store: a deleted activity is removed, a created or
+    updated one is fetched (one API call) and its summary and details saved
+    Returns what was done ('created', 'updated', 'deleted', 'deauthorized', 'ignored')
+    """
+    activity_id = event['object_id']
+
+    if event['object_type'] == 'athlete':
+        if str(event.get('updates', {}).get('authorized')).lower() == 'false':
+            print(f"[!] Athlete {activity_id} revoked access to the application")
+            return 'deauthorized'
+        return 'ignored'
+
+    if event['aspect_type'] == 'delete':
+        delete_activity(store, activity_id)
+        if streams_dir and os.path.exists(streams_path(activity_id, streams_dir)):
+            os.remove(streams_path(activity_id, streams_dir))
+        return 'deleted'
+
+    access_token = current_token_provider().get_access_token()
+    if not access_token:
+        raise RuntimeError("No token found. Run initial authentication first.")
+    response = api_get(f'/activities/{activity_id}', access_token)
+    if response.status_code == 404:
+        # Deleted or no longer visible since the event was sent
+        delete_activity(store, activity_id)
+        return 'deleted'
+    response.raise_for_status()
+    activity = response.json()
+
+    is_new = merge_activities(store, [activity_summary(activity)])
+    save_details(store, activity)
+    if streams_dir and event['aspect_type'] == 'create':
+        save_activity_streams(activity_id, access_token, streams_dir)
+    return 'created' if is_new else 'updated'
+
+
+def process_events(queue, store_file=STORE_FILE, streams_dir=None, metrics_files=None):
+    """
+    Worker loop: applies queued events one at a time (the store is only used
+    from this thread); the metrics files are rewritten whenever the queue is
+    drained
+    """
+    store = open_store(store_file)
+    while True:
+        event = queue.get()
+        label = f"{event['aspect_type']} {event['object_type']} {event['object_id']}"
+        try:
+            result = apply_event(store, event, streams_dir)
+            print(f"[OK] {label}: {result} ({count_activities(store)} activities in store)")
+            metrics.inc('webhook_events_total', object=event['object_type'], result=result)
+        except RateLimitExceeded as e:
+            print(f"[PAUSE] {e}, {label} postponed")
+            queue.retry(event)
+            time.sleep(max(e.reset_at - time.time(), 1))
+            continue
+        except Exception as e:
+            attempts = event.get('attempts', 0) + 1
+            if attempts < MAX_ATTEMPTS:
+                # Queued again behind the other events instead of holding up the worker
+                print(f"[X] {label}: {e}, retrying in {RETRY_DELAY}s ({attempts}/{MAX_ATTEMPTS})")
+                queue.retry({**event, 'attempts': attempts, 'not_before': time.time() + RETRY_DELAY})
+                continue
+            print(f"[X] {label}: {e}, giving up (run --sync to catch up)")
+            metrics.inc('webhook_events_total', object=event['object_type'], result='failed')
+
+        queue.task_done()
+        if metrics_files and not len(queue):
+            for filepath in metrics_files:
+                metrics.write(filepath)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Handler for the subscription handshake (GET) and events (POST)"""
+
+    def _send_json(self, status, body=None):
+        content = json.dumps(body or {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        """Subscription validation: echoes hub.challenge if the verify token matches"""
+        url = urlparse(self.path)
+        if url.path != WEBHOOK_PATH:
+            self._send_json(404)
+            return
+
+        params = parse_qs(url.query)
+        mode = params.get('hub.mode', [None])[0]
+        challenge = params.get('hub.challenge', [None])[0]
+        verify_token = params.get('hub.verify_token', [None])[0]
+        if mode != 'subscribe' or challenge is None:
+            self._send_json(400)
+        elif not secrets.compare_digest(verify_token or '', self.server.verify_token):
+            print("[X] Subscription handshake rejected: wrong verify token")
+            self._send_json(403)
+        else:
+            print("[OK] Subscription handshake validated")
+            self._send_json(200, {'hub.challenge': challenge})
+
+    def do_POST(self):
+        """Event: queued and acknowledged immediately, applied by the worker"""
+        if urlparse(self.path).path != WEBHOOK_PATH:
+            self._send_json(404)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        event = parse_event(self.rfile.read(length))
+        if event is None:
+            self._send_json(400)
+            return
+
+        # Events for other athletes or subscriptions are acknowledged and dropped
+        athlete_id = self.server.athlete_id
+        subscription_id = self.server.subscription_id
+        if ((athlete_id and str(event.get('owner_id')) != athlete_id)
+                or (subscription_id and str(event.get('subscription_id')) != subscription_id)):
+            metrics.inc('webhook_events_total', object=event['object_type'], result='ignored')
+        else:
+            self.server.queue.put(event)
+        self._send_json(200)
+
+    def log_message(self, format, *args):
+        """Suppresses HTTP server logs"""
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Receiver state shared by the request handlers"""
+
+    daemon_threads = True
+
+    def __init__(self, address, queue, verify_token, athlete_id=None, subscription_id=None):
+        super().__init__(address, WebhookHandler)
+        self.queue = queue
+        self.verify_token = verify_token
+        self.athlete_id = athlete_id
+        self.subscription_id = subscription_id
+
+
+def subscriptions_url():
+    return f'{activexport_client.API_BASE}/push_subscriptions'
+
+
+def create_subscription(callback_url, verify_token):
+    """
+    Registers the callback URL with Strava, which validates it right away
+    with a GET on the (already running) receiver
+    Returns the subscription ID
+    """
+    response = http_post(subscriptions_url(), {
+        'client_id': CLIENT_ID,
+        'client_secret': CLIENT_SECRET,
+        'callback_url': callback_url,
+        'verify_token': verify_token,
+    })
+    response.raise_for_status()
+    return response.json()['id']
+
+
+def list_subscriptions():
+    """Returns the push subscriptions of the application (Strava allows one)"""
+    response = get_session().get(subscriptions_url(),
+                                 params={'client_id': CLIENT_ID, 'client_secret': CLIENT_SECRET})
+    response.raise_for_status()
+    return response.json()
+
+
+def delete_subscription(subscription_id):
+    response = get_session().delete(f'{subscriptions_url()}/{subscription_id}',
+                                    params={'client_id': CLIENT_ID, 'client_secret': CLIENT_SECRET})
+    response.raise_for_status()
+
+
+def run_receiver(args):
+    """Starts the worker and serves until interrupted"""
+    verify_token = VERIFY_TOKEN
+    if not verify_token:
+        verify_token = secrets.token_urlsafe(16)
+        print(f"[!] ACTIVEXPORT_WEBHOOK_VERIFY_TOKEN not set, using a one-off token: {verify_token}")
+
+    queue = EventQueue()
+    pending = queue.open()
+    athlete_id = get_athlete_id()
+    server = WebhookServer((args.host, args.port), queue, verify_token,
+                           athlete_id=None if athlete_id == 'default' else athlete_id,
+                           subscription_id=args.subscription_id)
+    enable_metrics(args.metrics)
+
+    print("\n" + "="*60)
+    print("ACTIVEXPORT WEBHOOK RECEIVER")
+    print("="*60 + "\n")
+    print(f"[OK] Listening on http://{args.host}:{args.port}{WEBHOOK_PATH}")
+    print(f"[OK] Store: {args.store}")
+    if pending:
+        print(f"[OK] {pending} events left by the previous run, applying them first")
+
+    streams_dir = STREAMS_DIR if args.streams else None
+    worker = threading.Thread(target=process_events, daemon=True,
+                              args=(queue, args.store, streams_dir, args.metrics))
+    worker.start()
+
+    if args.subscribe:
+        def subscribe():
+            try:
+                subscription_id = create_subscription(args.subscribe, verify_token)
+                print(f"[OK] Subscribed (ID {subscription_id}): {args.subscribe}")
+            except requests.exceptions.RequestException as e:
+                print(f"[X] Subscription failed: {e}")
+        threading.Thread(target=subscribe, daemon=True).start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n[OK] Stopped ({queue.received} events received, {queue.coalesced} coalesced, "
+              f"{len(queue)} pending)")
+    finally:
+        server.server_close()
+
+
+def load_events(filepath):
+    """Reads events from a JSON array or NDJSON file ('-' for stdin)"""
+    if filepath == '-':
+        content = sys.stdin.read()
+    else:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+    if content.lstrip().startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def make_event(spec, owner_id, subscription_id=None):
+    """Builds an event from 'aspect:activity_id' (e.g. 'create:1234567890')"""
+    aspect, _, activity_id = spec.partition(':')
+    return {
+        'object_type': 'activity',
+        'object_id': int(activity_id),
+        'aspect_type': aspect,
+        'updates': {},
+        'owner_id': int(owner_id) if str(owner_id).isdigit() else owner_id,
+        'subscription_id': int(subscription_id or 0),
+        'event_time': int(time.time()),
+    }
+
+
+def replay_events(url, events, verify_token, delay=0.0):
+    """
+    Checks the receiver's handshake, then posts events to it as Strava would,
+    flagging any answer that is not a 200 within Strava's deadline
+    Returns the number of events accepted
+    """
+    session = get_session()
+    challenge = secrets.token_hex(8)
+    response = session.get(url, params={'hub.mode': 'subscribe', 'hub.challenge': challenge,
+                                        'hub.verify_token': verify_token}, timeout=10)
+    if response.status_code == 200 and response.json().get('hub.challenge') == challenge:
+        print(f"[OK] Handshake validated by {url}")
+    else:
+        print(f"[X] Handshake failed: HTTP {response.status_code}")
+
+    accepted = 0
+    for i, event in enumerate(events, 1):
+        start = time.perf_counter()
+        response = session.post(url, json=event, timeout=10)
+        elapsed = time.perf_counter() - start
+        label = f"{event.get('aspect_type')} {event.get('object_type')} {event.get('object_id')}"
+        if response.status_code != 200:
+            print(f"[X] [{i}/{len(events)}] {label}: HTTP {response.status_code}")
+        elif elapsed > RESPONSE_DEADLINE:
+            print(f"[!] [{i}/{len(events)}] {label}: answered in {elapsed:.2f}s (Strava would retry)")
+            accepted += 1
+        else:
+            print(f"[OK] [{i}/{len(events)}] {label} ({elapsed * 1000:.0f} ms)")
+            accepted += 1
+        if delay:
+            time.sleep(delay)
+
+    print(f"\n[OK] {accepted}/{len(events)} events accepted")
+    return accepted
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Receive Strava webhook events and apply them to the local store',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python activexport_webhook.py                                # Receiver on localhost:8020
+  python activexport_webhook.py --host 0.0.0.0 --streams       # Also download streams of new activities
+  python activexport_webhook.py --subscribe https://example.com/webhook
+  python activexport_webhook.py --list-subscriptions
+  python activexport_webhook.py --unsubscribe 123456
+
+Replay events to a running receiver (local testing):
+  python activexport_webhook.py --replay events.ndjson --url http://localhost:8020/webhook
+  python activexport_webhook.py --event create:10000000042 --event delete:10000000007
+        """
+    )
+
+    parser.add_argument('--host', type=str, default='localhost',
+                        help='Interface to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--store', type=str, default=STORE_FILE,
+                        help=f'Local store to update (default: {STORE_FILE})')
+    parser.add_argument('--streams', action='store_true',
+                        help=f'Also download the streams of created activities (into {STREAMS_DIR}/)')
+    parser.add_argument('--subscription-id', type=str,
+                        help='Only accept events of this subscription')
+    parser.add_argument('--metrics', type=str, action='append',
+                        help='Write run metrics to FILE whenever the queue is drained '
+                             '(.prom: Prometheus text, otherwise JSON), repeatable')
+
+    subscriptions = parser.add_argument_group('subscription management')
+    subscriptions.add_argument('--subscribe', type=str, metavar='CALLBACK_URL',
+                               help='Start the receiver and register its public URL with Strava')
+    subscriptions.add_argument('--list-subscriptions', action='store_true',
+                               help='Show the push subscription of the application')
+    subscriptions.add_argument('--unsubscribe', type=int, metavar='ID',
+                               help='Delete a push subscription')
+
+    replay = parser.add_argument_group('event replayer')
+    replay.add_argument('--replay', type=str, metavar='FILE',
+                        help="Post the events of a JSON/NDJSON file ('-' for stdin) to --url")
+    replay.add_argument('--event', type=str, action='append', metavar='ASPECT:ID',
+                        help='Post an activity event, e.g. create:1234567890 (repeatable)')
+    replay.add_argument('--url', type=str, default=f'http://localhost:{DEFAULT_PORT}{WEBHOOK_PATH}',
+                        help=f'Receiver URL (default: http://localhost:{DEFAULT_PORT}{WEBHOOK_PATH})')
+    replay.add_argument('--owner', type=str,
+                        help='owner_id of --event events (default: authenticated athlete)')
+    replay.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds between replayed events (default: 0)')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    args = parse_arguments()
+
+    try:
+        if args.list_subscriptions:
+            subscriptions = list_subscriptions()
+            if not subscriptions:
+                print("No push subscription")
+            for subscription in subscriptions:
+                print(f"[{subscription['id']}] {subscription['callback_url']} "
+                      f"(created {subscription.get('created_at', 'N/A')})")
+        elif args.unsubscribe:
+            delete_subscription(args.unsubscribe)
+            print(f"[OK] Subscription {args.unsubscribe} deleted")
+        elif args.replay or args.event:
+            events = load_events(args.replay) if args.replay else []
+            owner_id = args.owner or get_athlete_id()
+            events += [make_event(spec, owner_id, args.subscription_id) for spec in args.event or []]
+            if replay_events(args.url, events, VERIFY_TOKEN or '', args.delay) < len(events):
+                sys.exit(1)
+        else:
+            run_receiver(args)
+    except requests.exceptions.RequestException as e:
+        print(f"[X] Error: {e}")
+        sys.exit(1)